@@ -0,0 +1,204 @@
+# Running totals of expenses per category, per month and per month and category
+import numpy as np
+import storage
+from columns import ExpenseColumns
+
+# Name of the document the aggregates are saved in, next to the expenses
+AGGREGATES_DOCUMENT = "aggregates"
+
+# Totals that are updated one expense at a time instead of being recomputed from every expense
+class ExpenseAggregates:
+    def __init__(self):
+        self.total = 0.0
+        self.count = 0
+        self.by_category = {}  # category -> [amount, count]
+        self.by_month = {}  # "YYYY-MM" -> [amount, count]
+        self.by_month_category = {}  # "YYYY-MM" -> {category -> [amount, count]}
+
+    # Add (sign=1) or remove (sign=-1) one expense, entries without expenses left are dropped
+    def apply(self, amount, category, expense_date, sign=1):
+        month = str(expense_date)[:7]
+        self.total += sign * amount
+        self.count += sign
+        update_entry(self.by_category, category, amount, sign)
+        update_entry(self.by_month, month, amount, sign)
+        update_entry(self.by_month_category.setdefault(month, {}), category, amount, sign)
+        if not self.by_month_category[month]:
+            del self.by_month_category[month]
+
+    def add(self, expense):
+        self.apply(expense["amount"], expense["category"], expense["date"], 1)
+
+    def remove(self, expense):
+        self.apply(expense["amount"], expense["category"], expense["date"], -1)
+
+    # Take out the old version of every changed expense and add the new one
+    def apply_delta(self, delta):
+        for expense in delta.deleted:
+            self.remove(expense)
+        for old, new in delta.updated:
+            self.remove(old)
+            self.add(new)
+        for expense in delta.inserted:
+            self.add(expense)
+
+    # Read-only views in the shape the pages use
+    def totals_by_category(self):
+        return {category: entry[0] for category, entry in self.by_category.items()}
+
+    def totals_by_month(self):
+        return {month: entry[0] for month, entry in sorted(self.by_month.items())}
+
+    def month_total(self, month):
+        return self.by_month.get(month, [0.0, 0])[0]
+
+    def month_totals_by_category(self, month):
+        return {category: entry[0] for category, entry in self.by_month_category.get(month, {}).items()}
+
+    # Build the aggregates from scratch out of ExpenseColumns, grouping is done with NumPy
+    @classmethod
+    def from_columns(cls, columns):
+        aggregates = cls()
+        if not len(columns):
+            return aggregates
+        months = columns.days.astype("datetime64[D]").astype("datetime64[M]")
+        month_keys, month_index = np.unique(months, return_inverse=True)
+        month_names = month_keys.astype(str)
+        category_count = max(len(columns.categories), 1)
+        pair_index = month_index * category_count + columns.codes
+        pair_sums = np.bincount(pair_index, weights=columns.amounts, minlength=len(month_keys) * category_count)
+        pair_counts = np.bincount(pair_index, minlength=len(month_keys) * category_count)
+        for pair in np.flatnonzero(pair_counts):
+            month = str(month_names[pair // category_count])
+            category = columns.categories[pair % category_count]
+            amount, count = float(pair_sums[pair]), int(pair_counts[pair])
+            aggregates.by_month_category.setdefault(month, {})[category] = [amount, count]
+            add_entry(aggregates.by_category, category, amount, count)
+            add_entry(aggregates.by_month, month, amount, count)
+        aggregates.total = float(columns.amounts.sum())
+        aggregates.count = len(columns)
+        return aggregates
+
+    # Saved form, a plain JSON document that shares nothing with these aggregates
+    def to_dict(self):
+        return {
+            "total": self.total,
+            "count": self.count,
+            "by_category": copy_entries(self.by_category),
+            "by_month": copy_entries(self.by_month),
+            "by_month_category": {month: copy_entries(entries) for month, entries in self.by_month_category.items()},
+        }
+
+    # Loaded documents may be shared through the cache, so the nested entries are copied
+    @classmethod
+    def from_dict(cls, data):
+        aggregates = cls()
+        aggregates.total = data.get("total", 0.0)
+        aggregates.count = data.get("count", 0)
+        aggregates.by_category = copy_entries(data.get("by_category", {}))
+        aggregates.by_month = copy_entries(data.get("by_month", {}))
+        aggregates.by_month_category = {
+            month: copy_entries(entries) for month, entries in data.get("by_month_category", {}).items()
+        }
+        return aggregates
+
+    # Differences against other aggregates, amounts are compared with a small relative tolerance
+    # because running float sums drift a little from sums computed in one go
+    def differences(self, other, tolerance=1e-9):
+        problems = []
+        if self.count != other.count or not close(self.total, other.total, tolerance):
+            problems.append(("total", (self.total, self.count), (other.total, other.count)))
+        for name in ("by_category", "by_month"):
+            problems.extend(entry_differences(name, getattr(self, name), getattr(other, name), tolerance))
+        for month in set(self.by_month_category) | set(other.by_month_category):
+            problems.extend(entry_differences(
+                "by_month_category " + month,
+                self.by_month_category.get(month, {}),
+                other.by_month_category.get(month, {}),
+                tolerance,
+            ))
+        return problems
+
+
+# Copy a dict of [amount, count] entries
+def copy_entries(entries):
+    return {key: list(entry) for key, entry in entries.items()}
+
+# Change an [amount, count] entry and drop it once it has no expenses left
+def update_entry(entries, key, amount, sign):
+    entry = entries.setdefault(key, [0.0, 0])
+    entry[0] += sign * amount
+    entry[1] += sign
+    if entry[1] <= 0:
+        del entries[key]
+
+def add_entry(entries, key, amount, count):
+    entry = entries.setdefault(key, [0.0, 0])
+    entry[0] += amount
+    entry[1] += count
+
+def close(a, b, tolerance):
+    return abs(a - b) <= tolerance * max(1.0, abs(a), abs(b))
+
+def entry_differences(name, mine, theirs, tolerance):
+    problems = []
+    for key in set(mine) | set(theirs):
+        a, b = mine.get(key, [0.0, 0]), theirs.get(key, [0.0, 0])
+        if a[1] != b[1] or not close(a[0], b[0], tolerance):
+            problems.append((name + " " + key, a, b))
+    return problems
+
+
+# Save aggregates next to the expenses
+def save_aggregates(aggregates, backend=None):
+    (backend or storage.get_backend()).save_document(AGGREGATES_DOCUMENT, aggregates.to_dict())
+
+# Apply a delta to the latest saved aggregates. Called from commit_delta's on_commit, under the
+# same write lock as the expenses, so a rebuild can never see the expense without its totals or
+# count it twice. current is used when nothing is saved yet
+def apply_delta(delta, backend=None, current=None):
+    backend = backend or storage.get_backend()
+    data = backend.load_document(AGGREGATES_DOCUMENT, None)
+    totals = ExpenseAggregates.from_dict(data if data is not None else (current or ExpenseAggregates()).to_dict())
+    totals.apply_delta(delta)
+    backend.write_document(AGGREGATES_DOCUMENT, totals.to_dict())
+    return totals
+
+# Load the saved aggregates, building them from the expenses the first time
+def load_aggregates(backend=None):
+    backend = backend or storage.get_backend()
+    data = backend.load_document(AGGREGATES_DOCUMENT, None)
+    if data is None:
+        return rebuild_aggregates(backend)
+    return ExpenseAggregates.from_dict(data)
+
+# Recompute the aggregates from the raw expenses and save them. This happens under the write lock
+# so no expense can be saved in between, load_columns() gives the expenses as ExpenseColumns.
+# With only_if_stale the saved aggregates are kept when they cover every expense after all
+def rebuild_aggregates(backend=None, load_columns=None, only_if_stale=False):
+    backend = backend or storage.get_backend()
+    load_columns = load_columns or backend.load_columns
+
+    def rebuild(data):
+        if only_if_stale and data is not None and data.get("count") == backend.count_expenses():
+            return data
+        return ExpenseAggregates.from_columns(load_columns()).to_dict()
+
+    return ExpenseAggregates.from_dict(backend.update_document(AGGREGATES_DOCUMENT, None, rebuild))
+
+# Compare the saved aggregates with the raw expenses, rebuilding them if they disagree
+def check_aggregates(backend=None, repair=True):
+    backend = backend or storage.get_backend()
+    expected = ExpenseAggregates.from_columns(ExpenseColumns.from_records(backend.load_expenses()))
+    problems = load_aggregates(backend).differences(expected)
+    if problems and repair:
+        save_aggregates(expected, backend)
+    return problems
+
+
+# Run "python aggregates.py" to check the saved aggregates against the expenses
+if __name__ == "__main__":
+    problems = check_aggregates()
+    for name, saved, actual in problems:
+        print(f"{name}: saved {saved}, actual {actual}")
+    print("Aggregates rebuilt." if problems else "Aggregates are consistent.")
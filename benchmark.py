@@ -0,0 +1,226 @@
+# Benchmarks of the expense manager and the pages' data work on a large synthetic history.
+# Runs headless (page functions are called without a Streamlit server) and writes the results
+# as JSON, so runs from two commits can be compared with --compare
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date
+
+import cache
+import charts
+import storage
+import synthetic
+import writebehind
+
+# Defaults for the command line options
+OPTIONS = {"years": 5, "per_month": 3000, "goals": 2000, "repeat": 5, "backend": "json", "data": None, "output": None}
+
+# A benchmark whose median got this much slower, and by more than NOISE_MS, is reported as a
+# regression by --compare
+REGRESSION_THRESHOLD = 0.10
+NOISE_MS = 0.1
+
+
+# Page functions write to Streamlit; without a server that only logs warnings, which are
+# filtered out (Streamlit resets its log levels when it reads its config, filters stay)
+STREAMLIT_LOGGERS = ("streamlit.runtime.scriptrunner_utils.script_run_context", "root")  # "root" is Streamlit's top logger
+
+def quiet_streamlit():
+    import streamlit.logger
+    for name in STREAMLIT_LOGGERS:
+        streamlit.logger.get_logger(name).addFilter(lambda record: record.levelno >= logging.ERROR)
+
+# Each sample of a fast benchmark runs it in a loop for at least this long, like timeit
+SAMPLE_SECONDS = 0.02
+
+# Run timed() `repeat` times, returns the time of one call in milliseconds for each run. With a
+# setup, setup() runs untimed before every call and its result is passed to timed
+def measure(timed, setup=None, repeat=5):
+    if setup is not None:
+        timings = []
+        for _ in range(repeat):
+            argument = setup()
+            started = time.perf_counter()
+            timed(argument)
+            timings.append((time.perf_counter() - started) * 1000)
+        return timings
+    started = time.perf_counter()
+    timed()
+    number = max(1, int(SAMPLE_SECONDS / max(time.perf_counter() - started, 1e-9)))
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(number):
+            timed()
+        timings.append((time.perf_counter() - started) * 1000 / number)
+    return timings
+
+def summarize(timings):
+    return {
+        "min_ms": min(timings),
+        "median_ms": statistics.median(timings),
+        "mean_ms": statistics.fmean(timings),
+        "runs": len(timings),
+    }
+
+# Every benchmark as (name, timed, setup). Cold ones clear the process cache first, the way the
+# first session after a start sees it
+def benchmarks():
+    from expenses import ExpenseManager
+    import budget
+    import dashboard
+    import forecast
+    import goalprogress
+    import ledger
+    import rollups
+    import savings
+    import visualization
+
+    month = storage.current_month()
+    manager = ExpenseManager()
+    some_category = manager.categories[0]
+    forecast_inputs = forecast.forecast_inputs()
+
+    def cold_manager():
+        cache.clear()
+
+    def cold_charts():
+        charts.clear()
+
+    # What the add expense form does on submit, saved before it returns unless the queue runs
+    def submit_form():
+        manager.add_expense(12.5, manager.add_category(some_category), date.today())
+
+    def idle_queue():
+        writebehind.start()
+        writebehind.flush()
+
+    def queued_form():
+        idle_queue()
+        submit_form()
+
+    return [
+        ("manager_load_cold", lambda _: ExpenseManager().expenses, cold_manager),
+        ("manager_load_warm", lambda: ExpenseManager().expenses, None),
+        ("manager_open_without_expenses", lambda: ExpenseManager(), None),
+        ("add_expense", lambda: manager.add_expense(12.5, some_category, date.today()), None),
+        ("filter_by_category", lambda: manager.filter_by_category(some_category), None),
+        ("category_lookup", lambda: manager.find_category(some_category.upper()), None),
+        ("filter_by_date", lambda: manager.filter_by_date(date.today().isoformat()), None),
+        ("expenses_this_month", lambda: ExpenseManager().expenses_between(month + "-01", month + "-31"), None),
+        ("browse_page_by_amount", lambda: manager.expenses.page_positions(
+            manager.expenses.matching(some_category), "amount", True, 3, 100), None),
+        ("total_and_by_category", lambda: (manager.total_expenses(), manager.expenses_by_category()), None),
+        ("aggregates_rebuild", lambda: __import__("aggregates").ExpenseAggregates.from_columns(manager.expenses), None),
+        ("rollups_load", rollups.load_rollups, None),
+        ("rollups_rebuild", lambda: rollups.Rollups.from_columns(manager.expenses), None),
+        ("dashboard", dashboard.display_dashboard, None),
+        ("budget_progress_bars", budget.show_progress_bars, None),
+        ("spending_visualizations_cold", lambda _: visualization.spending_visualizations(), cold_charts),
+        ("spending_visualizations_warm", visualization.spending_visualizations, None),
+        ("insights_visualizations", visualization.insights_visualizations, None),
+        ("goal_progress_load", goalprogress.load_progress, None),
+        ("goal_progress_rebuild", lambda: goalprogress.refresh_progress(rebuild=True), None),
+        ("goal_lookup_one_day", lambda: goalprogress.goal_index().savings.containing(date.today()), None),
+        ("forecast_inputs", forecast.forecast_inputs, None),
+        ("forecast_simulate", lambda: forecast.run_forecast(forecast_inputs, seed=1), None),
+        ("savings_history", savings.get_savings_history, None),
+        ("savings_saved_this_month", lambda: ledger.load_ledger().change_between(month + "-01", month + "-31"), None),
+        ("savings_chart_cold", lambda _: savings.display_charts(), cold_charts),
+        ("savings_chart_warm", savings.display_charts, None),
+        # Last, the write-behind queue keeps running once started
+        ("add_expense_form_sync", submit_form, None),
+        ("add_expense_form_write_behind", lambda _: submit_form(), idle_queue),
+        ("write_behind_flush", lambda _: writebehind.flush(), queued_form),
+    ]
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+# Generate the data (unless a data folder is given), run every benchmark and return the results.
+# Pages read the "data" folder of the working directory, so the run happens in a temporary one
+def run(years=5, per_month=3000, repeat=5, backend="json", data=None, goals=2000):
+    quiet_streamlit()
+    os.environ[storage.BACKEND_ENV] = backend
+    work_dir = tempfile.mkdtemp(prefix="expensetracker-benchmark-")
+    previous_dir = os.getcwd()
+    try:
+        data_dir = os.path.join(work_dir, storage.DATA_DIR)
+        started = time.perf_counter()
+        if data:
+            shutil.copytree(data, data_dir)
+        else:
+            synthetic.generate_user(data_dir, years=years, per_month=per_month, goals=goals, backend=backend)
+        generate_seconds = time.perf_counter() - started
+        os.chdir(work_dir)
+        expenses = storage.get_backend().count_expenses()
+        results = {}
+        for name, timed, setup in benchmarks():
+            results[name] = summarize(measure(timed, setup, repeat))
+        return {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "backend": backend,
+            "expenses": expenses,
+            "generate_seconds": generate_seconds,
+            "results": results,
+        }
+    finally:
+        writebehind.stop()
+        os.chdir(previous_dir)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+# Median of every benchmark in two result files, and the ones that got slower than the threshold
+def compare(old, new, threshold=REGRESSION_THRESHOLD):
+    rows = []
+    for name in new["results"]:
+        if name not in old["results"]:
+            continue
+        before, after = old["results"][name]["median_ms"], new["results"][name]["median_ms"]
+        change = (after - before) / before if before else 0.0
+        rows.append((name, before, after, change, change > threshold and after - before > NOISE_MS))
+    return rows
+
+
+# Run "python benchmark.py [--years 5] [--per-month 3000] [--goals 2000] [--repeat 5] [--backend json|sqlite] [--data DIR]
+# [--output results.json]" or "python benchmark.py --compare OLD.json NEW.json"
+if __name__ == "__main__":
+    arguments = sys.argv[1:]
+    if arguments[:1] == ["--compare"]:
+        with open(arguments[1]) as file:
+            old = json.load(file)
+        with open(arguments[2]) as file:
+            new = json.load(file)
+        regressions = 0
+        if old["expenses"] != new["expenses"] or old["backend"] != new["backend"]:
+            print(f"Warning: comparing {old['expenses']} {old['backend']} expenses with {new['expenses']} {new['backend']} expenses.")
+        print(f"{'benchmark':32} {old['commit'] or 'old':>10} {new['commit'] or 'new':>10}  change")
+        for name, before, after, change, regressed in compare(old, new):
+            regressions += regressed
+            print(f"{name:32} {before:9.2f}ms {after:9.2f}ms  {change:+7.1%}{'  REGRESSION' if regressed else ''}")
+        sys.exit(1 if regressions else 0)
+    options = dict(OPTIONS)
+    while arguments:
+        flag, value = arguments.pop(0).lstrip("-").replace("-", "_"), arguments.pop(0)
+        options[flag] = value if flag in ("backend", "data", "output") else int(value)
+    result = run(options["years"], options["per_month"], options["repeat"], options["backend"], options["data"], options["goals"])
+    text = json.dumps(result, indent=2)
+    if options["output"]:
+        with open(options["output"], "w") as file:
+            file.write(text + "\n")
+    else:
+        print(text)
+    for name, summary in result["results"].items():
+        print(f"{name:32} median {summary['median_ms']:9.2f} ms  min {summary['min_ms']:9.2f} ms", file=sys.stderr)
@@ -1,34 +1,25 @@
 # Manage monthly/weekly budget and track spending
 import streamlit as st
-import json
+from datetime import date
+import instrument
+import storage
+from aggregates import load_aggregates
+from writes import WriteConflict
 import pandas as pd
 from streamlit_option_menu import option_menu
-import matplotlib.pyplot as plt
-
-# File paths
-CATEGORY_FILE = "data/expensecatagories.json"
-EXPENSES_FILE = "data/expenses.json"
-SAVINGS_FILE = "data/savings.json"
-GOALS_FILE = "data/goals.json"
-
-# Helper function: Load data from a file or return a default
-def load_data(file_path, default):
-    try:
-        with open(file_path, "r") as file:
-            return json.load(file)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return default
-
-# Helper function: Save data to a file
-def save_data(file_path, data):
-    with open(file_path, "w") as file:
-        json.dump(data, file, indent=4)
+import charts
+import goalprogress
+import ledger
+import monthclose
+import reports
+import writebehind
 
 # Load budget categories or use default ones
 def load_categories():
-    return load_data(CATEGORY_FILE, ["Food", "Transport", "Entertainment", "Other"])
+    return storage.get_backend().load_categories()
 
 # Main budget page
+@instrument.timed()
 def display_budget():
     st.title("💰 Budget Mastery")
     st.write("Manage your budget, spending, and savings all in one place.")
@@ -54,21 +45,20 @@ def display_budget():
         visualize_budget()
 
 # Show progress bars for expenses vs budget and savings vs goals
+@instrument.timed()
 def show_progress_bars():
     st.subheader("📊 Progress Overview")
 
     # Load data
-    savings = load_data(SAVINGS_FILE, {"total_savings": 0, "history": []})
-    total_savings = savings.get("total_savings", 0)
-    expenses = load_data(EXPENSES_FILE, [])
-    total_expenses = sum(exp["amount"] for exp in expenses)
-    category_budget = load_data(SAVINGS_FILE, {}).get("category_budget", {})
-    goals = load_data(GOALS_FILE, [])
+    backend = storage.get_backend()
+    total_expenses = load_aggregates(backend).month_total(storage.current_month())  # The budget is per month
+    category_budget = backend.load_document("savings", {}).get("category_budget", {})
+    progress = goalprogress.load_progress(backend)
 
     # Budget progress
     total_budget = sum(category_budget.values())
     if total_budget > 0:
-        st.write(f"**Expenses vs Budget**: {total_expenses} / {total_budget}")
+        st.write(f"**Expenses this month vs Budget**: {total_expenses} / {total_budget}")
         st.progress(min(total_expenses / total_budget, 1.0))
         if total_expenses > total_budget:
             st.error("Uh-oh! You've gone over your budget. Time to cut back!")
@@ -77,16 +67,22 @@ def show_progress_bars():
     else:
         st.info("No budget set yet. Start budgeting to track your spending.")
 
-    # Savings goal progress
-    st.subheader("Savings Goals")
-    if goals:
-        for goal in goals:
-            target = goal.get("target", 0)
-            progress = min(total_savings / target, 1.0) if target > 0 else 0
-            st.write(f"**{goal.get('name', 'Unnamed Goal')}**: {total_savings} saved, {max(target - total_savings, 0)} remaining")
-            st.progress(progress)
+    # Progress of the goals running today, each goal counts only what happened between its dates
+    st.subheader("Goals")
+    active = progress.index.active(date.today())
+    if active:
+        for goal_id in active:
+            goal = progress.index.goals[goal_id]
+            value, target, fraction = progress.status(goal_id)
+            if goalprogress.goal_type(goal) == goalprogress.SPEND_LESS:
+                st.write(f"**{goal.get('name', 'Unnamed Goal')}**: {value:.2f} spent on {goal.get('category')}, {max(target - value, 0):.2f} left to spend")
+                if value > target:
+                    st.error(f"You've spent more than you planned on {goal.get('category')}.")
+            else:
+                st.write(f"**{goal.get('name', 'Unnamed Goal')}**: {value:.2f} saved, {max(target - value, 0):.2f} remaining")
+            st.progress(fraction)
     else:
-        st.info("No savings goals yet. Set some in the Goals tab!")
+        st.info("No goals running right now. Set some in the Goals tab!")
 
 # Input total income
 def start_budgeting():
@@ -97,6 +93,7 @@ def start_budgeting():
     return income
 
 # Allocate income to budget categories
+@instrument.timed()
 def allocate_budget(income):
     st.subheader("Allocate Your Budget")
     categories = load_categories()
@@ -114,47 +111,72 @@ def allocate_budget(income):
         st.error("Yikes! You're trying to spend more than you earn. Adjust your budget.")
     else:
         st.success(f"Allocated: {total_allocated}. Remaining: {remaining}.")
-        save_data(SAVINGS_FILE, {"category_budget": category_budget, "remaining_budget": remaining})
+        # Every rerun shows the same budget, it is only saved when it changed
+        month_budget = {"category_budget": category_budget, "remaining_budget": remaining}
+        month = storage.current_month()
+        if storage.get_backend().load_document("savings", {}).get(monthclose.BUDGETS, {}).get(month) != month_budget:
+            writebehind.submit("set_budget", {"month": month, "budget": month_budget})
+
+# Write-behind handler (see writebehind.py) for budgets set on the page, only the last one set is
+# saved. It is kept per month too, so each month is closed with the budget it was planned with
+def save_budgets(backend, batch):
+    month, month_budget = batch[-1]["month"], batch[-1]["budget"]
+    backend.update_document("savings", {}, lambda savings: {
+        **savings, **month_budget, monthclose.BUDGETS: {**savings.get(monthclose.BUDGETS, {}), month: month_budget},
+    })
 
 # Reset budget and move leftover funds to savings
+@instrument.timed()
 def reset_budget():
     st.subheader("Reset Budget")
-    savings = load_data(SAVINGS_FILE, {"total_savings": 0, "remaining_budget": 0})
+    backend = storage.get_backend()
+    version = backend.document_version("savings")
+    savings = backend.load_document("savings", {"total_savings": 0, "remaining_budget": 0})
     remaining_budget = savings.get("remaining_budget", 0)
+    # The amount moved must be the one that was shown, so the version shown before the click is checked
+    shown_version = st.session_state.get("reset_budget_version", version)
+    st.session_state["reset_budget_version"] = version
+
+    closed = savings.get(monthclose.CLOSED_MONTHS, {})
+    if closed:
+        last = max(closed)
+        st.caption(f"What's left of each month's budget goes to savings when the month is over. {last} added {closed[last]:.2f}.")
 
     if st.button("Reset Now"):
-        savings["total_savings"] += remaining_budget
-        savings["remaining_budget"] = 0
-        save_data(SAVINGS_FILE, savings)
-        st.success(f"Remaining {remaining_budget} moved to savings!")
+        try:
+            backend.update_document("savings", {"total_savings": 0, "remaining_budget": 0}, monthclose.reset, shown_version)
+        except WriteConflict:
+            st.warning("Your budget was changed in another window. Check the remaining amount and try again.")
+        else:
+            st.success(f"Remaining {remaining_budget} moved to savings!")
+
+# Bars of the budget and the amount spent per category, drawn by charts.show
+def draw_budget_vs_spent(figure, data):
+    ax = figure.subplots()
+    ax.bar(data["categories"], data["allocated"], label="Budget Allocated", alpha=0.7)
+    ax.bar(data["categories"], data["spent"], label="Amount Spent", alpha=0.7)
+    ax.legend()
 
 # Visualize budget and savings
+@instrument.timed()
 def visualize_budget():
     st.subheader("📊 Visualize Spending and Savings")
 
-    expenses = load_data(EXPENSES_FILE, [])
-    savings = load_data(SAVINGS_FILE, {"total_savings": 0, "history": []})
-    category_budget = load_data(SAVINGS_FILE, {}).get("category_budget", {})
+    backend = storage.get_backend()
+    savings = backend.load_document("savings", {"total_savings": 0})
 
     # Bar chart: Spending vs Budget
-    st.write("### Spending vs Budget")
-    category_expenses = pd.DataFrame(expenses).groupby("category")["amount"].sum().to_dict()
-    categories = list(category_budget.keys())
-    allocated = [category_budget.get(cat, 0) for cat in categories]
-    spent = [category_expenses.get(cat, 0) for cat in categories]
-
-    fig, ax = plt.subplots()
-    ax.bar(categories, allocated, label="Budget Allocated", alpha=0.7)
-    ax.bar(categories, spent, label="Amount Spent", alpha=0.7)
-    ax.legend()
-    st.pyplot(fig)
+    st.write("### Spending this month vs Budget")
+    rows = reports.budget_vs_actual(savings, load_aggregates(backend).month_totals_by_category(storage.current_month()))
+    data = {"categories": [row["category"] for row in rows], "allocated": [row["budget"] for row in rows], "spent": [row["spent"] for row in rows]}
+
+    charts.show("budget_vs_spent", data, draw_budget_vs_spent)
 
     # Line chart: Savings over time
     st.write("### Savings Over Time")
-    savings_history = savings.get("history", [])
+    savings_history = ledger.ledger_of(savings).history()
     if savings_history:
-        dates = [entry["date"] for entry in savings_history]
-        amounts = [entry["amount"] for entry in savings_history]
+        dates, amounts = charts.downsample([day for day, _ in savings_history], [amount for _, amount in savings_history])
         st.line_chart(pd.DataFrame({"Date": dates, "Savings": amounts}).set_index("Date"))
     else:
         st.info("No savings history yet. Start saving to see trends!")
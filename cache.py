@@ -0,0 +1,133 @@
+# Process-wide cache of parsed data so every page and tab in a rerun shares one copy. Each entry's
+# memory is estimated when it is stored, so the cache can report how much it holds and drop the
+# entries of one data folder (see tenants.py)
+import os
+import sys
+import threading
+
+# Cached values are shared between sessions, callers must treat them as read-only
+_lock = threading.Lock()
+_entries = {}  # key -> (version, value)
+_sizes = {}  # key -> estimated bytes of the cached value
+_write_counters = {}  # key -> number of writes made through this process
+_stats = {"hits": 0, "misses": 0, "invalidations": 0, "bytes": 0, "dropped": 0}
+
+# Items of a long list or dict looked at to estimate its size, the rest are assumed alike
+SIZE_SAMPLE = 8
+
+# Rough memory use of a value: NumPy arrays by their buffers, objects by their attributes and long
+# containers from a sample of their items
+def size_of(value, depth=4):
+    if hasattr(value, "nbytes"):
+        return int(value.nbytes)
+    size = sys.getsizeof(value)
+    if depth == 0 or isinstance(value, (str, bytes, int, float, bool)) or value is None:
+        return size
+    if isinstance(value, dict):
+        items = list(value.items())[:SIZE_SAMPLE]
+        sampled = sum(size_of(key, depth - 1) + size_of(item, depth - 1) for key, item in items)
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        items = list(value)[:SIZE_SAMPLE] if not isinstance(value, (list, tuple)) else value[:SIZE_SAMPLE]
+        sampled = sum(size_of(item, depth - 1) for item in items)
+    elif hasattr(value, "__dict__"):
+        return size + size_of(vars(value), depth - 1)
+    else:
+        return size
+    return size + (sampled * len(value) // len(items) if items else 0)
+
+# Store an entry of a known size, called with _lock held
+def _store(key, version, value, size):
+    _entries[key] = (version, value)
+    _stats["bytes"] += size - _sizes.get(key, 0)
+    _sizes[key] = size
+
+# Remove an entry, called with _lock held. Returns whether there was one
+def _remove(key):
+    _stats["bytes"] -= _sizes.pop(key, 0)
+    return _entries.pop(key, None) is not None
+
+# Size and modification time of a file, or None when it doesn't exist
+def file_version(file_path):
+    try:
+        status = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    return (status.st_mtime_ns, status.st_size)
+
+# Version of a key: the write counter plus the state of the files it is read from
+def version_of(key, *file_paths):
+    return (_write_counters.get(key, 0),) + tuple(file_version(path) for path in file_paths)
+
+# Return the cached value for key if it was stored under this version, else load and store it
+def get(key, version, loader):
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None and entry[0] == version:
+            _stats["hits"] += 1
+            return entry[1]
+        _stats["misses"] += 1
+    value = loader()
+    size = size_of(value)
+    with _lock:
+        _store(key, version, value, size)
+    return value
+
+# Return the cached value only if it matches the version, without counting a hit or miss
+def peek(key, version):
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+        return None
+
+# Store a value that a writer already has in memory, e.g. right after saving it
+def put(key, version, value):
+    size = size_of(value)
+    with _lock:
+        _store(key, version, value, size)
+
+# Record a write to key and drop its cached value
+def invalidate(key):
+    with _lock:
+        _write_counters[key] = _write_counters.get(key, 0) + 1
+        if _remove(key):
+            _stats["invalidations"] += 1
+
+# Forget every cached value, the counters are kept
+def clear():
+    with _lock:
+        _entries.clear()
+        _sizes.clear()
+        _stats["bytes"] = 0
+
+# Data folders in use, so dropping one folder can leave the data folders nested in it alone
+_folders = set()
+
+def add_folder(directory):
+    with _lock:
+        _folders.add(os.path.join(os.path.abspath(directory), ""))
+
+# Forget the cached values read from files in a folder, keys name the files they come from. Files
+# of the data folders nested in it (data/users/<name> in data) are left. Returns the estimated
+# bytes freed
+def drop_under(directory):
+    prefix = os.path.join(os.path.abspath(directory), "")
+    freed = 0
+    with _lock:
+        nested = tuple(folder for folder in _folders if folder != prefix and folder.startswith(prefix))
+
+        def under(part):
+            return isinstance(part, str) and part.startswith(prefix) and not part.startswith(nested)
+
+        for key in [key for key in _entries if any(under(part) for part in key)]:
+            freed += _sizes.get(key, 0)
+            _remove(key)
+            _stats["dropped"] += 1
+    return freed
+
+# Hit/miss counters and the number of cached entries
+def stats():
+    with _lock:
+        lookups = _stats["hits"] + _stats["misses"]
+        hit_rate = _stats["hits"] / lookups if lookups else 0.0
+        return dict(_stats, entries=len(_entries), hit_rate=hit_rate)
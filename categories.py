@@ -0,0 +1,117 @@
+# Registry of expense categories. Every category has a small integer id, which is what expense
+# records store instead of the full name, and names are looked up case-folded with surrounding
+# and repeated whitespace ignored, so "Hello", "hello" and " hello " are the same category.
+# A category can be merged into another one: its id and any extra spellings (aliases) then
+# point to the other category
+import sys
+
+# Name of the document the registry is saved in
+CATEGORIES_DOCUMENT = "categories"
+
+
+# The form a name is looked up by
+def fold(name):
+    return " ".join(str(name).split()).casefold()
+
+# The form a name is shown in: whitespace trimmed, case kept
+def clean(name):
+    return " ".join(str(name).split())
+
+
+class CategoryRegistry:
+    def __init__(self, names=None, merged=None, aliases=None):
+        self.names = list(names or [])  # Display name of every id, ids are positions and never reused
+        self.merged = dict(merged or {})  # id -> id of the category it was merged into
+        self.aliases = dict(aliases or {})  # Folded extra spelling -> id
+        self.ids = {}  # Folded name or alias -> id of the category it stands for
+        for category_id, name in enumerate(self.names):
+            self.ids.setdefault(fold(name), self.canonical(category_id))
+        self.ids.update((alias, self.canonical(category_id)) for alias, category_id in self.aliases.items())
+
+    def __len__(self):
+        return len(self.names) - len(self.merged)
+
+    # The id a merged id now stands for, itself for every other id
+    def canonical(self, category_id):
+        return self.merged.get(category_id, category_id)
+
+    # Id of a name or alias, None for a category that isn't registered
+    def lookup(self, name):
+        return self.ids.get(fold(name))
+
+    def name_of(self, category_id):
+        return self.names[self.canonical(category_id)]
+
+    # The registered spelling of a name, or the name trimmed when it is new
+    def display_name(self, name):
+        category_id = self.lookup(name)
+        return clean(name) if category_id is None else self.names[category_id]
+
+    # Id of a name, registering it when it is new
+    def add(self, name):
+        category_id = self.lookup(name)
+        if category_id is None:
+            category_id = len(self.names)
+            self.names.append(clean(name))
+            self.ids[fold(name)] = category_id
+        return category_id
+
+    # Make `alias` another name for `into`. When alias is a category of its own its id is merged,
+    # expenses stored with it are then read as `into`
+    def merge(self, alias, into):
+        target = self.add(into)
+        source = self.lookup(alias)
+        if source == target:
+            return target
+        if source is not None:
+            self.merged.update([(category_id, target) for category_id, merged_into in self.merged.items() if merged_into == source])
+            self.merged[source] = target
+            self.ids.update([(key, target) for key, category_id in self.ids.items() if category_id == source])
+            self.aliases.update([(key, target) for key, category_id in self.aliases.items() if category_id == source])
+        self.aliases[fold(alias)] = target
+        self.ids[fold(alias)] = target
+        return target
+
+    # Names of the categories that weren't merged away, in the order they were added
+    def categories(self):
+        return [name for category_id, name in enumerate(self.names) if category_id not in self.merged]
+
+    # Saved form, ids are strings in JSON
+    def to_dict(self):
+        return {
+            "names": list(self.names),
+            "merged": {str(category_id): target for category_id, target in self.merged.items()},
+            "aliases": dict(self.aliases),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        merged = {int(category_id): target for category_id, target in data.get("merged", {}).items()}
+        return cls(data.get("names", []), merged, data.get("aliases", {}))
+
+    # Registry of an old plain list of names. Spellings that only differ in case or spacing
+    # become one category, the first spelling is the one shown
+    @classmethod
+    def from_names(cls, names):
+        registry = cls()
+        for name in names:
+            if clean(name):
+                registry.add(name)
+        return registry
+
+
+# Run "python categories.py" to list the categories, "python categories.py merge ALIAS INTO" to
+# merge one category into another, moving its expenses, goals and budget along
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["merge"] and len(sys.argv) == 4:
+        from expenses import ExpenseManager
+        moved = ExpenseManager().merge_category(sys.argv[2], sys.argv[3])
+        print(f"Merged {sys.argv[2]!r} into {sys.argv[3]!r}, {moved} expenses moved.")
+    elif len(sys.argv) == 1:
+        import storage
+        registry = storage.get_backend().load_registry()
+        for category_id, name in enumerate(registry.names):
+            merged = f" (merged into {registry.name_of(category_id)})" if category_id in registry.merged else ""
+            print(f"{category_id:>4}  {name}{merged}")
+    else:
+        print("Usage: python categories.py [merge ALIAS INTO]")
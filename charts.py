@@ -0,0 +1,119 @@
+# Rendered charts, cached as PNG images so a rerun or tab switch doesn't draw the same chart again.
+# Images are keyed on the kind of chart and a hash of the data it is drawn from, the least recently
+# used ones are dropped once the cache holds more than CACHE_BYTES
+import hashlib
+import io
+import json
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+import streamlit as st
+
+# Memory the cached images may use in total
+CACHE_BYTES = 32 * 1024 * 1024
+
+# Resolution of the rendered images, the same as st.pyplot uses
+DPI = 200
+
+# Points a line chart is drawn with at most, longer series are downsampled
+MAX_POINTS = 500
+
+_lock = threading.Lock()
+_images = OrderedDict()  # (kind, data version) -> PNG bytes, least recently used first
+_stats = {"hits": 0, "misses": 0, "evictions": 0, "renders": 0, "render_seconds": 0.0, "bytes": 0}
+
+# Version of the data a chart is drawn from, any change to it gives a new image
+def data_version(data):
+    text = json.dumps(data, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode()).hexdigest()
+
+# Draw a chart with draw(figure, data) and return it as PNG bytes. The figure is made without
+# pyplot, so it is never registered globally and is released as soon as it is saved
+def render(draw, data, size=None):
+    from matplotlib.figure import Figure  # Imported on the first render, most pages never draw a chart
+    started = time.perf_counter()
+    figure = Figure(figsize=size)
+    try:
+        draw(figure, data)
+        image = io.BytesIO()
+        figure.savefig(image, format="png", dpi=DPI, bbox_inches="tight")
+    finally:
+        figure.clear()
+    seconds = time.perf_counter() - started
+    with _lock:
+        _stats["renders"] += 1
+        _stats["render_seconds"] += seconds
+    return image.getvalue()
+
+# PNG of a chart, from the cache when the same kind of chart was drawn from the same data before
+def chart_image(kind, data, draw, size=None):
+    key = (kind, data_version(data))
+    with _lock:
+        image = _images.get(key)
+        if image is not None:
+            _images.move_to_end(key)
+            _stats["hits"] += 1
+            return image
+        _stats["misses"] += 1
+    image = render(draw, data, size)
+    with _lock:
+        if key not in _images:
+            _images[key] = image
+            _stats["bytes"] += len(image)
+        while _stats["bytes"] > CACHE_BYTES and len(_images) > 1:
+            _, evicted = _images.popitem(last=False)
+            _stats["bytes"] -= len(evicted)
+            _stats["evictions"] += 1
+    return image
+
+# Show a chart on the page, use in place of st.pyplot
+def show(kind, data, draw, size=None):
+    st.image(chart_image(kind, data, draw, size), width="stretch")
+
+# Forget every cached image, the counters are kept
+def clear():
+    with _lock:
+        _images.clear()
+        _stats["bytes"] = 0
+
+# Hit rate, render times and memory use of the cache
+def stats():
+    with _lock:
+        lookups = _stats["hits"] + _stats["misses"]
+        return dict(
+            _stats,
+            entries=len(_images),
+            hit_rate=_stats["hits"] / lookups if lookups else 0.0,
+            average_render_ms=_stats["render_seconds"] / _stats["renders"] * 1000 if _stats["renders"] else 0.0,
+        )
+
+# Largest-Triangle-Three-Buckets: positions of at most `points` points of a line that keep its
+# shape. The first and last points are kept, the rest is split into equal buckets and from each
+# the point forming the largest triangle with the previous pick and the next bucket's average
+def lttb_indices(x, y, points):
+    size = len(x)
+    if points >= size or points < 3:
+        return np.arange(size)
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    edges = np.linspace(1, size - 1, points - 1).astype(np.int64)  # Bucket b is edges[b]:edges[b + 1]
+    picked = np.empty(points, dtype=np.int64)
+    picked[0], picked[-1] = 0, size - 1
+    previous = 0
+    for bucket in range(points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_end = edges[bucket + 2] if bucket + 2 < len(edges) else size
+        next_x, next_y = x[end:next_end].mean(), y[end:next_end].mean()
+        areas = np.abs((x[previous] - next_x) * (y[start:end] - y[previous])
+                       - (x[previous] - x[start:end]) * (next_y - y[previous]))
+        previous = start + int(areas.argmax())
+        picked[bucket + 1] = previous
+    return picked
+
+# A series of "YYYY-MM-DD" dates and values cut down to at most `points` points with LTTB
+def downsample(dates, values, points=MAX_POINTS):
+    if len(dates) <= points:
+        return list(dates), list(values)
+    days = np.array(dates, dtype="datetime64[D]").astype(np.int64)
+    picked = lttb_indices(days, values, points).tolist()
+    return [dates[index] for index in picked], [values[index] for index in picked]
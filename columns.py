@@ -0,0 +1,295 @@
+# Compact column-wise storage of expenses: one NumPy array per field instead of a dict per row
+from datetime import date
+import numpy as np
+from delta import new_expense_id
+
+# Dates are stored as the number of days since 1970-01-01
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# Turn "YYYY-MM-DD" (or a date) into a day number and back
+def to_day(value):
+    if isinstance(value, str):
+        value = date.fromisoformat(value[:10])
+    return value.toordinal() - EPOCH_ORDINAL
+
+def from_day(day):
+    return date.fromordinal(int(day) + EPOCH_ORDINAL)
+
+
+# A single expense read from the columns, looks like the old {"amount", "category", "date"} dict
+class ExpenseRecord:
+    __slots__ = ("columns", "index")
+    FIELDS = ("id", "amount", "category", "date")
+
+    def __init__(self, columns, index):
+        self.columns = columns
+        self.index = index
+
+    def __getitem__(self, key):
+        if key == "id":
+            return int(self.columns.ids[self.index])
+        if key == "amount":
+            return float(self.columns.amounts[self.index])
+        if key == "category":
+            return self.columns.categories[self.columns.codes[self.index]]
+        if key == "date":
+            return from_day(self.columns.days[self.index]).isoformat()
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        return self[key] if key in self.FIELDS else default
+
+    def keys(self):
+        return self.FIELDS
+
+    def to_dict(self):
+        return {key: self[key] for key in self.FIELDS}
+
+    def __repr__(self):
+        return f"ExpenseRecord({self.to_dict()})"
+
+
+# Expenses as parallel arrays: stable id, amount, day number and a code into the category list
+class ExpenseColumns:
+    def __init__(self, amounts=None, days=None, codes=None, categories=None, ids=None):
+        self.size = 0 if amounts is None else len(amounts)
+        capacity = max(self.size, 16)
+        self._ids = np.zeros(capacity, dtype=np.int64)
+        self._amounts = np.zeros(capacity, dtype=np.float64)
+        self._days = np.zeros(capacity, dtype=np.int64)
+        self._codes = np.zeros(capacity, dtype=np.int32)
+        if self.size:
+            self._ids[:self.size] = [new_expense_id() for _ in range(self.size)] if ids is None else ids
+            self._amounts[:self.size] = amounts
+            self._days[:self.size] = days
+            self._codes[:self.size] = codes
+        self.categories = list(categories or [])
+        self.category_codes = {name: code for code, name in enumerate(self.categories)}
+
+    # Build the columns from a list of expense dicts, dates are parsed in one vectorized call
+    @classmethod
+    def from_records(cls, records):
+        columns = cls()
+        if not records:
+            return columns
+        ids = np.fromiter((record.get("id") or new_expense_id() for record in records), dtype=np.int64, count=len(records))
+        amounts = np.fromiter((record["amount"] for record in records), dtype=np.float64, count=len(records))
+        dates = np.array([str(record["date"])[:10] for record in records], dtype="datetime64[D]")
+        codes = np.fromiter((columns.code_for(record["category"]) for record in records), dtype=np.int32, count=len(records))
+        return cls(amounts, dates.astype(np.int64), codes, columns.categories, ids)
+
+    # Build the columns from a DataFrame with amount, category and date columns (and optionally id),
+    # incomplete rows are dropped
+    @classmethod
+    def from_frame(cls, frame):
+        import pandas as pd  # Only the pages work with DataFrames, reports.py starts without pandas
+        frame = frame.dropna(subset=["amount", "category", "date"])
+        columns = cls()
+        if frame.empty:
+            return columns
+        days = pd.to_datetime(frame["date"]).to_numpy(dtype="datetime64[D]").astype(np.int64)
+        codes = np.fromiter((columns.code_for(str(name)) for name in frame["category"]), dtype=np.int32, count=len(frame))
+        ids = frame["id"].to_numpy(dtype=np.int64) if "id" in frame else None
+        return cls(frame["amount"].to_numpy(dtype=np.float64), days, codes, columns.categories, ids)
+
+    # Build the columns from a segment's records (see segments.py), nothing is parsed. name_of
+    # gives the category name of a stored category id
+    @classmethod
+    def from_segment(cls, array, name_of):
+        columns = cls()
+        if not len(array):
+            return columns
+        category_ids = np.unique(array["category_id"])
+        table = np.zeros(int(category_ids[-1]) + 1, dtype=np.int32)
+        for category_id in category_ids.tolist():
+            table[category_id] = columns.code_for(name_of(category_id))
+        return cls(array["cents"] / 100, array["day"], table[array["category_id"]], columns.categories, array["id"])
+
+    # The rows of several columns in one, in order, categories are matched by name
+    @classmethod
+    def concatenate(cls, parts):
+        columns = cls()
+        parts = [part for part in parts if part.size]
+        if not parts:
+            return columns
+        codes = [np.array([columns.code_for(name) for name in part.categories], dtype=np.int32)[part.codes] for part in parts]
+        return cls(
+            np.concatenate([part.amounts for part in parts]),
+            np.concatenate([part.days for part in parts]),
+            np.concatenate(codes),
+            columns.categories,
+            np.concatenate([part.ids for part in parts]),
+        )
+
+    # Views of the filled part of each array
+    @property
+    def ids(self):
+        return self._ids[:self.size]
+
+    @property
+    def amounts(self):
+        return self._amounts[:self.size]
+
+    @property
+    def days(self):
+        return self._days[:self.size]
+
+    @property
+    def codes(self):
+        return self._codes[:self.size]
+
+    # Code of a category, new categories are added to the dictionary
+    def code_for(self, category):
+        code = self.category_codes.get(category)
+        if code is None:
+            code = len(self.categories)
+            self.categories.append(category)
+            self.category_codes[category] = code
+        return code
+
+    # Add one expense, the arrays double in size when full so appends stay cheap
+    def append(self, amount, category, expense_date, expense_id=None):
+        if self.size == len(self._amounts):
+            capacity = len(self._amounts) * 2
+            self._ids = np.resize(self._ids, capacity)
+            self._amounts = np.resize(self._amounts, capacity)
+            self._days = np.resize(self._days, capacity)
+            self._codes = np.resize(self._codes, capacity)
+        self._ids[self.size] = new_expense_id() if expense_id is None else expense_id
+        self._amounts[self.size] = amount
+        self._days[self.size] = to_day(expense_date)
+        self._codes[self.size] = self.code_for(category)
+        self.size += 1
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError(index)
+        return ExpenseRecord(self, index)
+
+    def __iter__(self):
+        return (ExpenseRecord(self, index) for index in range(self.size))
+
+    # Independent copy, used so a shared cached copy is never changed
+    def copy(self):
+        return ExpenseColumns(self.amounts.copy(), self.days.copy(), self.codes.copy(), self.categories, self.ids.copy())
+
+    # New columns holding only the rows where mask is True
+    def select(self, mask):
+        return ExpenseColumns(self.amounts[mask], self.days[mask], self.codes[mask], self.categories, self.ids[mask])
+
+    # Boolean masks for filtering
+    def category_mask(self, category):
+        code = self.category_codes.get(category)
+        if code is None:
+            return np.zeros(self.size, dtype=bool)
+        return self.codes == code
+
+    def date_mask(self, start, end=None):
+        start_day = to_day(start)
+        end_day = start_day if end is None else to_day(end)
+        return (self.days >= start_day) & (self.days <= end_day)
+
+    # Mask of the rows matching all given filters, dates are "YYYY-MM-DD" strings or dates
+    def matching(self, category=None, start=None, end=None):
+        mask = np.ones(self.size, dtype=bool)
+        if category is not None:
+            mask &= self.category_mask(category)
+        if start is not None:
+            mask &= self.days >= to_day(start)
+        if end is not None:
+            mask &= self.days <= to_day(end)
+        return mask
+
+    # Position of each category code in alphabetical order, for sorting by category
+    def category_ranks(self):
+        ranks = np.empty(len(self.categories), dtype=np.int64)
+        ranks[np.argsort(np.array(self.categories, dtype=str), kind="stable")] = np.arange(len(self.categories))
+        return ranks
+
+    # Row positions of one page of the masked rows, sorted by "date", "amount" or "category"
+    def page_positions(self, mask, sort_by="date", descending=False, page=1, page_size=100):
+        positions = np.flatnonzero(mask)
+        if sort_by == "amount":
+            keys = self.amounts[positions]
+        elif sort_by == "category":
+            keys = self.category_ranks()[self.codes[positions]]
+        else:
+            keys = self.days[positions]
+        order = np.argsort(keys, kind="stable")
+        if descending:
+            order = order[::-1]
+        first = (page - 1) * page_size
+        return positions[order[first:first + page_size]]
+
+    # New columns with the rows at the given positions, in that order
+    def take(self, positions):
+        return ExpenseColumns(
+            self.amounts[positions], self.days[positions], self.codes[positions], self.categories, self.ids[positions]
+        )
+
+    # Positions of the given expense ids, as a dict from id to position
+    def positions_of(self, expense_ids):
+        positions = np.flatnonzero(np.isin(self.ids, np.fromiter(expense_ids, dtype=np.int64)))
+        return dict(zip(self.ids[positions].tolist(), positions.tolist()))
+
+    # Apply an ExpenseDelta in place
+    def apply_delta(self, delta):
+        if delta.updated or delta.deleted:
+            positions = self.positions_of([new["id"] for old, new in delta.updated] + [old["id"] for old in delta.deleted])
+            for old, new in delta.updated:
+                position = positions[new["id"]]
+                self._amounts[position] = new["amount"]
+                self._days[position] = to_day(new["date"])
+                self._codes[position] = self.code_for(new["category"])
+            if delta.deleted:
+                keep = np.ones(self.size, dtype=bool)
+                keep[[positions[expense["id"]] for expense in delta.deleted]] = False
+                kept = self.select(keep)
+                self.size, self._ids, self._amounts, self._days, self._codes = (
+                    kept.size, kept._ids, kept._amounts, kept._days, kept._codes
+                )
+        for expense in delta.inserted:
+            self.append(expense["amount"], expense["category"], expense["date"], expense["id"])
+
+    def filter_by_category(self, category):
+        return self.select(self.category_mask(category))
+
+    def filter_by_date(self, selected_date):
+        return self.select(self.date_mask(selected_date))
+
+    # Totals and grouping, all done with NumPy
+    def total(self, mask=None):
+        if mask is None:
+            return float(self.amounts.sum())
+        return float(np.sum(self.amounts, where=mask))
+
+    def totals_by_category(self):
+        sums = np.bincount(self.codes, weights=self.amounts, minlength=len(self.categories))
+        counts = np.bincount(self.codes, minlength=len(self.categories))
+        return {self.categories[code]: float(sums[code]) for code in np.flatnonzero(counts)}
+
+    # Back to plain dicts for the storage backends
+    def to_records(self):
+        dates = self.days.astype("datetime64[D]").astype(str)
+        return [
+            {"id": expense_id, "amount": amount, "category": self.categories[code], "date": str(day)}
+            for expense_id, amount, code, day in zip(self.ids.tolist(), self.amounts.tolist(), self.codes, dates)
+        ]
+
+    # DataFrame over the arrays without copying them, categories become a pandas Categorical
+    def to_frame(self, index=None):
+        import pandas as pd
+        return pd.DataFrame(
+            {
+                "amount": self.amounts,
+                "category": pd.Categorical.from_codes(self.codes, categories=self.categories),
+                "date": self.days.view("datetime64[D]"),
+            },
+            index=index,
+            copy=False,
+        )
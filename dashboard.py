@@ -0,0 +1,55 @@
+# Dashboard, the home page: this month's numbers and the recent spending and savings trends, all
+# read from the rollups so the page doesn't depend on how many expenses there are
+from datetime import date
+import streamlit as st
+import instrument
+import reports
+import rollups
+import storage
+
+# Periods shown in the trend tabs: (tab label, period, number of periods)
+TRENDS = [("Last 30 days", "day", 30), ("Last 12 weeks", "week", 12), ("Last 12 months", "month", 12)]
+
+
+@instrument.timed()
+def display_dashboard():
+    st.title("📂 Dashboard")
+    st.write("Welcome to your dashboard! We are here for you to make sure you follow and track your expenses, we know how hard it can be!")
+
+    backend = storage.get_backend()
+    totals = rollups.load_rollups(backend)
+    savings = backend.load_document("savings", {})
+    today = date.today()
+    this_month, last_month = rollups.last_keys("month", 2, today)[::-1]
+
+    # Top metrics
+    spent_this_month = totals.spent("month", this_month)
+    col1, col2, col3, col4 = st.columns(4)
+    col1.metric("Spent this month", f"{spent_this_month:.2f}",
+                f"{spent_this_month - totals.spent('month', last_month):+.2f} vs last month", delta_color="inverse")
+    col2.metric("Spent this week", f"{totals.spent('week', rollups.period_key('week', today)):.2f}")
+    col3.metric("Spent today", f"{totals.spent('day', today.isoformat()):.2f}")
+    col4.metric("Total savings", f"{savings.get('total_savings', 0):.2f}",
+                f"{totals.saved('month', this_month):+.2f} this month")
+    # This month's category budgets minus what was spent in them so far
+    budget_rows = reports.budget_vs_actual(reports.month_budget(savings, this_month), totals.spent_by_category("month", this_month))
+    if budget_rows:
+        budgeted = sum(row["budget"] for row in budget_rows)
+        st.write(f"**Budget left this month**: {sum(row['left'] for row in budget_rows):.2f} of {budgeted:.2f}")
+
+    # Spending and savings trends
+    for tab, (label, period, count) in zip(st.tabs([label for label, _, _ in TRENDS]), TRENDS):
+        with tab:
+            trend = totals.trend(period, count, today)
+            st.bar_chart({
+                label: [key for key, _, _ in trend],
+                "Spent": [spent for _, spent, _ in trend],
+                "Saved": [saved for _, _, saved in trend],
+            }, x=label, y=["Spent", "Saved"], stack=False)
+
+    # Where this month's money went
+    by_category = sorted(totals.spent_by_category("month", this_month).items(), key=lambda item: -item[1])
+    if by_category:
+        st.subheader("Top categories this month")
+        st.bar_chart({"Category": [category for category, _ in by_category], "Spent": [amount for _, amount in by_category]},
+                     x="Category", y="Spent", horizontal=True, sort="-Spent")
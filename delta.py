@@ -0,0 +1,88 @@
+# Changes to the expenses, described by stable expense IDs so only what changed is saved
+import hashlib
+import secrets
+
+# IDs are random 63-bit integers: they fit SQLite's INTEGER and a NumPy int64 column
+def new_expense_id():
+    return secrets.randbits(63)
+
+# Make an expense dict with a fresh ID
+def new_expense(amount, category, expense_date):
+    return {"id": new_expense_id(), "amount": amount, "category": category, "date": str(expense_date)}
+
+# Give every expense dict without an ID one, returns True if any were missing. With a namespace
+# the IDs are derived from it and the position, so reading the same file again gives the same IDs
+def assign_ids(expenses, namespace=None):
+    missing = False
+    for position, expense in enumerate(expenses):
+        if "id" not in expense:
+            expense["id"] = new_expense_id() if namespace is None else derived_id(namespace, position)
+            missing = True
+    return missing
+
+def derived_id(namespace, position):
+    digest = hashlib.blake2b(f"{namespace}:{position}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") >> 1
+
+
+# Inserted, updated and deleted expenses. Updates keep the old version so running
+# totals can take it out again
+class ExpenseDelta:
+    def __init__(self, inserted=None, updated=None, deleted=None):
+        self.inserted = list(inserted or [])
+        self.updated = list(updated or [])  # (old expense, new expense) pairs with the same id
+        self.deleted = list(deleted or [])
+
+    def __bool__(self):
+        return bool(self.inserted or self.updated or self.deleted)
+
+    def __repr__(self):
+        return f"ExpenseDelta({len(self.inserted)} inserted, {len(self.updated)} updated, {len(self.deleted)} deleted)"
+
+    # Months touched by the delta, as "YYYY-MM"
+    def months(self):
+        months = {expense["date"][:7] for expense in self.inserted + self.deleted}
+        for old, new in self.updated:
+            months.update((old["date"][:7], new["date"][:7]))
+        return months
+
+    # One delta with the effect of several applied in order, e.g. an insert that is later
+    # deleted disappears and two updates of a row become one
+    @classmethod
+    def combine(cls, deltas):
+        if len(deltas) == 1:
+            return deltas[0]
+        changes = {}  # id -> (stored expense or None, final expense or None)
+        for delta in deltas:
+            for expense in delta.deleted:
+                changes[expense["id"]] = (changes.get(expense["id"], (expense,))[0], None)
+            for old, new in delta.updated:
+                changes[new["id"]] = (changes.get(new["id"], (old,))[0], new)
+            for expense in delta.inserted:
+                changes[expense["id"]] = (changes.get(expense["id"], (None,))[0], expense)
+        combined = cls()
+        for old, new in changes.values():
+            if old is None and new is not None:
+                combined.inserted.append(new)
+            elif old is not None and new is not None:
+                combined.updated.append((old, new))
+            elif old is not None:
+                combined.deleted.append(old)
+        return combined
+
+    # Delta that turns one list of expense dicts into another, matched on id
+    @classmethod
+    def between(cls, old_expenses, new_expenses):
+        old_by_id = {expense["id"]: expense for expense in old_expenses}
+        new_ids = set()
+        delta = cls()
+        for expense in new_expenses:
+            old = old_by_id.get(expense.get("id"))
+            if old is None:
+                delta.inserted.append(expense if "id" in expense else {**expense, "id": new_expense_id()})
+            else:
+                new_ids.add(expense["id"])
+                if old != expense:
+                    delta.updated.append((old, expense))
+        delta.deleted = [expense for expense_id, expense in old_by_id.items() if expense_id not in new_ids]
+        return delta
@@ -1,81 +1,237 @@
 # Import necessary libraries
 import streamlit as st
-import json
-import pandas as pd
 from streamlit_free_text_select import st_free_text_select
 from streamlit_option_menu import option_menu
 from datetime import date
-
-# Paths to JSON files
-EXPENSES_FILE = "data/expenses.json"  # File to store expenses
-CATEGORY_FILE = "data/expensecatagories.json"  # File to store categories
+import aggregates
+import cache
+import goalprogress
+import instrument
+import monthclose
+import rollups
+import storage
+import writebehind
+from categories import CategoryRegistry
+from columns import ExpenseColumns
+from delta import ExpenseDelta, assign_ids, new_expense, new_expense_id
+from importer import import_expenses
+import exporter
+from writes import WriteConflict
+import io
+import numpy as np
 
 # Manage expenses and categories
 class ExpenseManager:
-    def __init__(self, expenses_file, categories_file):
-        # Load files on initialization
-        self.expenses_file = expenses_file
-        self.categories_file = categories_file
-        self.expenses = self.load_file(self.expenses_file, [])
-        self.categories = self.load_file(self.categories_file, ["Food", "Transport", "Entertainment", "Other"])
-
-    # Load JSON data from a file
-    def load_file(self, file_path, default):
-        try:
-            with open(file_path, "r") as file:
-                return json.load(file)
-        except (FileNotFoundError, json.JSONDecodeError):
-            return default
+    def __init__(self, backend=None):
+        # Load data on initialization, from the backend chosen in storage.py by default
+        self.backend = backend or storage.get_backend()
+        self._expenses = None  # Loaded on first use, most views only need one month or the aggregates
+        self.registry = self.backend.load_registry()
+        self.categories = self.registry.categories()
+        self.aggregates = self.load_aggregates()
+
+    # All expenses as columns
+    @property
+    def expenses(self):
+        if self._expenses is None:
+            self._expenses = self.load_columns()
+        return self._expenses
+
+    # Cache key of the converted columns, next to the backend's own cache of the records
+    def columns_key(self):
+        return ("columns",) + self.backend.expenses_key()
 
-    # Save JSON data to a file
-    def save_file(self, file_path, data):
-        with open(file_path, "w") as file:
-            json.dump(data, file, indent=4)
+    # Expenses as NumPy columns, the conversion is cached and each manager works on its own copy
+    @instrument.timed()
+    def load_columns(self):
+        shared = cache.get(
+            self.columns_key(),
+            self.backend.expenses_version(),
+            self.backend.load_columns,
+        )
+        return shared.copy()
+
+    # Saved running totals, rebuilt when they don't cover the same number of expenses. Another
+    # session may be saving right now, so the rebuild checks again under the write lock
+    @instrument.timed()
+    def load_aggregates(self):
+        totals = aggregates.load_aggregates(self.backend)
+        if totals.count != self.backend.count_expenses():
+            totals = aggregates.rebuild_aggregates(self.backend, self.load_columns, only_if_stale=True)
+        return totals
 
-    # Add an expense and save it
+    # Save an ExpenseDelta: the backend, the loaded and cached columns, the aggregates, rollups
+    # and goal progress only see the rows that changed. Raises WriteConflict if rows it changes
+    # were changed by another session first
+    @instrument.timed()
+    def apply_delta(self, delta):
+        if not delta:
+            return
+        self.use_registered_names(delta.inserted + [new for old, new in delta.updated])
+        def save_totals():
+            self.aggregates = aggregates.apply_delta(delta, self.backend, self.aggregates)
+            rollups.apply_delta(delta, self.backend)
+            goalprogress.apply_delta(delta, self.backend)
+
+        applied, before, after = self.backend.commit_delta(delta, save_totals)
+        if self._expenses is not None:
+            self._expenses.apply_delta(delta)
+        # The group commit may have saved other sessions' changes too, applied holds all of them
+        shared = cache.peek(self.columns_key(), before)
+        if shared is not None:
+            shared = shared.copy()
+            shared.apply_delta(applied)
+            cache.put(self.columns_key(), after, shared)
+
+    # Give new and edited expenses the registered spelling of their category, the one they are read
+    # back with, so loaded and cached rows match the saved ones. New categories are registered
+    def use_registered_names(self, expenses):
+        names = {expense["category"] for expense in expenses}
+        if any(self.registry.lookup(name) is None for name in names):
+            self.registry = self.backend.register_categories(names)
+            self.categories = self.registry.categories()
+        for expense in expenses:
+            expense["category"] = self.registry.display_name(expense["category"])
+
+    # Add an expense and save it. In the app it is queued and saved by the write-behind thread,
+    # pages read it once the next rerun has waited for the queue
     def add_expense(self, amount, category, date):
-        self.expenses.append({"amount": amount, "category": category, "date": str(date)})
-        self.save_file(self.expenses_file, self.expenses)
+        expense = new_expense(amount, category, date)
+        if writebehind.started():
+            self.use_registered_names([expense])
+            writebehind.submit("insert_expenses", {"expenses": [expense]}, self.backend)
+        else:
+            self.apply_delta(ExpenseDelta(inserted=[expense]))
+
+    # Add a batch of expense dicts with one write to the backend and to the aggregates
+    def add_expenses(self, expenses):
+        assign_ids(expenses)
+        self.apply_delta(ExpenseDelta(inserted=expenses))
+
+    # Replace all expenses with edited columns, only the rows that differ are saved
+    def replace_expenses(self, expenses):
+        self.apply_delta(ExpenseDelta.between(self.expenses.to_records(), expenses.to_records()))
 
-    # Add a category if it doesn't already exist
+    # Fold the JSON journals into their snapshots (other backends have nothing to compact)
+    def compact(self):
+        self.backend.compact()
+
+    # Add a category unless it exists in any spelling, keeping categories other sessions added
+    # meanwhile. Returns the name the category is saved under
     def add_category(self, category):
-        if category not in self.categories:
-            self.categories.append(category)
-            self.save_file(self.categories_file, self.categories)
+        if self.registry.lookup(category) is None and writebehind.started():
+            self.registry = CategoryRegistry.from_dict(self.registry.to_dict())  # The loaded one is shared
+            self.registry.add(category)
+            self.categories = self.registry.categories()
+            writebehind.submit("add_categories", {"names": [category]}, self.backend)
+        elif self.registry.lookup(category) is None:
+            self.registry = self.backend.update_registry(lambda registry: registry.add(category))
+            self.categories = self.registry.categories()
+        return self.registry.display_name(category)
+
+    # The saved name of a category in any spelling, None if there is no such category
+    def find_category(self, category):
+        return None if self.registry.lookup(category) is None else self.registry.display_name(category)
+
+    # Merge one category into another. Its expenses are moved in one delta and goals and budgets
+    # follow, then the registry makes the old name another spelling of the new one. Returns the
+    # number of expenses moved
+    def merge_category(self, alias, into):
+        into = self.add_category(into)
+        alias = self.find_category(alias) or alias
+        moved = []
+        if self.registry.lookup(alias) != self.registry.lookup(into):
+            moved = [(expense, {**expense, "category": into}) for expense in self.expenses.to_records() if expense["category"] == alias]
+            self.apply_delta(ExpenseDelta(updated=moved))
+            self.backend.update_document(goalprogress.GOALS_DOCUMENT, [], lambda goals: [
+                {**goal, "category": into} if goal.get("category") == alias else goal for goal in goals
+            ])
+            self.backend.update_document("savings", {}, lambda savings: merge_budgets(savings, alias, into))
+        self.registry = self.backend.update_registry(lambda registry: registry.merge(alias, into))
+        self.categories = self.registry.categories()
+        return len(moved)
+
+    # Expenses between two dates (or all of them), reading only those months when nothing else is loaded
+    def expenses_between(self, start=None, end=None):
+        if self._expenses is None and (start is not None or end is not None):
+            return self.backend.load_columns(start, end)
+        return self.expenses
 
     # Filter expenses by category
     def filter_by_category(self, category):
-        return [expense for expense in self.expenses if expense["category"] == category]
+        return self.expenses.filter_by_category(category)
 
-    # Filter expenses by date
+    # Filter expenses by date, reading only that month when nothing else is loaded
     def filter_by_date(self, selected_date):
-        return [expense for expense in self.expenses if expense["date"] == selected_date]
+        if self._expenses is None:
+            return self.backend.load_columns(selected_date, selected_date)
+        return self.expenses.filter_by_date(selected_date)
 
     # Get total expenses
     def total_expenses(self):
-        return sum(expense["amount"] for expense in self.expenses)
+        return self.aggregates.total
 
     # Get total expenses grouped by category
     def expenses_by_category(self):
-        totals = {}
-        for expense in self.expenses:
-            totals[expense["category"]] = totals.get(expense["category"], 0) + expense["amount"]
-        return totals
+        return self.aggregates.totals_by_category()
+
+
+# Write-behind handlers (see writebehind.py), each saves a batch of queued changes at once
+# Categories queued by add_category
+def add_categories(backend, batch):
+    backend.save_categories([name for arguments in batch for name in arguments["names"]])
+
+# Expenses queued by add_expense, in one delta. Expenses already saved are left out, so a replay
+# after a crash doesn't add them twice
+def insert_expenses(backend, batch):
+    expenses = [expense for arguments in batch for expense in arguments["expenses"]]
+    saved = backend.find_expenses(expenses)
+    expenses = [expense for expense in expenses if expense["id"] not in saved]
+    if expenses:
+        ExpenseManager(backend).apply_delta(ExpenseDelta(inserted=expenses))
+
+
+# The savings document with the budget of one category added to another's, this month's budget
+# and the budget kept for each month
+def merge_budgets(savings, alias, into):
+    def merged(category_budget):
+        if alias not in category_budget:
+            return category_budget
+        budget = {category: amount for category, amount in category_budget.items() if category != alias}
+        budget[into] = budget.get(into, 0) + category_budget[alias]
+        return budget
+
+    savings = {**savings, "category_budget": merged(savings.get("category_budget", {}))}
+    if monthclose.BUDGETS in savings:
+        savings[monthclose.BUDGETS] = {
+            month: {**budget, "category_budget": merged(budget.get("category_budget", {}))}
+            for month, budget in savings[monthclose.BUDGETS].items()
+        }
+    return savings
+
+
+# Rows shown per page when browsing expenses
+PAGE_SIZE = 100
+ALL_CATEGORIES = "All categories"
+
+# Show the date column as a plain date in tables
+DATE_COLUMN = {"date": st.column_config.DateColumn("date", format="YYYY-MM-DD")}
 
 
 # Main function to display the expense tracker
+@instrument.timed()
 def display_expenses():
     st.title("💸 Expense Tracker")
     st.write("Track your expenses, add new ones, and modify existing records.")
 
     # Initialize manager
-    manager = ExpenseManager(EXPENSES_FILE, CATEGORY_FILE)
+    manager = ExpenseManager()
 
     # Navigation menu
     selected = option_menu(
         menu_title=None,
-        options=["Add expenses", "View expenses", "Modify"],
-        icons=["plus-circle", "eye", "pencil"],
+        options=["Add expenses", "View expenses", "Modify", "Import", "Export"],
+        icons=["plus-circle", "eye", "pencil", "upload", "download"],
         default_index=0,
         orientation="horizontal",
     )
@@ -87,9 +243,14 @@ def display_expenses():
         view_expenses(manager)
     elif selected == "Modify":
         modify_expenses(manager)
+    elif selected == "Import":
+        import_expenses_page(manager)
+    elif selected == "Export":
+        export_page(manager)
 
 
 # Add a new expense
+@instrument.timed()
 def add_expenses(manager):
     st.subheader("Add a new expense")
 
@@ -109,70 +270,154 @@ def add_expenses(manager):
             if amount <= 0:
                 st.error("Please enter a valid amount.")
             else:
-                manager.add_category(category)  # Add category if new
+                category = manager.add_category(category)  # Add category if new, in any spelling
                 manager.add_expense(amount, category, date_selected)
                 st.success(f"Added: {amount} to '{category}' on {date_selected}.")
 
 
-# View expenses (all, by category, or by date)
+# Filter, sort and page controls shared by the view and modify tabs. Filtering, sorting
+# and paging happen here on the server, only the rows of the visible page are sent on
+@instrument.timed()
+def browse_expenses(manager, key, whole_history=False):
+    col1, col2, col3 = st.columns(3)
+    category = col1.selectbox("Category", [ALL_CATEGORIES] + manager.categories, key=key + "_category")
+    start = col2.date_input("From", value=None, key=key + "_start")
+    end = col3.date_input("To", value=None, key=key + "_end")
+    category = None if category == ALL_CATEGORIES else category
+
+    expenses = manager.expenses if whole_history else manager.expenses_between(start, end)
+    mask = expenses.matching(category, start, end)
+    count = int(mask.sum())
+    if not count:
+        return expenses, mask, None
+
+    col4, col5, col6 = st.columns(3)
+    sort_by = col4.selectbox("Sort by", ["date", "amount", "category"], key=key + "_sort")
+    descending = col5.selectbox("Order", ["Descending", "Ascending"], key=key + "_order") == "Descending"
+    pages = (count + PAGE_SIZE - 1) // PAGE_SIZE
+    page = col6.number_input(f"Page (of {pages})", min_value=1, max_value=pages, value=1, key=key + "_page")
+    positions = expenses.page_positions(mask, sort_by, descending, page, PAGE_SIZE)
+    st.caption(f"Showing {(page - 1) * PAGE_SIZE + 1}-{(page - 1) * PAGE_SIZE + len(positions)} of {count} expenses.")
+    return expenses, mask, positions
+
+
+# View expenses, filtered by category and dates
+@instrument.timed()
 def view_expenses(manager):
     st.subheader("View Expenses")
 
-    # Selection option
-    view_option = st.selectbox(
-        "View by", ["All Expenses", "Category", "Date"]
+    expenses, mask, positions = browse_expenses(manager, "view")
+    if positions is None:
+        st.info("No expenses match these filters.")
+        return
+    st.dataframe(expenses.take(positions).to_frame(), column_config=DATE_COLUMN, hide_index=True)
+    # The total covers every matching expense, not just the page
+    st.write(f"Total: {expenses.total(mask)}")
+
+
+# Modify or delete expenses, one page at a time
+@instrument.timed()
+def modify_expenses(manager):
+    st.subheader("Modify Expenses")
+
+    # Positions must refer to all expenses, so the whole history is loaded here
+    expenses, mask, positions = browse_expenses(manager, "modify", whole_history=True)
+    if positions is None:
+        st.info("No expenses available to modify.")
+        return
+
+    # Display the page as an editable table, the hidden "row" column holds each row's position in all expenses
+    expenses_df = expenses.take(positions).to_frame()
+    expenses_df["category"] = expenses_df["category"].astype(str)  # Free text, not limited to existing categories
+    expenses_df["row"] = positions
+    expenses_df["Delete"] = False
+    edited_df = st.data_editor(
+        expenses_df, num_rows="dynamic", hide_index=True, column_config={**DATE_COLUMN, "row": None},
     )
 
-    # Show all expenses
-    if view_option == "All Expenses":
-        st.write("All Expenses")
-        if manager.expenses:
-            st.dataframe(pd.DataFrame(manager.expenses))
-            st.write(f"Total: {manager.total_expenses()}")
-        else:
-            st.info("No expenses recorded.")
-
-    # Show expenses by category
-    elif view_option == "Category":
-        category = st.selectbox("Select a category", manager.categories)
-        filtered = manager.filter_by_category(category)
-        if filtered:
-            st.dataframe(pd.DataFrame(filtered))
-            total = sum(exp["amount"] for exp in filtered)
-            st.write(f"Total in '{category}': {total}")
+    # Save changes button
+    if st.button("Save Changes"):
+        deleted = edited_df["Delete"].fillna(False).astype(bool)
+        kept = edited_df[~deleted].dropna(subset=["amount", "category", "date"])  # Emptied rows are deleted too
+        # Rows added in the editor have no position and get a new id, the others keep theirs
+        kept_positions = kept["row"].to_numpy(dtype=np.float64, na_value=np.nan)
+        edited = ExpenseColumns.from_frame(kept).to_records()
+        for record, position in zip(edited, kept_positions):
+            record["id"] = new_expense_id() if np.isnan(position) else int(expenses.ids[int(position)])
+        delta = ExpenseDelta.between(expenses.take(positions).to_records(), edited)
+        try:
+            manager.apply_delta(delta)
+        except WriteConflict as error:
+            st.warning(str(error))
         else:
-            st.info(f"No expenses in category '{category}'.")
-
-    # Show expenses by date
-    elif view_option == "Date":
-        selected_date = st.date_input("Select a date")
-        filtered = manager.filter_by_date(str(selected_date))
-        if filtered:
-            st.dataframe(pd.DataFrame(filtered))
-            total = sum(exp["amount"] for exp in filtered)
-            st.write(f"Total on {selected_date}: {total}")
+            st.success(
+                f"Expenses updated successfully! {len(delta.inserted)} added, {len(delta.updated)} changed, "
+                f"{len(delta.deleted)} deleted."
+            )
+
+
+# Import many expenses at once from a CSV file or bank export
+@instrument.timed()
+def import_expenses_page(manager):
+    st.subheader("Import Expenses")
+    st.write("Upload a CSV file with date, amount and (optionally) category columns.")
+
+    uploaded = st.file_uploader("CSV file or bank export", type=["csv", "txt"])
+    negative = st.checkbox("Expenses are negative amounts in this file (common in bank exports)")
+    category_column = st.text_input("Category column", placeholder="category", help="Leave empty to use a column named category or kategori, without one every expense goes to Other.")
+
+    if uploaded is not None and st.button("Import"):
+        status = st.empty()
+        try:
+            report = import_expenses(
+                uploaded,
+                manager,
+                mapping={"category": category_column.strip()} if category_column.strip() else None,
+                negative_expenses=negative,
+                progress=lambda report: status.write(f"{report.imported} rows imported..."),
+            )
+        except ValueError as error:
+            st.error(str(error))
         else:
-            st.info(f"No expenses on {selected_date}.")
+            status.empty()
+            st.success(report.summary())
+            if report.new_categories:
+                st.info(f"New categories: {', '.join(report.new_categories)}")
+            for row_number, message in report.errors:
+                st.warning(f"Row {row_number}: {message}")
 
 
-# Modify or delete expenses
-def modify_expenses(manager):
-    st.subheader("Modify Expenses")
+# Export expenses or the savings history to a file
+@instrument.timed()
+def export_page(manager):
+    st.subheader("Export")
 
-    # Check if expenses exist
-    if manager.expenses:
-        # Display as editable table
-        expenses_df = pd.DataFrame(manager.expenses)
-        expenses_df["Delete"] = False
-        edited_df = st.data_editor(expenses_df, num_rows="dynamic", hide_index=True)
-
-        # Save changes button
-        if st.button("Save Changes"):
-            # Filter out rows marked for deletion
-            updated_expenses = edited_df[~edited_df["Delete"]].to_dict("records")
-            manager.expenses = updated_expenses
-            manager.save_file(EXPENSES_FILE, updated_expenses)
-            st.success("Expenses updated successfully!")
-    else:
-        st.info("No expenses available to modify.")
-        
\ No newline at end of file
+    kind = st.radio("What to export", ["Expenses", "Savings history"], horizontal=True)
+    file_format = st.selectbox("Format", ["csv", "parquet"])
+    start = st.date_input("From", value=None)
+    end = st.date_input("To", value=None)
+    categories = []
+    if kind == "Expenses":
+        categories = st.multiselect("Categories (leave empty for all)", manager.categories)
+
+    if st.button("Prepare export"):
+        output = io.BytesIO()
+        try:
+            count = exporter.export(
+                "expenses" if kind == "Expenses" else "savings",
+                output,
+                file_format,
+                start=start,
+                end=end,
+                categories=categories,
+                backend=manager.backend,
+            )
+        except RuntimeError as error:
+            st.error(str(error))
+        else:
+            st.success(f"{count} rows ready.")
+            st.download_button(
+                "Download",
+                output.getvalue(),
+                file_name=f"{kind.lower().replace(' ', '_')}.{file_format}",
+            )
@@ -0,0 +1,95 @@
+# Export expenses and savings history to CSV or Parquet, one chunk at a time
+import csv
+import io
+import sys
+import ledger
+import storage
+from importer import batched
+
+# Rows per chunk written to the output
+CHUNK_SIZE = 10000
+
+# Columns of each kind of export
+EXPENSE_FIELDS = ("date", "category", "amount")
+SAVINGS_FIELDS = ("date", "amount")
+
+# Yield expenses between two dates, optionally only some categories
+def iter_expense_rows(backend=None, start=None, end=None, categories=None):
+    backend = backend or storage.get_backend()
+    wanted = set(categories) if categories else None
+    for expense in backend.iter_expenses(start, end):
+        if wanted is None or expense["category"] in wanted:
+            yield {"date": expense["date"], "category": expense["category"], "amount": expense["amount"]}
+
+# Yield the total savings after every change between two dates
+def iter_savings_rows(backend=None, start=None, end=None):
+    for day, total in ledger.load_ledger(backend).history(start, end):
+        yield {"date": day, "amount": total}
+
+# Write chunks of rows as CSV to a path or a (text or binary) file object
+def write_csv(chunks, target, fields):
+    file = open(target, "w", newline="") if isinstance(target, str) else target
+    text = file if isinstance(file, io.TextIOBase) else io.TextIOWrapper(file, encoding="utf-8", newline="")
+    try:
+        writer = csv.DictWriter(text, fieldnames=fields)
+        writer.writeheader()
+        rows = 0
+        for chunk in chunks:
+            writer.writerows(chunk)
+            rows += len(chunk)
+        text.flush()
+        return rows
+    finally:
+        if isinstance(target, str):
+            file.close()
+        elif text is not file:
+            text.detach()  # Leave the caller's binary file open
+
+# Write chunks of rows as Parquet, each chunk becomes a row group. Needs pyarrow
+def write_parquet(chunks, target, fields):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export needs pyarrow, install it with 'pip install pyarrow'.")
+    types = {"date": pa.string(), "category": pa.string(), "amount": pa.float64()}
+    schema = pa.schema([(field, types[field]) for field in fields])
+    rows = 0
+    with pq.ParquetWriter(target, schema) as writer:
+        for chunk in chunks:
+            writer.write_table(pa.Table.from_pylist(chunk, schema=schema))
+            rows += len(chunk)
+    return rows
+
+# Export "expenses" or "savings" as "csv" or "parquet", returns the number of rows written
+def export(kind, target, file_format="csv", start=None, end=None, categories=None, chunk_size=CHUNK_SIZE, backend=None):
+    if kind == "expenses":
+        rows, fields = iter_expense_rows(backend, start, end, categories), EXPENSE_FIELDS
+    elif kind == "savings":
+        rows, fields = iter_savings_rows(backend, start, end), SAVINGS_FIELDS
+    else:
+        raise ValueError(f"Unknown export {kind!r}, use 'expenses' or 'savings'.")
+    writers = {"csv": write_csv, "parquet": write_parquet}
+    if file_format not in writers:
+        raise ValueError(f"Unknown format {file_format!r}, use 'csv' or 'parquet'.")
+    return writers[file_format](batched(rows, chunk_size), target, fields)
+
+
+# Run "python exporter.py expenses out.csv [--start DATE] [--end DATE] [--category NAME ...]" to export without the app
+if __name__ == "__main__":
+    arguments = sys.argv[1:]
+    if len(arguments) < 2:
+        print("Usage: python exporter.py expenses|savings OUTPUT.csv|OUTPUT.parquet [--start DATE] [--end DATE] [--category NAME]")
+        sys.exit(1)
+    kind, output = arguments[0], arguments[1]
+    options = {"category": []}
+    rest = arguments[2:]
+    while rest:
+        flag, value = rest.pop(0).lstrip("-"), rest.pop(0)
+        if flag == "category":
+            options["category"].append(value)
+        else:
+            options[flag] = value
+    file_format = "parquet" if output.endswith(".parquet") else "csv"
+    count = export(kind, output, file_format, options.get("start"), options.get("end"), options["category"])
+    print(f"Exported {count} rows to {output}.")
@@ -0,0 +1,233 @@
+# Monte Carlo forecast of goals and budgets. Each simulated future is a sequence of months drawn
+# at random (with replacement) from the user's own past months, so spending per category and
+# savings move together the way they did before. Everything is computed with NumPy arrays over all
+# paths at once, and the paths can be split over a pool of processes
+import multiprocessing
+import sys
+import time
+from datetime import date
+import numpy as np
+import cache
+import goalprogress
+import ledger
+import storage
+from aggregates import load_aggregates
+
+# Simulated futures per forecast, enough for probabilities to about half a percent
+PATHS = 20000
+
+# Months simulated at most, goals ending later are judged at this horizon
+MAX_MONTHS = 120
+
+# Months ahead the savings bands are shown for
+HORIZONS = (3, 6, 12, 18, 24)
+
+# Average length of a month in days, to turn days left into months left
+MONTH_DAYS = 365.25 / 12
+
+# Time a page may spend on a forecast, and the paths simulated first to see how many fit in it
+LATENCY_SECONDS = 0.5
+PILOT_PATHS = 1000
+
+# Goals compared against all paths at once, bounds the memory of one comparison to
+# PATHS * GOAL_CHUNK values
+GOAL_CHUNK = 256
+
+
+# Spending per category and net savings of every complete month, from the first month with an
+# expense or a savings entry up to last month. Months without anything count as zero
+def monthly_history(backend=None, today=None):
+    backend = backend or storage.get_backend()
+    today = today or date.today()
+    totals = load_aggregates(backend)
+    savings_ledger = ledger.load_ledger(backend)
+    current = today.isoformat()[:7]
+    months = sorted(month for month in set(totals.by_month) | {day[:7] for day in savings_ledger.dates} if month < current)
+    if not months:
+        return [], [], np.zeros((0, 0)), np.zeros(0)
+    first = int(months[0][:4]) * 12 + int(months[0][5:7]) - 1
+    last = today.year * 12 + today.month - 2
+    months = [f"{month // 12:04d}-{month % 12 + 1:02d}" for month in range(first, last + 1)]
+    position = {month: index for index, month in enumerate(months)}
+    categories = sorted(totals.by_category)
+    column = {category: index for index, category in enumerate(categories)}
+    spending = np.zeros((len(months), len(categories)))
+    for month, by_category in totals.by_month_category.items():
+        if month in position:
+            for category, entry in by_category.items():
+                spending[position[month], column[category]] = entry[0]
+    savings = np.zeros(len(months))
+    for day, change in zip(savings_ledger.dates, savings_ledger.changes):
+        if day[:7] in position:
+            savings[position[day[:7]]] += change
+    return months, categories, spending, savings
+
+
+# Everything a simulation needs, as plain arrays so it can be sent to other processes
+def forecast_inputs(backend=None, today=None):
+    backend = backend or storage.get_backend()
+    today = today or date.today()
+    months, categories, spending, savings = monthly_history(backend, today)
+    column = {category: index for index, category in enumerate(categories)}
+    progress = goalprogress.load_progress(backend)
+
+    goal_ids, goal_columns, so_far, targets, months_left, spend_less = [], [], [], [], [], []
+    for goal_id, goal in progress.index.goals.items():
+        is_spending = goalprogress.goal_type(goal) == goalprogress.SPEND_LESS
+        if is_spending and goal.get("category") not in column:
+            continue  # Nothing was ever spent in the category, there is no history to draw from
+        if goalprogress.has_window(goal):
+            start = max(date.fromisoformat(goal["start"]), today)
+            days_left = max((date.fromisoformat(goal["end"]) - start).days, 0)
+        else:
+            days_left = max(HORIZONS) * MONTH_DAYS  # Goals without an end date are judged two years out
+        goal_ids.append(goal_id)
+        goal_columns.append(column[goal["category"]] if is_spending else -1)
+        so_far.append(progress.values.get(goal_id, 0.0))
+        targets.append(goal.get("target", 0))
+        months_left.append(days_left / MONTH_DAYS)
+        spend_less.append(is_spending)
+
+    # This month's budgets: what is already spent plus a draw of a whole month scaled to the days left
+    savings_document = backend.load_document(ledger.SAVINGS_DOCUMENT, {})
+    spent_this_month = load_aggregates(backend).month_totals_by_category(today.isoformat()[:7])
+    budget_categories = [category for category in savings_document.get("category_budget", {}) if category in column]
+    next_month = date(today.year + today.month // 12, today.month % 12 + 1, 1)
+    fraction_left = ((next_month - today).days - 1) / (next_month - date(today.year, today.month, 1)).days
+    return {
+        "months": months,
+        "categories": categories,
+        "spending": spending,
+        "savings": savings,
+        "total_savings": savings_document.get("total_savings", 0),
+        "goal_ids": goal_ids,
+        "goal_columns": np.array(goal_columns, dtype=np.int64),
+        "goal_so_far": np.array(so_far, dtype=np.float64),
+        "goal_targets": np.array(targets, dtype=np.float64),
+        "goal_months": np.minimum(np.array(months_left, dtype=np.float64), MAX_MONTHS),
+        "goal_spend_less": np.array(spend_less, dtype=bool),
+        "budget_categories": budget_categories,
+        "budget_columns": np.array([column[category] for category in budget_categories], dtype=np.int64),
+        "budget_spent": np.array([spent_this_month.get(category, 0.0) for category in budget_categories]),
+        "budget_limits": np.array([savings_document["category_budget"][category] for category in budget_categories], dtype=np.float64),
+        "budget_fraction": fraction_left,
+    }
+
+# Amount added over `months_left` months on every path: the whole months drawn first, then a
+# share of the next one. draws is (months, paths) and running its running sum with a zero first,
+# months come first so picking them copies whole rows
+def added_over(draws, running, months_left):
+    whole = np.floor(months_left).astype(np.int64)
+    partial = (months_left - whole)[:, None]
+    next_month = np.minimum(whole, len(draws) - 1)
+    return running[whole] + partial * draws[next_month]
+
+# Simulate `paths` futures and count, per goal and per budget, the paths on which it is met.
+# Also returns the total savings after each of HORIZONS months on every path
+def simulate(inputs, paths, seed=None):
+    rng = np.random.default_rng(seed)
+    history = len(inputs["savings"])
+    goal_months = inputs["goal_months"]
+    length = max(int(np.ceil(goal_months.max())) if len(goal_months) else 0, max(HORIZONS), 1)
+    picks = rng.integers(0, history, size=(length, paths))  # Which past month each future month repeats
+
+    savings_draws = inputs["savings"][picks]
+    savings_running = np.zeros((length + 1, paths))
+    np.cumsum(savings_draws, axis=0, out=savings_running[1:])
+    bands = inputs["total_savings"] + savings_running[list(HORIZONS)]
+
+    goal_hits = np.zeros(len(goal_months), dtype=np.int64)
+    saving_goals = np.flatnonzero(~inputs["goal_spend_less"])
+    for goals, column in [(saving_goals, -1)] + [
+        (np.flatnonzero(inputs["goal_spend_less"] & (inputs["goal_columns"] == column)), column)
+        for column in np.unique(inputs["goal_columns"][inputs["goal_spend_less"]])
+    ]:
+        if column == -1:
+            draws, running = savings_draws, savings_running
+        else:
+            draws = inputs["spending"][:, column][picks]
+            running = np.zeros((length + 1, paths))
+            np.cumsum(draws, axis=0, out=running[1:])
+        for chunk in range(0, len(goals), GOAL_CHUNK):
+            chosen = goals[chunk:chunk + GOAL_CHUNK]
+            final = inputs["goal_so_far"][chosen, None] + added_over(draws, running, goal_months[chosen])
+            targets = inputs["goal_targets"][chosen, None]
+            goal_hits[chosen] = (final <= targets if column != -1 else final >= targets).sum(axis=1)
+
+    this_month = inputs["spending"][picks[0]][:, inputs["budget_columns"]]
+    budget_hits = (inputs["budget_spent"] + inputs["budget_fraction"] * this_month <= inputs["budget_limits"]).sum(axis=0)
+    return goal_hits, budget_hits, bands
+
+def simulate_part(arguments):
+    return simulate(*arguments)
+
+# Probability of meeting every goal and staying within every budget, with savings bands. With
+# processes > 1 the paths are split over a process pool, each part with its own random stream.
+# With a time budget (in seconds) a small run is timed first and only as many more paths are
+# simulated as fit in the budget
+def run_forecast(inputs, paths=PATHS, processes=1, seed=None, time_budget=None):
+    started = time.perf_counter()
+    if len(inputs["savings"]) == 0:
+        return None
+    seeds = np.random.SeedSequence(seed).spawn(max(processes, 2))
+    if processes > 1:
+        sizes = [paths // processes + (part < paths % processes) for part in range(processes)]
+        with multiprocessing.get_context("spawn").Pool(processes) as pool:
+            parts = pool.map(simulate_part, [(inputs, size, part_seed) for size, part_seed in zip(sizes, seeds)])
+    elif time_budget is not None and paths > PILOT_PATHS:
+        parts = [simulate(inputs, PILOT_PATHS, seeds[0])]
+        per_path = (time.perf_counter() - started) / PILOT_PATHS
+        more = min(paths - PILOT_PATHS, int((time_budget - (time.perf_counter() - started)) / per_path))
+        if more > 0:
+            parts.append(simulate(inputs, more, seeds[1]))
+    else:
+        parts = [simulate(inputs, paths, seeds[0])]
+    paths = sum(part[2].shape[1] for part in parts)
+    goal_hits = sum(part[0] for part in parts)
+    budget_hits = sum(part[1] for part in parts)
+    percentiles = np.percentile(np.concatenate([part[2] for part in parts], axis=1), [10, 50, 90], axis=1)
+    return {
+        "paths": paths,
+        "history_months": len(inputs["months"]),
+        "goals": dict(zip(inputs["goal_ids"], (goal_hits / paths).tolist())),
+        "budgets": dict(zip(inputs["budget_categories"], (budget_hits / paths).tolist())),
+        "savings_bands": {months: tuple(percentiles[:, index].tolist()) for index, months in enumerate(HORIZONS)},
+        "seconds": time.perf_counter() - started,
+    }
+
+# Forecast for the data folder, recomputed only when expenses, savings or goals change or a day
+# passes. By default it simulates as many paths as fit in LATENCY_SECONDS, up to `paths`
+def forecast(backend=None, paths=PATHS, processes=1, seed=None, time_budget=LATENCY_SECONDS):
+    backend = backend or storage.get_backend()
+    version = (
+        backend.expenses_version(),
+        backend.document_version(ledger.SAVINGS_DOCUMENT),
+        backend.document_version(goalprogress.GOALS_DOCUMENT),
+        date.today().isoformat(),
+        paths,
+    )
+    return cache.get(("forecast",) + backend.expenses_key(), version,
+                     lambda: run_forecast(forecast_inputs(backend), paths, processes, seed, time_budget))
+
+
+# Run "python forecast.py [--paths 20000] [--processes 1] [--seed N]". A pool only pays off for
+# hundreds of thousands of paths, starting its processes takes about a second
+if __name__ == "__main__":
+    arguments = sys.argv[1:]
+    options = {"paths": PATHS, "processes": 1, "seed": None}
+    while arguments:
+        flag, value = arguments.pop(0).lstrip("-"), arguments.pop(0)
+        options[flag] = int(value)
+    backend = storage.get_backend()
+    result = run_forecast(forecast_inputs(backend), options["paths"], options["processes"], options["seed"])
+    if result is None:
+        print("Not enough history yet, a forecast needs at least one complete month.")
+        sys.exit(1)
+    goals = goalprogress.goal_index(backend).goals
+    print(f"{result['paths']} paths drawn from {result['history_months']} months in {result['seconds'] * 1000:.0f} ms")
+    for goal_id, probability in result["goals"].items():
+        print(f"  goal {goals[goal_id].get('name', 'Unnamed Goal')}: {probability:.1%}")
+    for category, probability in result["budgets"].items():
+        print(f"  budget {category}: {probability:.1%} chance to stay within it this month")
+    for months, (low, middle, high) in result["savings_bands"].items():
+        print(f"  savings in {months} months: {middle:.0f} (10%: {low:.0f}, 90%: {high:.0f})")
@@ -0,0 +1,275 @@
+# Progress of every goal, kept up to date as expenses and savings come in. A savings goal counts
+# what was saved between its start and end date, a spend-less goal what was spent in its category
+# between them. An interval index over the goals' dates finds the goals a new expense or deposit
+# falls in, so only those are touched
+import numpy as np
+import cache
+import ledger
+import storage
+from columns import to_day
+from delta import assign_ids, new_expense_id
+
+# Names of the documents the goals and their progress are saved in
+GOALS_DOCUMENT = "goals"
+PROGRESS_DOCUMENT = "goal_progress"
+
+# Kinds of goals. Goals saved before there were kinds are savings goals without dates
+SAVE = "save"
+SPEND_LESS = "spend_less"
+
+def goal_type(goal):
+    return goal.get("type", SAVE)
+
+# Goals without both dates count everything, like the old goals against the total savings
+def has_window(goal):
+    return bool(goal.get("start")) and bool(goal.get("end"))
+
+# What a goal's progress depends on, the progress of an edited goal is computed again
+def signature(goal):
+    return f"{goal_type(goal)}|{goal.get('start') or ''}|{goal.get('end') or ''}|{goal.get('category') or ''}"
+
+
+# The saved goals with an id each, old goals get one derived from their position
+def load_goals(backend=None):
+    backend = backend or storage.get_backend()
+    goals = [dict(goal) for goal in backend.load_document(GOALS_DOCUMENT, [])]
+    assign_ids(goals, namespace=GOALS_DOCUMENT)
+    return goals
+
+# Save a new goal, returns it with its id. Dates are "YYYY-MM-DD", category only for spend-less goals
+def add_goal(name, target, goal_type=SAVE, start=None, end=None, category=None, backend=None):
+    goal = {"id": new_expense_id(), "name": name, "type": goal_type, "target": target}
+    goal.update({key: str(value) for key, value in (("start", start), ("end", end), ("category", category)) if value is not None})
+
+    def add(goals):
+        goals = [dict(saved) for saved in goals]
+        assign_ids(goals, namespace=GOALS_DOCUMENT)
+        return goals + [goal]
+
+    (backend or storage.get_backend()).update_document(GOALS_DOCUMENT, [], add)
+    return goal
+
+def delete_goal(goal_id, backend=None):
+    def delete(goals):
+        goals = [dict(saved) for saved in goals]
+        assign_ids(goals, namespace=GOALS_DOCUMENT)
+        return [goal for goal in goals if goal["id"] != goal_id]
+
+    (backend or storage.get_backend()).update_document(GOALS_DOCUMENT, [], delete)
+
+
+# Goals sorted by start date. A goal can only contain a day if it starts at most `longest` days
+# before it, so a lookup is two binary searches and a check of the goals in between
+class IntervalIndex:
+    def __init__(self, goals):
+        bounded = sorted((goal for goal in goals if has_window(goal)), key=lambda goal: goal["start"])
+        self.always = [goal["id"] for goal in goals if not has_window(goal)]
+        self.ids = [goal["id"] for goal in bounded]
+        self.starts = np.array([to_day(goal["start"]) for goal in bounded], dtype=np.int64)
+        self.ends = np.array([to_day(goal["end"]) for goal in bounded], dtype=np.int64)
+        self.longest = int((self.ends - self.starts).max()) if bounded else 0
+
+    # Ids of the goals whose dates include a day
+    def containing(self, day):
+        day = to_day(day)
+        low = np.searchsorted(self.starts, day - self.longest, "left")
+        high = np.searchsorted(self.starts, day, "right")
+        positions = low + np.flatnonzero(self.ends[low:high] >= day)
+        return self.always + [self.ids[position] for position in positions.tolist()]
+
+
+# The goals with an interval index of the savings goals and one per category of the spend-less
+# goals. Built once per version of the goals document and shared
+class GoalIndex:
+    def __init__(self, goals):
+        self.goals = {goal["id"]: goal for goal in goals}
+        self.savings = IntervalIndex([goal for goal in goals if goal_type(goal) == SAVE])
+        by_category = {}
+        for goal in goals:
+            if goal_type(goal) == SPEND_LESS:
+                by_category.setdefault(goal.get("category"), []).append(goal)
+        self.spending = {category: IntervalIndex(category_goals) for category, category_goals in by_category.items()}
+
+    # Ids of the goals running on a day, in the order they were saved
+    def active(self, day):
+        running = set(self.savings.containing(day))
+        for category_index in self.spending.values():
+            running.update(category_index.containing(day))
+        return [goal_id for goal_id in self.goals if goal_id in running]
+
+def goal_index(backend=None):
+    backend = backend or storage.get_backend()
+    return cache.get(
+        ("goal_index",) + backend.expenses_key(),
+        backend.document_version(GOALS_DOCUMENT),
+        lambda: GoalIndex(load_goals(backend)),
+    )
+
+
+# Saved or spent amount per goal, with what it was computed from: the number of expenses and
+# the savings ledger entries folded in so far
+class GoalProgress:
+    def __init__(self, index):
+        self.index = index
+        self.values = {}  # goal id -> amount saved or spent, for the goals tracked so far
+        self.count = 0
+        self.savings_entries = 0
+        self.savings_total = 0.0
+        self.goals_version = None
+
+    # Add (sign=1) or remove (sign=-1) an expense from the spend-less goals it falls in
+    def add_expense(self, expense, sign=1):
+        self.count += sign
+        category_index = self.index.spending.get(expense["category"])
+        if category_index is None:
+            return
+        for goal_id in category_index.containing(expense["date"]):
+            if goal_id in self.values:
+                self.values[goal_id] += sign * expense["amount"]
+
+    def apply_delta(self, delta):
+        for expense in delta.deleted:
+            self.add_expense(expense, -1)
+        for old, new in delta.updated:
+            self.add_expense(old, -1)
+            self.add_expense(new, 1)
+        for expense in delta.inserted:
+            self.add_expense(expense, 1)
+
+    # Fold in the ledger entries added since the last call. If the ledger doesn't add up to the
+    # total folded in so far (an entry was put before others), the savings goals are recomputed
+    def add_savings(self, savings_ledger):
+        folded = min(self.savings_entries, len(savings_ledger))
+        if folded < self.savings_entries or abs(savings_ledger.balance_before(folded) - self.savings_total) > 1e-6:
+            tracked = [goal_id for goal_id in self.values if goal_type(self.index.goals[goal_id]) == SAVE]
+            self.compute_savings(tracked, savings_ledger)
+            return
+        for day, change in zip(savings_ledger.dates[folded:], savings_ledger.changes[folded:]):
+            for goal_id in self.index.savings.containing(day):
+                if goal_id in self.values:
+                    self.values[goal_id] += change
+        self.savings_entries = len(savings_ledger)
+        self.savings_total = savings_ledger.total
+
+    # Compute savings goals from scratch, each is a range query on the ledger
+    def compute_savings(self, goal_ids, savings_ledger):
+        for goal_id in goal_ids:
+            goal = self.index.goals[goal_id]
+            self.values[goal_id] = (
+                savings_ledger.change_between(goal["start"], goal["end"]) if has_window(goal) else savings_ledger.total
+            )
+        self.savings_entries = len(savings_ledger)
+        self.savings_total = savings_ledger.total
+
+    # Compute spend-less goals from scratch: per category the expenses are sorted by day and
+    # summed up once, then each goal is the difference of two running sums
+    def compute_spending(self, goal_ids, columns):
+        by_category = {}
+        for goal_id in goal_ids:
+            by_category.setdefault(self.index.goals[goal_id].get("category"), []).append(goal_id)
+        for category, category_goals in by_category.items():
+            code = columns.categories.index(category) if category in columns.categories else -1
+            mask = columns.codes == code
+            order = np.argsort(columns.days[mask], kind="stable")
+            days = columns.days[mask][order]
+            running = np.concatenate(([0.0], np.cumsum(columns.amounts[mask][order])))
+            for goal_id in category_goals:
+                goal = self.index.goals[goal_id]
+                if has_window(goal):
+                    low = np.searchsorted(days, to_day(goal["start"]), "left")
+                    high = np.searchsorted(days, to_day(goal["end"]), "right")
+                    self.values[goal_id] = float(running[high] - running[low])
+                else:
+                    self.values[goal_id] = float(running[-1])
+
+    # (amount so far, target, fraction of the target) of a goal. For a spend-less goal the
+    # fraction is how much of the allowed spending is used
+    def status(self, goal_id):
+        goal = self.index.goals[goal_id]
+        value, target = self.values.get(goal_id, 0.0), goal.get("target", 0)
+        return value, target, min(max(value / target, 0.0), 1.0) if target > 0 else 0.0
+
+    # Saved form, goal ids are strings in JSON
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "savings_entries": self.savings_entries,
+            "savings_total": self.savings_total,
+            "goals_version": self.goals_version,
+            "values": {str(goal_id): value for goal_id, value in self.values.items()},
+            "signatures": {str(goal_id): signature(self.index.goals[goal_id]) for goal_id in self.values},
+        }
+
+    # Values are only kept for goals that still exist and weren't changed
+    @classmethod
+    def from_dict(cls, data, index):
+        progress = cls(index)
+        progress.count = data.get("count", 0)
+        progress.savings_entries = data.get("savings_entries", 0)
+        progress.savings_total = data.get("savings_total", 0.0)
+        progress.goals_version = data.get("goals_version")
+        values, signatures = data.get("values", {}), data.get("signatures", {})
+        for goal_id, goal in index.goals.items():
+            key = str(goal_id)
+            if key in values and signatures.get(key) == signature(goal):
+                progress.values[goal_id] = values[key]
+        return progress
+
+
+# Apply a delta to the saved progress. Called from commit_delta's on_commit together with the
+# aggregates, under the same write lock as the expenses. Nothing is saved before the first
+# load_progress() computes it
+def apply_delta(delta, backend=None):
+    backend = backend or storage.get_backend()
+    data = backend.load_document(PROGRESS_DOCUMENT, None)
+    if data is None:
+        return None
+    progress = GoalProgress.from_dict(data, goal_index(backend))
+    progress.apply_delta(delta)
+    backend.write_document(PROGRESS_DOCUMENT, progress.to_dict())
+    return progress
+
+# Load the saved progress. It is brought up to date under the write lock when the goals changed,
+# savings were added or it doesn't cover every expense
+def load_progress(backend=None):
+    backend = backend or storage.get_backend()
+    data = backend.load_document(PROGRESS_DOCUMENT, None)
+    savings = backend.load_document(ledger.SAVINGS_DOCUMENT, {})
+    if (data is not None and data.get("goals_version") == backend.document_version(GOALS_DOCUMENT)
+            and data.get("count") == backend.count_expenses() and data.get("savings_entries") == ledger.entry_count(savings)):
+        return GoalProgress.from_dict(data, goal_index(backend))
+    return refresh_progress(backend)
+
+# Goals that are new or changed are computed from scratch, the others only take in what was
+# added since. With rebuild everything is computed again
+def refresh_progress(backend=None, rebuild=False):
+    backend = backend or storage.get_backend()
+
+    def refresh(data):
+        index = goal_index(backend)
+        progress = GoalProgress(index) if data is None or rebuild else GoalProgress.from_dict(data, index)
+        count = backend.count_expenses()
+        untracked = [goal_id for goal_id in index.goals if goal_id not in progress.values]
+        spending = [goal_id for goal_id, goal in index.goals.items() if goal_type(goal) == SPEND_LESS
+                    and (goal_id in untracked or progress.count != count)]
+        if spending:
+            goals = [index.goals[goal_id] for goal_id in spending]
+            start = None if not all(has_window(goal) for goal in goals) else min(goal["start"] for goal in goals)
+            end = None if start is None else max(goal["end"] for goal in goals)
+            progress.compute_spending(spending, backend.load_columns(start, end))
+        progress.count = count
+        savings_ledger = ledger.load_ledger(backend)
+        progress.add_savings(savings_ledger)
+        progress.compute_savings([goal_id for goal_id in untracked if goal_type(index.goals[goal_id]) == SAVE], savings_ledger)
+        progress.goals_version = backend.document_version(GOALS_DOCUMENT)
+        return progress.to_dict()
+
+    return GoalProgress.from_dict(backend.update_document(PROGRESS_DOCUMENT, None, refresh), goal_index(backend))
+
+
+# Run "python goalprogress.py" to compute the progress of every goal again
+if __name__ == "__main__":
+    progress = refresh_progress(rebuild=True)
+    for goal_id, goal in progress.index.goals.items():
+        value, target, fraction = progress.status(goal_id)
+        print(f"{goal.get('name', 'Unnamed Goal')}: {value:.2f} of {target} ({fraction:.0%})")
@@ -1,53 +1,36 @@
 # user can set goals and track progress
 import streamlit as st
-import json
+from datetime import date
+import forecast
+import goalprogress
+import instrument
+import storage
 
-EXPENSES_FILE = "data/expenses.json"
-CATEGORY_FILE = "data/expensecatagories.json"
-
-# Function to load expenses from the JSON file
+# Function to load expenses through the storage backend
 
 def load_expenses():
-    try:
-        with open(EXPENSES_FILE, "r") as file:
-            content = file.read().strip()
-            if content:
-                return json.loads(content)
-            else:
-                return []  # Return an empty list if the file is empty
-    except FileNotFoundError:
-        return []  # Return an empty list if the file doesn't exist
-    except json.JSONDecodeError:
-        st.error(f"Error decoding JSON from {EXPENSES_FILE}. Please check the file's content.")
-        return []
-# Function to save expenses back to the JSON file
-def save_expenses(expenses):
-    with open(EXPENSES_FILE, "w") as file:
-        json.dump(expenses, file, indent=4)
-
-# Function to load categories from the JSON file
+    return storage.get_backend().load_expenses()
+# Function to load categories through the storage backend
 def load_categories():
-    try:
-        with open(CATEGORY_FILE, "r") as file:
-            return json.load(file)
-    except FileNotFoundError:
-        return ["Food", "Transport", "Entertainment", "Other"]  # Default categories if the file doesn't exist
+    return storage.get_backend().load_categories()
 
-# Function to save new categories to the JSON file
+# Function to save new categories through the storage backend
 def save_categories(categories):
-    with open(CATEGORY_FILE, "w") as file:
-        json.dump(categories, file, indent=4)
+    storage.get_backend().save_categories(categories)
 
+@instrument.timed()
 def display_goals():
     st.title("🎯 Achieve Goals")
     st.subheader("Welcome to the Goals page, set up and track your goals!")
     set_up_goals()
     st.write("---")  # Divider line
+    show_forecast()
+    st.write("---")  # Divider line
     display_goal_calculator()  
 
+@instrument.timed()
 def set_up_goals():
     categories = load_categories()
-    expenses = load_expenses()
     goal_type = st.selectbox(
     "Step 1 to create your goals",
     ("Save money", "Spend less in specific category"),
@@ -56,15 +39,88 @@ def set_up_goals():
 
     if goal_type == "Save money":
         saving_goal_name = st.text_input("Enter the name of your goal here:")
-        saving_goal_amount = st.number_input("How much would you like to save?")
+        saving_goal_amount = st.number_input("How much would you like to save?", min_value=0.0)
         saving_goal_end_date = st.date_input("Enter when your goal should be reached")
+        if st.button("Save goal"):
+            save_goal(saving_goal_name, saving_goal_amount, goalprogress.SAVE, saving_goal_end_date)
     elif goal_type == "Spend less in specific category":
         spend_less_category = st.selectbox("In what category would you like to focus on?", options = categories)
         spend_less_goal_name = st.text_input("Enter the name of your goal here:")
-        spend_less_goal_amount = st.number_input("How much would you like to save?")
+        spend_less_goal_amount = st.number_input("How much would you like to spend at most?", min_value=0.0)
         spend_less_goal_end_date = st.date_input("Enter when your goal should be reached")
+        if st.button("Save goal"):
+            save_goal(spend_less_goal_name, spend_less_goal_amount, goalprogress.SPEND_LESS, spend_less_goal_end_date, spend_less_category)
+
+    show_goals()
+
+# Save a goal that runs from today until its end date
+def save_goal(name, amount, goal_type, end_date, category=None):
+    if not name or amount <= 0:
+        st.warning("Give your goal a name and an amount first.")
+    elif end_date < date.today():
+        st.warning("The end date of a goal can't be in the past.")
+    else:
+        goalprogress.add_goal(name, amount, goal_type, date.today(), end_date, category)
+        st.success(f"Goal '{name}' saved!")
+
+# List the saved goals with their progress so far
+@instrument.timed()
+def show_goals():
+    progress = goalprogress.load_progress()
+    if not progress.index.goals:
+        return
+    st.subheader("Your goals")
+    for goal_id, goal in progress.index.goals.items():
+        value, target, fraction = progress.status(goal_id)
+        dates = f" ({goal['start']} to {goal['end']})" if goalprogress.has_window(goal) else ""
+        col1, col2 = st.columns([5, 1])
+        with col1:
+            if goalprogress.goal_type(goal) == goalprogress.SPEND_LESS:
+                st.write(f"**{goal.get('name', 'Unnamed Goal')}**{dates}: spent {value:.2f} of {target} on {goal.get('category')}")
+            else:
+                st.write(f"**{goal.get('name', 'Unnamed Goal')}**{dates}: saved {value:.2f} of {target}")
+            st.progress(fraction)
+        with col2:
+            if st.button("Delete", key=f"delete_goal_{goal_id}"):
+                goalprogress.delete_goal(goal_id)
+                st.rerun()
+
+# Chances of reaching the goals and staying within the budgets, from futures simulated out of
+# the months so far
+@instrument.timed()
+def show_forecast():
+    st.subheader("What's likely to happen")
+    result = forecast.forecast()
+    if result is None:
+        st.info("The forecast needs at least one complete month of expenses or savings.")
+        return
+    st.caption(f"Based on {result['paths']} futures made up of your last {result['history_months']} months.")
+
+    goals = goalprogress.goal_index().goals
+    if result["goals"]:
+        st.write("Chance of reaching your goals:")
+        st.dataframe({
+            "Goal": [goals[goal_id].get("name", "Unnamed Goal") for goal_id in result["goals"]],
+            "Chance": [f"{probability:.0%}" for probability in result["goals"].values()],
+        }, hide_index=True)
+    if result["budgets"]:
+        st.write("Chance of staying within your budgets this month:")
+        st.dataframe({
+            "Category": list(result["budgets"]),
+            "Chance": [f"{probability:.0%}" for probability in result["budgets"].values()],
+        }, hide_index=True)
+
+    st.write("Your savings in:")
+    bands = result["savings_bands"]
+    st.dataframe({
+        "Months": list(bands),
+        "Likely": [f"{middle:.2f}" for _, middle, _ in bands.values()],
+        "Low (1 in 10 is worse)": [f"{low:.2f}" for low, _, _ in bands.values()],
+        "High (1 in 10 is better)": [f"{high:.2f}" for _, _, high in bands.values()],
+    }, hide_index=True)
 
 # A goal/budget calculator to help users figure out their goals
+@instrument.timed()
 def display_goal_calculator():
     st.subheader("Need help figuring how much your saving goal?")
     st.write("Use the calculator below to set your savings goal or get a general budget plan.")
@@ -0,0 +1,213 @@
+# Bulk import of expenses from CSV files and bank exports
+import csv
+import io
+import sys
+import time
+from datetime import datetime
+from functools import lru_cache
+from itertools import islice
+
+# Rows written to storage per batch, and how many bad rows are kept for the report
+BATCH_SIZE = 5000
+MAX_ERRORS = 20
+
+# Header names we recognise in CSV files and bank exports (compared in lower case)
+AMOUNT_COLUMNS = ("amount", "belopp", "sum", "summa", "value", "debit", "transaction amount")
+DATE_COLUMNS = ("date", "datum", "transaction date", "booking date", "transaktionsdag", "bokföringsdag", "reskontradatum")
+# Only real category columns: free-text descriptions (merchant, payee, "text") would turn every
+# transaction into a category of its own. Such a column can still be picked with mapping
+CATEGORY_COLUMNS = ("category", "kategori")
+
+# Date formats tried in order when none is given
+DATE_FORMATS = ("%Y-%m-%d", "%Y/%m/%d", "%Y%m%d", "%d.%m.%Y", "%d/%m/%Y", "%d-%m-%Y", "%m/%d/%Y")
+
+# Category used when the file has no category column or the cell is empty
+DEFAULT_CATEGORY = "Other"
+
+
+# Counters and timing for one import
+class ImportReport:
+    def __init__(self):
+        self.rows_read = 0
+        self.imported = 0
+        self.skipped = 0
+        self.batches = 0
+        self.errors = []  # (row number, message), only the first MAX_ERRORS
+        self.new_categories = []
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+
+    def error(self, row_number, message):
+        self.skipped += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append((row_number, message))
+
+    def finish(self):
+        self.seconds = time.perf_counter() - self.started
+
+    @property
+    def rows_per_second(self):
+        return self.rows_read / self.seconds if self.seconds else 0.0
+
+    def summary(self):
+        return (
+            f"Imported {self.imported} of {self.rows_read} rows in {self.batches} batches "
+            f"({self.skipped} skipped) in {self.seconds:.2f}s, {self.rows_per_second:,.0f} rows/sec."
+        )
+
+
+# Open a path or an uploaded (binary) file as text
+def open_text(source, encoding="utf-8-sig"):
+    if isinstance(source, str):
+        return open(source, "r", newline="", encoding=encoding)
+    return io.TextIOWrapper(source, encoding=encoding, newline="")
+
+# Yield the rows of a CSV file one at a time as dicts, the delimiter is guessed from the start of the file
+def read_rows(file, delimiter=None):
+    if delimiter is None:
+        sample = file.read(8192)
+        file.seek(0)
+        try:
+            delimiter = csv.Sniffer().sniff(sample, delimiters=",;\t|").delimiter
+        except csv.Error:
+            delimiter = ","
+    yield from csv.DictReader(file, delimiter=delimiter)
+
+# Pick the amount, date and category columns from a header by their names
+def detect_mapping(header):
+    lowered = {name.strip().lower(): name for name in header if name}
+    mapping = {}
+    for field, candidates in (("amount", AMOUNT_COLUMNS), ("date", DATE_COLUMNS), ("category", CATEGORY_COLUMNS)):
+        for candidate in candidates:
+            if candidate in lowered:
+                mapping[field] = lowered[candidate]
+                break
+    return mapping
+
+# Parse amounts like "1 234,50", "-45.00" or "kr 99", the sign is handled by the caller
+def parse_amount(text):
+    text = "".join(char for char in str(text) if char.isdigit() or char in ",.-")
+    if "," in text and "." in text:
+        # The separator that comes last is the decimal one
+        if text.rfind(",") > text.rfind("."):
+            text = text.replace(".", "").replace(",", ".")
+        else:
+            text = text.replace(",", "")
+    elif "," in text:
+        whole, _, decimals = text.rpartition(",")
+        text = whole.replace(",", "") + ("." + decimals if len(decimals) <= 2 else decimals)
+    return float(text)
+
+# Parse a date into "YYYY-MM-DD", a time after the date is ignored. Statements repeat
+# the same dates many times, so results are cached
+@lru_cache(maxsize=4096)
+def parse_date(text, date_format=None):
+    text = str(text).strip().split(" ")[0].split("T")[0]
+    for candidate in (date_format,) if date_format else DATE_FORMATS:
+        try:
+            return datetime.strptime(text, candidate).date().isoformat()
+        except ValueError:
+            continue
+    raise ValueError(f"unknown date format: {text!r}")
+
+# Map categories onto the existing ones through the manager's registry, which ignores case and
+# spacing. New categories are added to the manager
+def category_normalizer(manager, report):
+    def normalize(name):
+        name = " ".join(str(name or "").split()) or DEFAULT_CATEGORY
+        category = manager.find_category(name)
+        if category is None:
+            category = manager.add_category(name)
+            report.new_categories.append(category)
+        return category
+
+    return normalize
+
+# Turn raw rows into expense dicts, invalid rows are counted in the report and skipped
+def clean_rows(rows, mapping, normalize, report, negative_expenses=False, date_format=None):
+    for row_number, row in enumerate(rows, start=2):  # Row 1 is the header
+        report.rows_read += 1
+        try:
+            amount = parse_amount(row[mapping["amount"]])
+            expense_date = parse_date(row[mapping["date"]], date_format)
+        except (KeyError, ValueError, TypeError) as error:
+            report.error(row_number, str(error))
+            continue
+        if negative_expenses:
+            # Bank exports list money going out as negative amounts, the rest is income
+            if amount >= 0:
+                report.skipped += 1
+                continue
+            amount = -amount
+        if amount <= 0:
+            report.error(row_number, "amount must be positive")
+            continue
+        category = normalize(row.get(mapping["category"]) if "category" in mapping else None)
+        yield {"amount": round(amount, 2), "category": category, "date": expense_date}
+
+# Group an iterator into lists of at most size items
+def batched(items, size):
+    items = iter(items)
+    while batch := list(islice(items, size)):
+        yield batch
+
+# Stream a CSV file into the manager in batches, only one batch is held in memory at a time. Columns
+# given in mapping replace the ones found by their names
+def import_expenses(source, manager=None, mapping=None, batch_size=BATCH_SIZE, negative_expenses=False,
+                    date_format=None, encoding="utf-8-sig", progress=None):
+    if manager is None:
+        from expenses import ExpenseManager
+        manager = ExpenseManager()
+    report = ImportReport()
+    file = open_text(source, encoding)
+    try:
+        rows = read_rows(file)
+        first = next(rows, None)
+        if first is not None:
+            mapping = {**detect_mapping(first.keys()), **(mapping or {})}
+            missing = [field for field in ("amount", "date") if field not in mapping]
+            if missing:
+                raise ValueError(f"Could not find the {' and '.join(missing)} column in the file.")
+            normalize = category_normalizer(manager, report)
+            all_rows = (row for chunk in ([first], rows) for row in chunk)
+            for batch in batched(clean_rows(all_rows, mapping, normalize, report, negative_expenses, date_format), batch_size):
+                manager.add_expenses(batch)
+                report.imported += len(batch)
+                report.batches += 1
+                if progress:
+                    progress(report)
+            manager.compact()  # Seal the months that got journal entries
+    finally:
+        if isinstance(source, str):
+            file.close()
+        else:
+            file.detach()  # Leave the uploaded file open for the caller
+    report.finish()
+    return report
+
+
+# Run "python importer.py statement.csv [--negative] [--date-format %d/%m/%Y]" to import without the app
+if __name__ == "__main__":
+    arguments = sys.argv[1:]
+    if not arguments:
+        print("Usage: python importer.py FILE [--negative] [--date-format FORMAT] [--amount COL --date COL --category COL]")
+        sys.exit(1)
+    path = arguments.pop(0)
+    options = {"negative": False}
+    while arguments:
+        flag = arguments.pop(0)
+        if flag == "--negative":
+            options["negative"] = True
+        else:
+            options[flag.lstrip("-").replace("-", "_")] = arguments.pop(0)
+    columns = {field: options[field] for field in ("amount", "date", "category") if field in options}
+    result = import_expenses(
+        path,
+        mapping=columns or None,
+        negative_expenses=options["negative"],
+        date_format=options.get("date_format"),
+        progress=lambda report: print(f"{report.imported} rows imported...", end="\r"),
+    )
+    print(result.summary())
+    for row_number, message in result.errors:
+        print(f"Row {row_number}: {message}")
@@ -0,0 +1,91 @@
+# Startup report in the style of "python -X importtime": how long a fresh process takes to import
+# what main.py needs before the first page is drawn, eagerly (every page, as main.py used to) and
+# lazily (the page registry and the storage setup in open_data()), and how long each page's first
+# load adds on top
+import ast
+import json
+import os
+import subprocess
+import sys
+from pages import PAGES
+
+# Page modules in sidebar order
+PAGE_MODULES = [module for module, function in PAGES.values()]
+
+# Modules main.py imports, read from its source so the report follows it. The ones imported inside
+# functions count too: open_data() runs on every rerun before the page is drawn
+def startup_modules(path=os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")):
+    with open(path) as file:
+        tree = ast.parse(file.read())
+    modules = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            modules.extend(alias.name for alias in node.names if alias.name not in modules)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module not in modules:
+            modules.append(node.module)
+    return modules
+
+# What a fresh process imports before the first page is shown
+LAZY_STARTUP = "import " + ", ".join(startup_modules())
+EAGER_STARTUP = LAZY_STARTUP + "; import " + ", ".join(PAGE_MODULES)
+
+# Run code in a fresh interpreter with -X importtime, returns (depth, module, cumulative us) per line.
+# Children are listed before the module that imported them, one more level indented
+def import_lines(code):
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    lines = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        name = name[1:]  # One space after the bar, then two per level of nesting
+        depth = (len(name) - len(name.lstrip())) // 2
+        lines.append((depth, name.strip(), int(cumulative)))
+    return lines
+
+# Total of the top-level imports, nested ones are already in their parent's cumulative time
+def total(lines):
+    return sum(cumulative for depth, name, cumulative in lines if depth == 0)
+
+# Lowest total of several runs in milliseconds, the first runs pay for a cold disk cache
+def best_total(code, repeat):
+    return min(total(import_lines(code)) for _ in range(repeat)) / 1000
+
+# Milliseconds a page's first load adds once streamlit and the registry are loaded, and the
+# heaviest modules it imports that weren't loaded yet
+def page_load(module, repeat):
+    runs = [import_lines(f"{LAZY_STARTUP}; import {module}") for _ in range(repeat)]
+    lines = min(runs, key=lambda lines: next(us for depth, name, us in lines if depth == 0 and name == module))
+    end = next(index for index, (depth, name, us) in enumerate(lines) if depth == 0 and name == module)
+    start = max([index + 1 for index, (depth, name, us) in enumerate(lines[:end]) if depth == 0] or [0])
+    children = [(name, us / 1000) for depth, name, us in lines[start:end] if depth == 1]
+    return lines[end][2] / 1000, sorted(children, key=lambda child: -child[1])[:3]
+
+def report(repeat=3):
+    pages = {}
+    for module in PAGE_MODULES:
+        milliseconds, heaviest = page_load(module, repeat)
+        pages[module] = {"first_load_ms": milliseconds, "heaviest": heaviest}
+    return {
+        "eager_startup_ms": best_total(EAGER_STARTUP, repeat),
+        "lazy_startup_ms": best_total(LAZY_STARTUP, repeat),
+        "pages": pages,
+    }
+
+
+# Run "python importreport.py [--repeat 3] [--json]"
+if __name__ == "__main__":
+    arguments = sys.argv[1:]
+    repeat = int(arguments[arguments.index("--repeat") + 1]) if "--repeat" in arguments else 3
+    result = report(repeat)
+    if "--json" in arguments:
+        print(json.dumps(result))
+    else:
+        print(f"Cold start, every page imported up front: {result['eager_startup_ms']:8.1f} ms")
+        print(f"Cold start, pages imported when opened:    {result['lazy_startup_ms']:8.1f} ms")
+        print("First load of each page after a lazy start:")
+        for module, page in result["pages"].items():
+            heaviest = ", ".join(f"{name} {milliseconds:.0f} ms" for name, milliseconds in page["heaviest"])
+            print(f"  {module:15} {page['first_load_ms']:8.1f} ms  ({heaviest})")
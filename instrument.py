@@ -0,0 +1,198 @@
+# Hot-path instrumentation: wall time, JSON bytes read and written, file opens and DataFrame
+# constructions per page and per instrumented function. Off unless EXPENSE_TRACKER_PROFILE=1 is
+# set or enable() is called; while off, an instrumented call costs one extra function call
+import builtins
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+# Environment variable that turns instrumentation on at startup
+PROFILE_ENV = "EXPENSE_TRACKER_PROFILE"
+
+# Finished spans kept for the trace, and durations kept per name for the rolling percentiles
+TRACE_SIZE = 5000
+WINDOW_SIZE = 200
+
+# What is counted inside a span
+COUNTERS = ("json_bytes_read", "json_bytes_written", "file_opens", "dataframes")
+
+_enabled = False
+_lock = threading.Lock()
+_local = threading.local()  # counters and open spans of the current thread, i.e. one session's rerun
+_trace = deque(maxlen=TRACE_SIZE)  # finished spans, oldest first
+_windows = {}  # span name -> deque of recent finished spans
+_originals = {}  # functions replaced while enabled, to put back on disable()
+_started = time.perf_counter()
+
+
+def enabled():
+    return _enabled
+
+# Add to a counter of the current thread, does nothing while disabled
+def add(counter, amount=1):
+    if not _enabled:
+        return
+    counters = getattr(_local, "counters", None)
+    if counters is None:
+        counters = _local.counters = dict.fromkeys(COUNTERS, 0)
+    counters[counter] += amount
+
+def thread_counters():
+    counters = getattr(_local, "counters", None)
+    if counters is None:
+        counters = _local.counters = dict.fromkeys(COUNTERS, 0)
+    return counters
+
+
+# Time a block and record what it read and wrote. Spans nest: a page's span includes the
+# functions it calls, and each of those is recorded on its own too
+class span:
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        if not _enabled:
+            self.start = None
+            return self
+        stack = getattr(_local, "stack", None)
+        if stack is None:
+            stack = _local.stack = []
+        self.depth = len(stack)
+        stack.append(self.name)
+        self.counters = dict(thread_counters())
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.start is None:
+            return False
+        end = time.perf_counter()
+        _local.stack.pop()
+        counters = thread_counters()
+        record = {
+            "name": self.name,
+            "start": self.start - _started,
+            "ms": (end - self.start) * 1000,
+            "depth": self.depth,
+            "thread": threading.get_ident(),
+        }
+        for counter in COUNTERS:
+            record[counter] = counters[counter] - self.counters[counter]
+        with _lock:
+            _trace.append(record)
+            _windows.setdefault(self.name, deque(maxlen=WINDOW_SIZE)).append(record)
+        return False
+
+# Decorator that records every call of a function as a span named after it
+def timed(name=None):
+    def decorate(function):
+        label = name or f"{function.__module__}.{function.__qualname__}"
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with span(label):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+# File opens and DataFrame constructions are counted by wrapping open() and DataFrame.__init__,
+# only while enabled so there is no cost otherwise
+def enable():
+    global _enabled
+    import pandas as pd
+    with _lock:
+        if _enabled:
+            return
+        _originals["open"] = builtins.open
+        _originals["DataFrame.__init__"] = pd.DataFrame.__init__
+        original_open, original_init = builtins.open, pd.DataFrame.__init__
+
+        @functools.wraps(original_open)
+        def counting_open(*args, **kwargs):
+            add("file_opens")
+            return original_open(*args, **kwargs)
+
+        @functools.wraps(original_init)
+        def counting_init(self, *args, **kwargs):
+            add("dataframes")
+            original_init(self, *args, **kwargs)
+
+        builtins.open = counting_open
+        pd.DataFrame.__init__ = counting_init
+        _enabled = True
+
+def disable():
+    global _enabled
+    import pandas as pd
+    with _lock:
+        if not _enabled:
+            return
+        builtins.open = _originals.pop("open")
+        pd.DataFrame.__init__ = _originals.pop("DataFrame.__init__")
+        _enabled = False
+
+def reset():
+    with _lock:
+        _trace.clear()
+        _windows.clear()
+
+
+# p50/p90/p99 of the recent durations of every span name, with the average of each counter
+def summary():
+    with _lock:
+        windows = {name: list(records) for name, records in _windows.items()}
+    rows = []
+    for name, records in sorted(windows.items()):
+        durations = sorted(record["ms"] for record in records)
+        row = {
+            "name": name,
+            "calls": len(records),
+            "p50_ms": percentile(durations, 0.50),
+            "p90_ms": percentile(durations, 0.90),
+            "p99_ms": percentile(durations, 0.99),
+        }
+        for counter in COUNTERS:
+            row[counter] = sum(record[counter] for record in records) / len(records)
+        rows.append(row)
+    return rows
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+# The recorded spans in the Chrome trace event format, which chrome://tracing and Perfetto open
+def trace_events():
+    with _lock:
+        records = list(_trace)
+    events = [
+        {
+            "name": record["name"],
+            "ph": "X",
+            "ts": record["start"] * 1_000_000,
+            "dur": record["ms"] * 1000,
+            "pid": os.getpid(),
+            "tid": record["thread"],
+            "args": {counter: record[counter] for counter in COUNTERS},
+        }
+        for record in records
+    ]
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+def export_trace(target):
+    data = json.dumps(trace_events())
+    if isinstance(target, str):
+        with open(target, "w") as file:
+            file.write(data)
+    else:
+        target.write(data.encode())
+
+
+if os.environ.get(PROFILE_ENV) == "1":
+    enable()
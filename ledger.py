@@ -0,0 +1,158 @@
+# Savings as a ledger of signed changes, saved in the savings document. Every CHECKPOINT_EVERY
+# entries the running total is kept as a checkpoint, so the balance on any date is found with a
+# binary search and at most CHECKPOINT_EVERY additions, and the current total is stored as is
+import bisect
+from datetime import date
+import storage
+
+# Name of the document the ledger is saved in, with the budget figures
+SAVINGS_DOCUMENT = "savings"
+
+# Entries between two checkpoints
+CHECKPOINT_EVERY = 64
+
+# Tokens of the last deposits saved by add_deposits, kept in the savings document
+DEPOSIT_TOKENS = "deposit_tokens"
+DEPOSIT_TOKENS_KEPT = 1000
+
+
+# Changes in date order, each with the date it happened on
+class SavingsLedger:
+    def __init__(self, dates=None, changes=None):
+        self.dates = list(dates or [])  # "YYYY-MM-DD", sorted
+        self.changes = list(changes or [])
+        self.checkpoints = [0.0]  # checkpoints[n] is the total of the first n * CHECKPOINT_EVERY changes
+        self.total = 0.0
+        self.rebuild_checkpoints()
+
+    def __len__(self):
+        return len(self.changes)
+
+    # Recompute the checkpoints from the one before position onwards, and the total
+    def rebuild_checkpoints(self, position=0):
+        block = position // CHECKPOINT_EVERY
+        del self.checkpoints[block + 1:]
+        running = self.checkpoints[block]
+        for index in range(block * CHECKPOINT_EVERY, len(self.changes)):
+            running += self.changes[index]
+            if (index + 1) % CHECKPOINT_EVERY == 0:
+                self.checkpoints.append(running)
+        self.total = running
+
+    # Record a deposit (positive) or withdrawal (negative), today by default. Entries for an
+    # earlier date are put in order, which recomputes the checkpoints after them
+    def add(self, amount, day=None):
+        day = str(day or date.today())[:10]
+        position = bisect.bisect_right(self.dates, day)
+        self.dates.insert(position, day)
+        self.changes.insert(position, amount)
+        if position == len(self.changes) - 1:
+            self.total += amount
+            if len(self.changes) % CHECKPOINT_EVERY == 0:
+                self.checkpoints.append(self.total)
+        else:
+            self.rebuild_checkpoints(position)
+
+    # Total of the changes before an entry position
+    def balance_before(self, position):
+        block = position // CHECKPOINT_EVERY
+        return self.checkpoints[block] + sum(self.changes[block * CHECKPOINT_EVERY:position])
+
+    # Savings at the end of a day
+    def balance_at(self, day):
+        return self.balance_before(bisect.bisect_right(self.dates, str(day)[:10]))
+
+    # Net change from the start of one day to the end of another
+    def change_between(self, start, end):
+        return self.balance_at(end) - self.balance_before(bisect.bisect_left(self.dates, str(start)[:10]))
+
+    # (date, total after the entry) of every entry between two dates, both optional
+    def history(self, start=None, end=None):
+        low = 0 if start is None else bisect.bisect_left(self.dates, str(start)[:10])
+        high = len(self.dates) if end is None else bisect.bisect_right(self.dates, str(end)[:10])
+        running = self.balance_before(low)
+        points = []
+        for index in range(low, high):
+            running += self.changes[index]
+            points.append((self.dates[index], running))
+        return points
+
+    # Saved form. The checkpoints are saved too so loading doesn't have to add everything up
+    def to_dict(self):
+        return {"dates": list(self.dates), "changes": list(self.changes), "checkpoints": list(self.checkpoints), "total": self.total}
+
+    # Loaded documents may be shared through the cache, so the lists are copied
+    @classmethod
+    def from_dict(cls, data):
+        ledger = cls.__new__(cls)
+        ledger.dates = list(data.get("dates", []))
+        ledger.changes = list(data.get("changes", []))
+        ledger.checkpoints = list(data.get("checkpoints", [0.0]))
+        ledger.total = data.get("total", 0.0)
+        if len(ledger.checkpoints) != len(ledger.changes) // CHECKPOINT_EVERY + 1:
+            ledger.checkpoints = [0.0]
+            ledger.rebuild_checkpoints()
+        return ledger
+
+    # The ledger of an old savings document, whose history held the total after every deposit.
+    # Money added to the total without a history entry (a moved budget) is recorded today
+    @classmethod
+    def from_history(cls, history, total=None):
+        ledger = cls()
+        previous = 0.0
+        for entry in history:
+            ledger.add(entry["amount"] - previous, entry["date"])
+            previous = entry["amount"]
+        if total is not None and total != ledger.total:
+            ledger.add(total - ledger.total)
+        return ledger
+
+
+# The ledger of a savings document, old documents are converted on the fly
+def ledger_of(savings):
+    if "ledger" in savings:
+        return SavingsLedger.from_dict(savings["ledger"])
+    return SavingsLedger.from_history(savings.get("history", []), savings.get("total_savings"))
+
+# Number of entries in a savings document's ledger, without loading it
+def entry_count(savings):
+    if "ledger" in savings:
+        return len(savings["ledger"].get("changes", []))
+    return len(ledger_of(savings))
+
+# The savings document with the ledger stored in it. total_savings is kept next to it for the
+# pages that only show the total
+def with_ledger(savings, ledger):
+    document = {key: value for key, value in savings.items() if key != "history"}
+    document["ledger"] = ledger.to_dict()
+    document["total_savings"] = ledger.total
+    return document
+
+def load_ledger(backend=None):
+    return ledger_of((backend or storage.get_backend()).load_document(SAVINGS_DOCUMENT, {}))
+
+# Add a change to the latest saved ledger, under the write lock. With expected_version the write
+# fails with WriteConflict if the savings changed since they were shown
+def deposit(amount, day=None, backend=None, expected_version=None):
+    def add(savings):
+        ledger = ledger_of(savings)
+        ledger.add(amount, day)
+        return with_ledger(savings, ledger)
+
+    backend = backend or storage.get_backend()
+    return backend.update_document(SAVINGS_DOCUMENT, {}, add, expected_version)
+
+# Write-behind handler (see writebehind.py) for deposits queued by the savings page, all saved in one
+# write. Each deposit has a token, deposits whose token is already saved are skipped so a replay
+# after a crash doesn't add them twice
+def add_deposits(backend, deposits):
+    def add(savings):
+        tokens = list(savings.get(DEPOSIT_TOKENS, []))
+        ledger = ledger_of(savings)
+        for deposit in deposits:
+            if deposit["token"] not in tokens:
+                ledger.add(deposit["amount"], deposit["day"])
+                tokens.append(deposit["token"])
+        return {**with_ledger(savings, ledger), DEPOSIT_TOKENS: tokens[-DEPOSIT_TOKENS_KEPT:]}
+
+    backend.update_document(SAVINGS_DOCUMENT, {}, add)
@@ -0,0 +1,146 @@
+# Load test for the write path: many sessions adding expenses and savings at once, in threads
+# (like Streamlit sessions) and optionally in several processes. Reports commits per second and
+# checks that no write was lost. Runs on a copy of the data folder unless --data is given
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import date
+
+import aggregates
+import ledger
+import storage
+import writes
+
+# Defaults for the command line options
+OPTIONS = {"sessions": 16, "writes": 50, "processes": 1, "backend": "json", "data": None}
+
+
+# One simulated session: every write is either an expense (a delta plus an aggregates update
+# for the coordinator) or a savings deposit, alternately
+def run_session(data_dir, session, count, latencies):
+    from expenses import ExpenseManager
+    backend = storage.get_backend(data_dir)
+    manager = ExpenseManager(backend)
+    for number in range(count):
+        started = time.perf_counter()
+        if number % 2 == 0:
+            manager.add_expense(1.0, "Load test", date.today())
+        else:
+            ledger.deposit(1.0, backend=backend)
+        latencies.append(time.perf_counter() - started)
+    backend.close()
+
+# Run the sessions of one process in threads, returns the latencies and the coordinator's counters
+def run_process(data_dir, sessions, count, results=None):
+    latencies = []
+    threads = [threading.Thread(target=run_session, args=(data_dir, session, count, latencies)) for session in range(sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    outcome = {"latencies": latencies, "stats": writes.coordinator(storage.get_backend(data_dir).lock_path()).stats()}
+    if results is not None:
+        results.put(outcome)
+    return outcome
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)] if values else 0.0
+
+# Run the whole test and return a dict of results
+def run(sessions=16, writes_per_session=50, processes=1, backend="json", data_dir=None):
+    os.environ[storage.BACKEND_ENV] = backend
+    temporary = data_dir is None
+    if temporary:
+        data_dir = tempfile.mkdtemp(prefix="expensetracker-loadtest-")
+        shutil.copytree(storage.DATA_DIR, data_dir, dirs_exist_ok=True)
+        if backend == "sqlite":
+            storage.migrate_json_to_sqlite(data_dir)
+    try:
+        before = storage.get_backend(data_dir)
+        expenses_before = before.count_expenses()
+        savings_before = before.load_document("savings", {}).get("total_savings", 0)
+        before.close()
+
+        started = time.perf_counter()
+        if processes == 1:
+            outcomes = [run_process(data_dir, sessions, writes_per_session)]
+        else:
+            results = multiprocessing.Queue()
+            workers = [
+                multiprocessing.Process(target=run_process, args=(data_dir, sessions, writes_per_session, results))
+                for _ in range(processes)
+            ]
+            for worker in workers:
+                worker.start()
+            outcomes = [results.get() for _ in workers]
+            for worker in workers:
+                worker.join()
+        seconds = time.perf_counter() - started
+
+        # Every write must be there: half are expenses and half savings deposits
+        total_sessions = sessions * processes
+        expected_expenses = total_sessions * ((writes_per_session + 1) // 2)
+        expected_savings = total_sessions * (writes_per_session // 2)
+        after = storage.get_backend(data_dir)
+        lost_expenses = expenses_before + expected_expenses - after.count_expenses()
+        lost_savings = savings_before + expected_savings - after.load_document("savings", {}).get("total_savings", 0)
+        aggregate_problems = aggregates.check_aggregates(after, repair=False)
+        after.close()
+
+        latencies = [latency for outcome in outcomes for latency in outcome["latencies"]]
+        commits = sum(outcome["stats"]["commits"] for outcome in outcomes)
+        queued = sum(outcome["stats"]["writes"] for outcome in outcomes)
+        groups = sum(outcome["stats"]["groups"] for outcome in outcomes)
+        return {
+            "backend": backend,
+            "sessions": total_sessions,
+            "processes": processes,
+            "writes": len(latencies),
+            "seconds": seconds,
+            "writes_per_second": len(latencies) / seconds,
+            "commits": commits,
+            "commits_per_second": commits / seconds,
+            "writes_per_group": queued / groups if groups else 0.0,
+            "latency_p50_ms": percentile(latencies, 0.5) * 1000,
+            "latency_p99_ms": percentile(latencies, 0.99) * 1000,
+            "lost_expenses": lost_expenses,
+            "lost_savings": lost_savings,
+            "aggregate_problems": len(aggregate_problems),
+        }
+    finally:
+        if temporary:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+
+# Run "python loadtest.py [--sessions 16] [--writes 50] [--processes 1] [--backend json|sqlite] [--data DIR] [--json]"
+if __name__ == "__main__":
+    arguments = sys.argv[1:]
+    options = dict(OPTIONS)
+    as_json = "--json" in arguments
+    if as_json:
+        arguments.remove("--json")
+    while arguments:
+        flag, value = arguments.pop(0).lstrip("-"), arguments.pop(0)
+        if flag not in options:
+            print(f"Unknown option --{flag}")
+            sys.exit(1)
+        options[flag] = value if flag in ("backend", "data") else int(value)
+    result = run(options["sessions"], options["writes"], options["processes"], options["backend"], options["data"])
+    if as_json:
+        print(json.dumps(result))
+    else:
+        print(
+            f"{result['writes']} writes from {result['sessions']} sessions in {result['seconds']:.2f}s: "
+            f"{result['writes_per_second']:,.0f} writes/sec, {result['commits_per_second']:,.0f} commits/sec, "
+            f"{result['writes_per_group']:.1f} writes per group commit"
+        )
+        print(f"Latency p50 {result['latency_p50_ms']:.1f} ms, p99 {result['latency_p99_ms']:.1f} ms")
+        print(f"Lost expenses: {result['lost_expenses']}, lost savings: {result['lost_savings']}, "
+              f"aggregate mismatches: {result['aggregate_problems']}")
+    sys.exit(1 if result["lost_expenses"] or result["lost_savings"] or result["aggregate_problems"] else 0)
@@ -4,49 +4,50 @@
 
 
 
-#importing libraries needed
+#importing libraries needed, the pages themselves are imported when they are first opened
 import streamlit as st
-from budget import display_budget
-from expenses import display_expenses
-from goals import display_goals
-from randomtips import display_random_tips
-from savings import display_savings
-from visualization import display_visualizations
+import instrument
+from pages import PAGES, load_page
+
+# Each user (household) has their own data folder, the one picked here is used for this session.
+# A link can pick it too, with ?user=name
+st.session_state.setdefault("user", st.query_params.get("user", ""))
+st.sidebar.text_input("User", key="user", placeholder="Shared", help="Leave empty to use the shared data.")
+
+# Storage and everything under it (NumPy, SQLite, the aggregates) is imported here, so the sidebar
+# is drawn before it is loaded. It still runs before the page, importreport.py counts it as startup
+def open_data(user):
+    import monthclose
+    import storage
+    import tenants
+    import writebehind
+    tenants.enter(user)
+
+    # Forms queue their saves and return straight away, a background thread writes them. Each rerun
+    # first waits for this folder's queued saves, so pages always show what was just added
+    writebehind.start()
+    with instrument.span("write-behind flush"):
+        for error in writebehind.flush(storage.current_data_dir()):
+            st.error(f"A change could not be saved and will be retried on restart: {error}")
+
+    # Move what was left of the budget of the months that are over into savings, does nothing once
+    # they are closed
+    with instrument.span("month close"):
+        monthclose.close_months()
 
 # Sidebar Navigation
 st.sidebar.title("Navigation")
 page = st.sidebar.radio(
     "Choose a page",
-    [
-        "📂 Dashboard",  # The first (home) page of the program
-        "💰 Budget Mastery",
-        "💸 Expense Tracker",
-        "🎯 Achieve Goals",
-        "💡 Money Hacks",
-        "🏦 Savings Vault",
-        "📊 Insights & Charts",
-    ],
+    list(PAGES),  # The first entry, the Dashboard, is the home page of the program
     index=0  # Set the default so when entering the program you arrive at dashboard
 )
 
+open_data(st.session_state["user"])
+
 # Loading the correct file when side bar navigation is choicen
-if page == "📂 Dashboard":
-    st.title("📂 Dashboard")
-    st.write("Welcome to your dashboard! We are here for you to make sure you follow and track your expenses, we know how hard it can be!")
-    # have some top metrics shown like total spendings, total savings, last added expense, remaning of total budget for the month
-    # lates months spending trends as visuals
-elif page == "💰 Budget Mastery":
-    display_budget()
-elif page == "💸 Expense Tracker":
-    display_expenses()
-elif page == "🎯 Achieve Goals":
-    display_goals()
-elif page == "💡 Money Hacks":
-    display_random_tips()
-elif page == "🏦 Savings Vault":
-    display_savings()
-elif page == "📊 Insights & Charts":
-    display_visualizations()
+with instrument.span("page " + page):  # Records nothing unless instrumentation is on
+    load_page(page)()
 
 
 
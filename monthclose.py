@@ -0,0 +1,115 @@
+# Month close: when a month is over, what was left of its budget goes into the savings ledger.
+# The leftover of a month is the income that wasn't allocated plus, per category, the budget
+# minus what was actually spent. The last closed month is kept in the savings document, in the
+# same write as the ledger entries, so running it again never moves money twice and a run after
+# a long break closes every month that was missed
+import os
+import sys
+from datetime import date, timedelta
+import ledger
+import storage
+from aggregates import load_aggregates
+
+# Keys of the savings document used here
+CLOSED_THROUGH = "closed_through"  # Last month closed, "YYYY-MM"
+CLOSED_MONTHS = "closed_months"  # "YYYY-MM" -> amount moved to savings
+BUDGETS = "budgets"  # "YYYY-MM" -> the budget set that month
+
+
+def month_key(day):
+    return day.isoformat()[:7]
+
+def next_month(month):
+    year, number = int(month[:4]), int(month[5:7])
+    return f"{year + number // 12:04d}-{number % 12 + 1:02d}"
+
+def last_day(month):
+    return date.fromisoformat(next_month(month) + "-01") - timedelta(days=1)
+
+# The budget a month was planned with: the last one set in or before it. Savings documents from
+# before budgets were kept per month only have the current one
+def budget_for(savings, month):
+    earlier = [key for key in savings.get(BUDGETS, {}) if key <= month]
+    if earlier:
+        return savings[BUDGETS][max(earlier)]
+    return {"category_budget": savings.get("category_budget", {}), "remaining_budget": savings.get("remaining_budget", 0)}
+
+# Money left of a month's budget, never negative: going over budget doesn't take from savings
+def leftover(budget, spent_by_category):
+    left = budget.get("remaining_budget", 0) or 0
+    for category, amount in budget.get("category_budget", {}).items():
+        left += amount - spent_by_category.get(category, 0.0)
+    return round(max(left, 0.0), 2)
+
+# "Reset Now": the income that wasn't allocated goes to savings today. The month's own budget loses
+# it too, or closing the month would move it a second time
+def reset(savings, today=None):
+    month = month_key(today or date.today())
+    savings_ledger = ledger.ledger_of(savings)
+    savings_ledger.add(savings.get("remaining_budget", 0), today)
+    document = {**ledger.with_ledger(savings, savings_ledger), "remaining_budget": 0}
+    if savings.get(BUDGETS):
+        document[BUDGETS] = {**savings[BUDGETS], month: {**budget_for(savings, month), "remaining_budget": 0}}
+    return document
+
+# Months that are over and not closed yet. Without a closed month the first one is the month a
+# budget was first set in, or last month for budgets set before they were kept per month
+def months_to_close(savings, today=None):
+    last = month_key((today or date.today()).replace(day=1) - timedelta(days=1))
+    if savings.get(CLOSED_THROUGH):
+        month = next_month(savings[CLOSED_THROUGH])
+    elif savings.get(BUDGETS):
+        month = min(savings[BUDGETS])
+    elif savings.get("category_budget") or savings.get("remaining_budget"):
+        month = last
+    else:
+        return []
+    months = []
+    while month <= last:
+        months.append(month)
+        month = next_month(month)
+    return months
+
+# Close every month that is over. Spending per month comes from the aggregates, loaded once for
+# all months. Returns {month: amount moved}, empty when there was nothing to close
+def close_months(backend=None, today=None):
+    backend = backend or storage.get_backend()
+    if not months_to_close(backend.load_document(ledger.SAVINGS_DOCUMENT, {}), today):
+        return {}
+    totals = load_aggregates(backend)
+    moved = {}
+
+    def close(savings):
+        moved.clear()
+        months = months_to_close(savings, today)
+        if not months:
+            return savings
+        savings_ledger = ledger.ledger_of(savings)
+        for month in months:
+            moved[month] = leftover(budget_for(savings, month), totals.month_totals_by_category(month))
+            if moved[month] > 0:
+                savings_ledger.add(moved[month], last_day(month))
+        document = ledger.with_ledger(savings, savings_ledger)
+        document[CLOSED_THROUGH] = months[-1]
+        document[CLOSED_MONTHS] = {**savings.get(CLOSED_MONTHS, {}), **moved}
+        return document
+
+    backend.update_document(ledger.SAVINGS_DOCUMENT, {}, close)
+    return moved
+
+
+# Run "python monthclose.py [DATA_DIR ...]" to close the months of one or more data folders, by
+# default the shared one and every user's
+if __name__ == "__main__":
+    import tenants
+    for data_dir in sys.argv[1:] or [storage.DATA_DIR] + [os.path.join(tenants.USERS_DIR, user) for user in tenants.list_users()]:
+        if not os.path.isdir(data_dir):
+            print(f"{data_dir}: no such folder")
+            continue
+        backend = storage.get_backend(data_dir)
+        moved = close_months(backend)
+        if moved:
+            print(f"{data_dir}: closed {', '.join(moved)}, moved {sum(moved.values()):.2f} to savings")
+        else:
+            print(f"{data_dir}: nothing to close")
+        backend.close()
@@ -0,0 +1,34 @@
+# Registry of the pages in the sidebar. A page's module (and with it pandas, matplotlib and the
+# streamlit components it uses) is imported the first time the page is opened, not at startup
+import importlib
+import threading
+import time
+import instrument
+
+# Sidebar label -> (module, function that shows the page). The first one is the home page
+PAGES = {
+    "📂 Dashboard": ("dashboard", "display_dashboard"),
+    "💰 Budget Mastery": ("budget", "display_budget"),
+    "💸 Expense Tracker": ("expenses", "display_expenses"),
+    "🎯 Achieve Goals": ("goals", "display_goals"),
+    "💡 Money Hacks": ("randomtips", "display_random_tips"),
+    "🏦 Savings Vault": ("savings", "display_savings"),
+    "📊 Insights & Charts": ("visualization", "display_visualizations"),
+}
+
+# Timings and I/O of the pages, only listed when the app runs with instrumentation on
+if instrument.enabled():
+    PAGES["⏱️ Performance"] = ("performance", "display_performance")
+
+_lock = threading.Lock()
+load_times = {}  # module -> seconds its first import took in this process
+
+# The function that shows a page, importing its module on first use
+def load_page(label):
+    module_name, function_name = PAGES[label]
+    with _lock:
+        if module_name not in load_times:
+            started = time.perf_counter()
+            importlib.import_module(module_name)
+            load_times[module_name] = time.perf_counter() - started
+    return getattr(importlib.import_module(module_name), function_name)
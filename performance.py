@@ -0,0 +1,65 @@
+# Performance page: rolling timings and I/O of the pages and the functions they call, the caches
+# and the write coordinator, with the recorded spans as a downloadable trace. Listed in the
+# sidebar when the app runs with EXPENSE_TRACKER_PROFILE=1
+import json
+import streamlit as st
+import pandas as pd
+import cache
+import charts
+import instrument
+import pages
+import storage
+import tenants
+import writebehind
+
+# Column headers of the timings table
+SUMMARY_COLUMNS = {
+    "name": "Page or function",
+    "calls": "Calls",
+    "p50_ms": "p50 ms",
+    "p90_ms": "p90 ms",
+    "p99_ms": "p99 ms",
+    "json_bytes_read": "JSON read (bytes)",
+    "json_bytes_written": "JSON written (bytes)",
+    "file_opens": "File opens",
+    "dataframes": "DataFrames",
+}
+
+
+def display_performance():
+    st.title("⏱️ Performance")
+    st.write(f"Percentiles over the last {instrument.WINDOW_SIZE} calls of each page and function, "
+             "bytes, file opens and DataFrames are averages per call and include what nested calls did.")
+
+    recording = st.toggle("Record", value=instrument.enabled())
+    if recording and not instrument.enabled():
+        instrument.enable()
+    elif not recording and instrument.enabled():
+        instrument.disable()
+
+    rows = instrument.summary()
+    if rows:
+        st.dataframe(pd.DataFrame(rows).rename(columns=SUMMARY_COLUMNS), hide_index=True, width="stretch",
+                     column_config={label: st.column_config.NumberColumn(format="%.1f")
+                                    for key, label in SUMMARY_COLUMNS.items() if key not in ("name", "calls")})
+    else:
+        st.info("Nothing recorded yet, open some pages first.")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button("Download trace", json.dumps(instrument.trace_events()), file_name="expensetracker-trace.json",
+                           mime="application/json", help="Chrome trace event format, open it in Perfetto or chrome://tracing")
+    with col2:
+        if st.button("Clear recordings"):
+            instrument.reset()
+            st.rerun()
+
+    st.subheader("Caches and writes")
+    st.json({
+        "data cache": cache.stats(),
+        "chart cache": charts.stats(),
+        "user pool": tenants.pool.stats(),
+        "write-behind queue": writebehind.stats(),
+        "write coordinator": storage.get_backend().writer().stats(),
+        "first page load (ms)": {module: seconds * 1000 for module, seconds in pages.load_times.items()},
+    }, expanded=False)
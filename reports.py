@@ -0,0 +1,136 @@
+# Reports without the app: monthly summaries, budget against actual spending, overspending alerts
+# and the savings trend. They are computed from the saved aggregates and the savings ledger, so a
+# report over many years reads two documents, not the expenses. Nothing here imports Streamlit,
+# matplotlib or pandas: the pages show these figures and "python reports.py" prints them
+import json
+import sys
+import ledger
+import monthclose
+import storage
+from aggregates import load_aggregates, rebuild_aggregates
+
+# How a category did against its budget
+OVER = "over"
+USED = "used"  # Spent exactly the budget
+WITHIN = "within"
+
+# Categories shown per month in the summary
+TOP_CATEGORIES = 3
+
+
+# Months from start to end, both "YYYY-MM" and included
+def months_between(start, end):
+    month = start
+    while month <= end:
+        yield month
+        month = monthclose.next_month(month)
+
+def budget_status(allocated, spent):
+    if spent > allocated:
+        return OVER
+    if spent == allocated:
+        return USED
+    return WITHIN
+
+# Spending of one month, categories by amount spent
+def month_summary(totals, month):
+    amount, count = totals.by_month.get(month, [0.0, 0])
+    by_category = sorted(totals.month_totals_by_category(month).items(), key=lambda item: -item[1])
+    return {"month": month, "spent": amount, "expenses": count, "by_category": dict(by_category)}
+
+# Every category of a budget ({"category_budget": ...}, e.g. the savings document) with what was spent
+def budget_vs_actual(budget, spent_by_category):
+    rows = []
+    for category, allocated in budget.get("category_budget", {}).items():
+        spent = spent_by_category.get(category, 0)
+        rows.append({"category": category, "budget": allocated, "spent": spent, "left": allocated - spent,
+                     "status": budget_status(allocated, spent)})
+    return rows
+
+# The budget a month was planned with, none for months before the first budget kept per month
+def month_budget(savings, month):
+    budgets = savings.get(monthclose.BUDGETS, {})
+    if budgets and month < min(budgets):
+        return {}
+    return monthclose.budget_for(savings, month)
+
+# Saved during a month and the savings total at its end
+def month_savings(savings_ledger, month):
+    end = monthclose.last_day(month)
+    return {"month": month, "saved": savings_ledger.change_between(month + "-01", end), "balance": savings_ledger.balance_at(end)}
+
+
+# The saved figures of one data folder, read once for any number of reports
+class Report:
+    def __init__(self, backend=None):
+        backend = backend or storage.get_backend()
+        self.totals = load_aggregates(backend)
+        if self.totals.count != backend.count_expenses():
+            self.totals = rebuild_aggregates(backend, only_if_stale=True)
+        self.savings = backend.load_document(ledger.SAVINGS_DOCUMENT, {})
+        self.ledger = ledger.ledger_of(self.savings)
+
+    # First month with expenses or savings, this month when there are none
+    def first_month(self):
+        months = list(self.totals.by_month) + self.ledger.dates[:1]
+        return min(months)[:7] if months else storage.current_month()
+
+    # Each report yields one record per month, so long ranges are printed as they are computed
+    def summaries(self, months):
+        for month in months:
+            yield month_summary(self.totals, month)
+
+    def budgets(self, months):
+        for month in months:
+            for row in budget_vs_actual(month_budget(self.savings, month), self.totals.month_totals_by_category(month)):
+                yield {"month": month, **row}
+
+    def alerts(self, months):
+        for row in self.budgets(months):
+            if row["status"] == OVER:
+                yield row
+
+    def savings_trend(self, months):
+        for month in months:
+            yield month_savings(self.ledger, month)
+
+
+# One line of text per record
+def format_record(report, record):
+    if report == "summary":
+        top = ", ".join(f"{category} {amount:.2f}" for category, amount in list(record["by_category"].items())[:TOP_CATEGORIES])
+        return f"{record['month']}  spent {record['spent']:>10.2f} in {record['expenses']:>5} expenses  {top}"
+    if report == "budget":
+        return (f"{record['month']}  {record['category'][:20]:20} budget {record['budget']:>9.2f}  spent {record['spent']:>9.2f}"
+                f"  left {record['left']:>9.2f}  {record['status']}")
+    if report == "alerts":
+        return f"{record['month']}  {record['category']} over budget by {record['spent'] - record['budget']:.2f}"
+    return f"{record['month']}  saved {record['saved']:>10.2f}  total {record['balance']:>10.2f}"
+
+# Options of the command line and their defaults
+OPTIONS = {"from": None, "to": None, "data": None, "json": False}
+
+# Run "python reports.py REPORT [--from YYYY-MM] [--to YYYY-MM] [--data DIR] [--json]", REPORT being
+# summary, budget, alerts or savings. Budget and alerts cover this month by default, summary and
+# savings every month so far. --json prints one JSON object per line
+if __name__ == "__main__":
+    arguments = sys.argv[1:]
+    if not arguments or arguments[0] not in ("summary", "budget", "alerts", "savings"):
+        print("Usage: python reports.py summary|budget|alerts|savings [--from YYYY-MM] [--to YYYY-MM] [--data DIR] [--json]")
+        sys.exit(1)
+    report_name = arguments.pop(0)
+    options = dict(OPTIONS)
+    while arguments:
+        flag = arguments.pop(0).lstrip("-")
+        options[flag] = True if flag == "json" else arguments.pop(0)
+    report = Report(storage.get_backend(options["data"]))
+    end = options["to"] or storage.current_month()
+    start = options["from"] or (end if report_name in ("budget", "alerts") else report.first_month())
+    records = {
+        "summary": report.summaries,
+        "budget": report.budgets,
+        "alerts": report.alerts,
+        "savings": report.savings_trend,
+    }[report_name](months_between(start, end))
+    for record in records:
+        print(json.dumps(record) if options["json"] else format_record(report_name, record), flush=True)
@@ -0,0 +1,236 @@
+# Spending per day, week and month, in total and per category, plus the change in savings over
+# the same periods. Kept up to date one expense at a time like the aggregates, so the Dashboard
+# reads its numbers and trends without grouping the expenses
+from datetime import date, timedelta
+import numpy as np
+import storage
+import ledger
+from aggregates import add_entry, close, copy_entries, update_entry
+from columns import EPOCH_ORDINAL
+
+# Name of the document the rollups are saved in, next to the expenses
+ROLLUPS_DOCUMENT = "rollups"
+
+# Periods rolled up. Days and weeks are only kept for the recent past, months for all time
+PERIODS = ("day", "week", "month")
+DAYS_KEPT = 92
+WEEKS_KEPT = 106
+
+# Key of the period a date falls in: "YYYY-MM-DD", the Monday of its week, or "YYYY-MM"
+def period_key(period, expense_date):
+    text = str(expense_date)[:10]
+    if period == "day":
+        return text
+    if period == "month":
+        return text[:7]
+    day = date.fromisoformat(text)
+    return (day - timedelta(days=day.weekday())).isoformat()
+
+# Oldest key of each period that is kept, keys sort as strings in date order
+def cutoffs(today=None):
+    today = today or date.today()
+    return {
+        "day": (today - timedelta(days=DAYS_KEPT - 1)).isoformat(),
+        "week": period_key("week", today - timedelta(weeks=WEEKS_KEPT - 1)),
+        "month": "",
+    }
+
+# Keys of the last `count` periods up to and including today, oldest first
+def last_keys(period, count, today=None):
+    today = today or date.today()
+    if period == "day":
+        return [(today - timedelta(days=back)).isoformat() for back in range(count - 1, -1, -1)]
+    if period == "week":
+        monday = today - timedelta(days=today.weekday())
+        return [(monday - timedelta(weeks=back)).isoformat() for back in range(count - 1, -1, -1)]
+    months = today.year * 12 + today.month - 1
+    return [f"{month // 12:04d}-{month % 12 + 1:02d}" for month in range(months - count + 1, months + 1)]
+
+
+# Rolled-up spending and savings. Every period maps its keys to [amount, count] totals and to
+# {category -> [amount, count]}, savings map keys to the change in total savings
+class Rollups:
+    def __init__(self):
+        self.count = 0  # Expenses rolled up, including ones too old for the day and week rollups
+        self.totals = {period: {} for period in PERIODS}
+        self.by_category = {period: {} for period in PERIODS}
+        self.savings = {period: {} for period in PERIODS}
+        self.savings_entries = 0  # Entries of the savings ledger rolled up so far
+        self.savings_total = 0.0  # Total savings after the last of them
+
+    # Add (sign=1) or remove (sign=-1) one expense in every period it still has a rollup in
+    def apply(self, amount, category, expense_date, sign=1, limits=None):
+        limits = limits or cutoffs()
+        self.count += sign
+        for period in PERIODS:
+            key = period_key(period, expense_date)
+            if key < limits[period]:
+                continue
+            update_entry(self.totals[period], key, amount, sign)
+            categories = self.by_category[period].setdefault(key, {})
+            update_entry(categories, category, amount, sign)
+            if not categories:
+                del self.by_category[period][key]
+
+    def apply_delta(self, delta, today=None):
+        limits = cutoffs(today)
+        for expense in delta.deleted:
+            self.apply(expense["amount"], expense["category"], expense["date"], -1, limits)
+        for old, new in delta.updated:
+            self.apply(old["amount"], old["category"], old["date"], -1, limits)
+            self.apply(new["amount"], new["category"], new["date"], 1, limits)
+        for expense in delta.inserted:
+            self.apply(expense["amount"], expense["category"], expense["date"], 1, limits)
+        self.prune(limits)
+
+    # Roll up the ledger entries added since the last call. If the ledger doesn't add up to the
+    # total rolled up so far (an entry was put before others), its rollups are started over
+    def add_savings(self, savings_ledger, today=None):
+        folded = min(self.savings_entries, len(savings_ledger))
+        if folded < self.savings_entries or not close(savings_ledger.balance_before(folded), self.savings_total, 1e-9):
+            self.savings = {period: {} for period in PERIODS}
+            self.savings_entries, self.savings_total = 0, 0.0
+        limits = cutoffs(today)
+        for day, change in zip(savings_ledger.dates[self.savings_entries:], savings_ledger.changes[self.savings_entries:]):
+            self.savings_total += change
+            for period in PERIODS:
+                key = period_key(period, day)
+                if key >= limits[period]:
+                    self.savings[period][key] = self.savings[period].get(key, 0.0) + change
+        self.savings_entries = len(savings_ledger)
+        self.prune(limits)
+
+    # Drop day and week rollups that have become too old
+    def prune(self, limits):
+        for period in ("day", "week"):
+            for rolled_up in (self.totals[period], self.by_category[period], self.savings[period]):
+                for key in [key for key in rolled_up if key < limits[period]]:
+                    del rolled_up[key]
+
+    # Reads for the Dashboard, each a dictionary lookup per period asked for
+    def spent(self, period, key):
+        return self.totals[period].get(key, [0.0, 0])[0]
+
+    def spent_by_category(self, period, key):
+        return {category: entry[0] for category, entry in self.by_category[period].get(key, {}).items()}
+
+    def saved(self, period, key):
+        return self.savings[period].get(key, 0.0)
+
+    # (key, spent, saved) of the last `count` periods up to today, zero where nothing happened
+    def trend(self, period, count, today=None):
+        return [(key, self.spent(period, key), self.saved(period, key)) for key in last_keys(period, count, today)]
+
+    # Build the expense rollups from scratch out of ExpenseColumns, grouping is done with NumPy
+    @classmethod
+    def from_columns(cls, columns, today=None):
+        rollups = cls()
+        rollups.count = len(columns)
+        if not len(columns):
+            return rollups
+        limits = cutoffs(today)
+        days = columns.days
+        keys = {
+            "day": days,
+            "week": days - (days + 3) % 7,  # 1970-01-01 was a Thursday
+            "month": days.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64),
+        }
+        category_count = max(len(columns.categories), 1)
+        for period in PERIODS:
+            unique_keys, key_index = np.unique(keys[period], return_inverse=True)
+            if period == "month":
+                names = unique_keys.astype("datetime64[M]").astype(str)
+            else:
+                names = (unique_keys + EPOCH_ORDINAL).tolist()
+                names = [date.fromordinal(ordinal).isoformat() for ordinal in names]
+            pair_index = key_index * category_count + columns.codes
+            pair_sums = np.bincount(pair_index, weights=columns.amounts, minlength=len(unique_keys) * category_count)
+            pair_counts = np.bincount(pair_index, minlength=len(unique_keys) * category_count)
+            for pair in np.flatnonzero(pair_counts):
+                key = str(names[pair // category_count])
+                if key < limits[period]:
+                    continue
+                category = columns.categories[pair % category_count]
+                amount, count = float(pair_sums[pair]), int(pair_counts[pair])
+                rollups.by_category[period].setdefault(key, {})[category] = [amount, count]
+                add_entry(rollups.totals[period], key, amount, count)
+        return rollups
+
+    # Saved form, a plain JSON document that shares nothing with these rollups
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "totals": {period: copy_entries(self.totals[period]) for period in PERIODS},
+            "by_category": {
+                period: {key: copy_entries(entries) for key, entries in self.by_category[period].items()}
+                for period in PERIODS
+            },
+            "savings": {period: dict(self.savings[period]) for period in PERIODS},
+            "savings_entries": self.savings_entries,
+            "savings_total": self.savings_total,
+        }
+
+    # Loaded documents may be shared through the cache, so the nested entries are copied
+    @classmethod
+    def from_dict(cls, data):
+        rollups = cls()
+        rollups.count = data.get("count", 0)
+        for period in PERIODS:
+            rollups.totals[period] = copy_entries(data.get("totals", {}).get(period, {}))
+            rollups.by_category[period] = {
+                key: copy_entries(entries) for key, entries in data.get("by_category", {}).get(period, {}).items()
+            }
+            rollups.savings[period] = dict(data.get("savings", {}).get(period, {}))
+        rollups.savings_entries = data.get("savings_entries", 0)
+        rollups.savings_total = data.get("savings_total", 0.0)
+        return rollups
+
+
+# Apply a delta to the saved rollups. Called from commit_delta's on_commit together with the
+# aggregates, under the same write lock as the expenses. Nothing is saved before the first
+# load_rollups() builds them
+def apply_delta(delta, backend=None):
+    backend = backend or storage.get_backend()
+    data = backend.load_document(ROLLUPS_DOCUMENT, None)
+    if data is None:
+        return None
+    rollups = Rollups.from_dict(data)
+    rollups.apply_delta(delta)
+    backend.write_document(ROLLUPS_DOCUMENT, rollups.to_dict())
+    return rollups
+
+# Load the saved rollups. They are brought up to date under the write lock when they don't cover
+# every expense (e.g. after an import from another tool) or the savings added since they were saved
+def load_rollups(backend=None, load_columns=None):
+    backend = backend or storage.get_backend()
+    data = backend.load_document(ROLLUPS_DOCUMENT, None)
+    entries = ledger.entry_count(backend.load_document(ledger.SAVINGS_DOCUMENT, {}))
+    if data is not None and data.get("count") == backend.count_expenses() and data.get("savings_entries") == entries:
+        return Rollups.from_dict(data)
+    return refresh_rollups(backend, load_columns)
+
+# With rebuild everything is rolled up again from scratch
+def refresh_rollups(backend=None, load_columns=None, rebuild=False):
+    backend = backend or storage.get_backend()
+    load_columns = load_columns or backend.load_columns
+
+    def refresh(data):
+        saved = None if data is None or rebuild else Rollups.from_dict(data)
+        if saved is not None and saved.count == backend.count_expenses():
+            rollups = saved
+        else:
+            rollups = Rollups.from_columns(load_columns())
+            if saved is not None:  # Only the expenses are stale, the savings part is still good
+                rollups.savings, rollups.savings_entries, rollups.savings_total = (
+                    saved.savings, saved.savings_entries, saved.savings_total
+                )
+        rollups.add_savings(ledger.load_ledger(backend))
+        return rollups.to_dict()
+
+    return Rollups.from_dict(backend.update_document(ROLLUPS_DOCUMENT, None, refresh))
+
+
+# Run "python rollups.py" to rebuild the rollups from the expenses and the savings ledger
+if __name__ == "__main__":
+    rollups = refresh_rollups(rebuild=True)
+    print(f"Rolled up {rollups.count} expenses and {rollups.savings_entries} savings entries.")
@@ -1,65 +1,69 @@
 # Import necessary libraries
 import streamlit as st
-import json
+import uuid
+from datetime import date
+import instrument
+import storage
 import pandas as pd
-import matplotlib.pyplot as plt
+import charts
+import ledger
+import reports
+import writebehind
 
-# Paths to JSON files
-SAVINGS_FILE = "data/savings.json"
+# Function to load the savings document or use default values
+def load_savings(default):
+    return storage.get_backend().load_document("savings", default)
 
-# Function to load data from a file or use default values
-def load_data(file_path, default):
-    try:
-        with open(file_path, "r") as file:
-            return json.load(file)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return default
+# Function to save the savings document
+def save_savings(data):
+    storage.get_backend().save_document("savings", data)
 
-# Function to save data to a file
-def save_data(file_path, data):
-    with open(file_path, "w") as file:
-        json.dump(data, file, indent=4)
+# Function to change the latest savings document, safe when several sessions save at once
+def update_savings(default, change):
+    return storage.get_backend().update_document("savings", default, change)
 
 # Ensure the savings file is initialized with default values
 def initialize_savings_file():
-    default_savings = {"total_savings": 0, "history": []}
-    current_savings = load_data(SAVINGS_FILE, default_savings)
-    if "total_savings" not in current_savings:
-        current_savings["total_savings"] = 0
-    if "history" not in current_savings:
-        current_savings["history"] = []
-    save_data(SAVINGS_FILE, current_savings)
-
-# Add savings and update total
+    default_savings = {"total_savings": 0}
+    current_savings = load_savings(default_savings)
+    if any(key not in current_savings for key in default_savings):
+        update_savings(default_savings, lambda savings: {**default_savings, **savings})
+
+# Add savings and update total, in the app the deposit is saved by the write-behind thread.
+# Returns the new total
 def add_savings(amount):
-    savings = load_data(SAVINGS_FILE, {"total_savings": 0, "history": []})
+    total = get_total_savings()
     if amount > 0:
-        savings["total_savings"] += amount
-        savings["history"].append({"date": pd.Timestamp.now().strftime("%Y-%m-%d"), "amount": savings["total_savings"]})
-        save_data(SAVINGS_FILE, savings)
+        writebehind.submit("deposit", {"token": uuid.uuid4().hex, "amount": amount, "day": str(date.today())})
+        total += amount
+    return total
 
-# Display savings data
+# Display savings data, the total is stored next to the ledger
 def get_total_savings():
-    savings = load_data(SAVINGS_FILE, {"total_savings": 0, "history": []})
+    savings = load_savings({"total_savings": 0})
     return savings.get("total_savings", 0)
 
-def get_savings_history():
-    savings = load_data(SAVINGS_FILE, {"total_savings": 0, "history": []})
-    return pd.DataFrame(savings.get("history", []))
+# Total savings after every change, between two dates (both optional)
+def get_savings_history(start=None, end=None):
+    return pd.DataFrame(ledger.load_ledger().history(start, end), columns=["date", "amount"])
 
 # Add Savings Page
+@instrument.timed()
 def display_add_savings():
     st.subheader("Add to Your Savings")
     add_amount = st.number_input("Enter the amount to add:", min_value=0.0, step=10.0)
     if st.button("Add Savings"):
-        add_savings(add_amount)
-        st.success(f"Added {add_amount}! Your new total savings: {get_total_savings()}")
+        total = add_savings(add_amount)
+        st.success(f"Added {add_amount}! Your new total savings: {total}")
 
 # View Savings Page
+@instrument.timed()
 def display_view_savings():
     st.subheader("View Your Savings")
     total_savings = get_total_savings()
     st.write(f"**Total Savings**: {total_savings}")
+    month = storage.current_month()
+    st.write(f"**Saved this month**: {reports.month_savings(ledger.load_ledger(), month)['saved']}")
 
     savings_history = get_savings_history()
     if not savings_history.empty:
@@ -69,21 +73,28 @@ def display_view_savings():
         st.info("No savings history yet.")
 
 # Savings Charts Page
+@instrument.timed()
 def display_charts():
     st.subheader("Savings Over Time")
     savings_history = get_savings_history()
     if not savings_history.empty:
-        fig, ax = plt.subplots()
-        ax.plot(pd.to_datetime(savings_history["date"]), savings_history["amount"], marker="o", linestyle="-", color="green")
-        ax.set_title("Savings Growth")
-        ax.set_xlabel("Date")
-        ax.set_ylabel("Savings")
-        plt.xticks(rotation=45)
-        st.pyplot(fig)
+        dates, amounts = charts.downsample(savings_history["date"].tolist(), savings_history["amount"].tolist())
+        data = {"date": dates, "amount": amounts}
+        charts.show("savings_growth", data, draw_savings_growth)
     else:
         st.info("No savings history yet. Start saving to see your progress!")
 
+# Line chart of the savings total over time, drawn by charts.show
+def draw_savings_growth(figure, data):
+    ax = figure.subplots()
+    ax.plot(pd.to_datetime(data["date"]), data["amount"], marker="o", linestyle="-", color="green")
+    ax.set_title("Savings Growth")
+    ax.set_xlabel("Date")
+    ax.set_ylabel("Savings")
+    ax.tick_params(axis="x", labelrotation=45)
+
 # Main Savings Vault Function
+@instrument.timed()
 def display_savings():
     st.title("💰 Savings Vault")
     st.write("Track your savings here. Add savings, view your progress, and see detailed charts.")
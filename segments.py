@@ -0,0 +1,131 @@
+# Binary copies of the months of expenses that have ended (data/expenses/YYYY-MM.seg). Every
+# expense is a fixed 24-byte record: id, amount in cents, day number and category id, the fields
+# of the JSON partition. A segment is opened with mmap as a NumPy structured array, so columns
+# and date ranges come out of it without parsing. The JSON month stays the saved data: a
+# segment records the version of the JSON file it was made from and is ignored once that changed
+import hashlib
+import json
+import os
+import struct
+import sys
+import threading
+import numpy as np
+from columns import from_day, to_day
+
+# One expense, fields in order of size so every field is aligned
+RECORD = np.dtype([("id", "<i8"), ("cents", "<i8"), ("day", "<i4"), ("category_id", "<i4")])
+
+# File header: format tag, then the modification time (ns), size and a digest of the contents of
+# the JSON file it was made from. The digest catches an edit that keeps the size within one mtime tick
+MAGIC = b"EXPSEG02"
+HEADER = struct.Struct("<8sqq16s")
+
+SUFFIX = ".seg"
+
+
+def segment_path(partition_path):
+    return os.path.splitext(partition_path)[0] + SUFFIX
+
+# Version of a JSON file a segment is made from: (mtime_ns, size, digest), or None when it doesn't exist
+def source_version(file_path):
+    try:
+        status = os.stat(file_path)
+        with open(file_path, "rb") as file:
+            digest = hashlib.blake2b(file.read(), digest_size=16).digest()
+    except FileNotFoundError:
+        return None
+    return (status.st_mtime_ns, status.st_size, digest)
+
+# Stored expense records (with category ids) as a segment array in date order. None when one
+# can't be stored exactly: an amount that isn't a whole number of cents or a record without an
+# id or category id, such months are only kept as JSON
+def from_records(records):
+    if any("id" not in record or "category_id" not in record for record in records):
+        return None
+    array = np.zeros(len(records), dtype=RECORD)
+    if not records:
+        return array
+    amounts = np.fromiter((record["amount"] for record in records), dtype=np.float64, count=len(records))
+    array["cents"] = np.round(amounts * 100)
+    if not np.array_equal(array["cents"] / 100, amounts):
+        return None
+    array["id"] = np.fromiter((record["id"] for record in records), dtype=np.int64, count=len(records))
+    array["day"] = np.array([str(record["date"])[:10] for record in records], dtype="datetime64[D]").astype(np.int64)
+    array["category_id"] = np.fromiter((record["category_id"] for record in records), dtype=np.int32, count=len(records))
+    return array[np.argsort(array["day"], kind="stable")]
+
+# Back to records as they are stored in JSON
+def to_records(array):
+    return [
+        {"id": expense_id, "amount": cents / 100, "date": from_day(day).isoformat(), "category_id": category_id}
+        for expense_id, cents, day, category_id in zip(array["id"].tolist(), array["cents"].tolist(), array["day"].tolist(), array["category_id"].tolist())
+    ]
+
+# Write a segment through a temporary file, so a reader never sees half of one. Every writer has
+# its own temporary file (same naming as storage.temp_path_for), so two sessions building the same
+# month don't take each other's. Where the old file can't be replaced (Windows, while it is mapped)
+# the old one stays and is ignored as out of date
+def write(path, array, version):
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, *version))
+        file.write(array.tobytes())
+    try:
+        os.replace(temp_path, path)
+    except (PermissionError, FileNotFoundError):
+        remove(temp_path)
+
+# The records of a segment mapped into memory, read-only. None when there is no segment or it was
+# made from another version of the JSON file
+def read(path, version):
+    try:
+        with open(path, "rb") as file:
+            header = file.read(HEADER.size)
+    except FileNotFoundError:
+        return None
+    if len(header) != HEADER.size or HEADER.unpack(header) != (MAGIC, *version):
+        return None
+    if os.path.getsize(path) == HEADER.size:
+        return np.zeros(0, dtype=RECORD)
+    return np.memmap(path, dtype=RECORD, mode="r", offset=HEADER.size)
+
+def remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+# A date range of a segment array. The records are in date order, so it is a slice of the mapped
+# array and nothing is copied
+def between(array, start=None, end=None):
+    low = 0 if start is None else np.searchsorted(array["day"], to_day(str(start)), side="left")
+    high = len(array) if end is None else np.searchsorted(array["day"], to_day(str(end)), side="right")
+    return array[low:high]
+
+
+# Run "python segments.py build [DATA_DIR]" to write the segment of every month that has ended,
+# "python segments.py to-json FILE.seg OUT.json" or "to-segment FILE.json OUT.seg" to convert one
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["build"] and len(sys.argv) <= 3:
+        import storage
+        backend = storage.JsonBackend(*sys.argv[2:3])
+        months = sorted(backend.load_manifest()["months"])
+        built = [month for month in months if backend.load_segment(month) is not None]
+        print(f"{len(built)} of {len(months)} months have a segment, the others stay JSON only.")
+    elif sys.argv[1:2] == ["to-json"] and len(sys.argv) == 4:
+        with open(sys.argv[2], "rb") as file:
+            file.read(HEADER.size)
+            array = np.frombuffer(file.read(), dtype=RECORD)
+        with open(sys.argv[3], "w") as file:
+            json.dump(to_records(array), file)
+        print(f"Wrote {len(array)} expenses to {sys.argv[3]}.")
+    elif sys.argv[1:2] == ["to-segment"] and len(sys.argv) == 4:
+        with open(sys.argv[2]) as file:
+            array = from_records(json.load(file))
+        if array is None:
+            print("Every expense needs an id, a category id and an amount in whole cents.")
+            sys.exit(1)
+        write(sys.argv[3], array, (0, 0, bytes(16)))
+        print(f"Wrote {len(array)} expenses to {sys.argv[3]}.")
+    else:
+        print("Usage: python segments.py build [DATA_DIR] | to-json FILE.seg OUT.json | to-segment FILE.json OUT.seg")
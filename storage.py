@@ -0,0 +1,971 @@
+# Shared helpers for reading and writing the files in data/
+import atexit
+import contextvars
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import cache
+import instrument
+import segments
+import writes
+from datetime import date
+from categories import CATEGORIES_DOCUMENT, CategoryRegistry
+from columns import ExpenseColumns
+from delta import ExpenseDelta, assign_ids
+from writes import WriteConflict, WriteTarget
+
+# Suffix of the append-only journal that sits next to a snapshot file
+JOURNAL_SUFFIX = ".journal"
+
+# Number of single appends to a month's journal after which it is compacted into the snapshot
+COMPACT_THRESHOLD = 1000
+
+# Load JSON data from a file or return a default
+def load_json(file_path, default):
+    try:
+        with open(file_path, "r") as file:
+            text = file.read()
+        instrument.add("json_bytes_read", len(text))
+        return json.loads(text)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return default
+
+# Temporary file next to file_path, unique per process and thread so writers never share one
+def temp_path_for(file_path):
+    return f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+# Save JSON data to a file through a temporary file so readers never see half a file
+def save_json(file_path, data):
+    temp_path = temp_path_for(file_path)
+    text = json.dumps(data, indent=4)
+    with open(temp_path, "w") as file:
+        file.write(text)
+    instrument.add("json_bytes_written", len(text))
+    os.replace(temp_path, file_path)
+
+# Path of the journal that belongs to a snapshot file
+def journal_path(file_path):
+    return file_path + JOURNAL_SUFFIX
+
+# Read the records appended to the journal since the last compaction
+def read_journal(file_path):
+    records = []
+    size = 0
+    try:
+        with open(journal_path(file_path), "r") as file:
+            for line in file:
+                size += len(line)
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break  # A torn last line from an interrupted write, ignore it
+    except FileNotFoundError:
+        pass
+    instrument.add("json_bytes_read", size)
+    return records
+
+# Load the snapshot (a plain JSON list, like the old files) plus the journal on top of it
+def load_journaled(file_path):
+    records = load_json(file_path, [])
+    records.extend(read_journal(file_path))
+    return records
+
+# Append a single record to the journal, only the new record is written
+def append_record(file_path, record):
+    text = json.dumps(record) + "\n"
+    with open(journal_path(file_path), "a") as file:
+        file.write(text)
+    instrument.add("json_bytes_written", len(text))
+
+# Append several records to the journal with a single write
+def append_records(file_path, records):
+    text = "".join(json.dumps(record) + "\n" for record in records)
+    with open(journal_path(file_path), "a") as file:
+        file.write(text)
+    instrument.add("json_bytes_written", len(text))
+
+# Save a list of records as a JSON list with one record per line, much faster to write
+# than indent=4 for long lists and still readable
+def save_records(file_path, records):
+    temp_path = temp_path_for(file_path)
+    text = "[\n" + ",\n".join(json.dumps(record) for record in records) + "\n]" if records else "[]"
+    with open(temp_path, "w") as file:
+        file.write(text)
+    instrument.add("json_bytes_written", len(text))
+    os.replace(temp_path, file_path)
+
+# Rewrite the snapshot with all records and empty the journal
+def compact(file_path, records):
+    save_records(file_path, records)
+    try:
+        os.remove(journal_path(file_path))
+    except FileNotFoundError:
+        pass
+
+# Number of records waiting in the journal
+def journal_length(file_path):
+    try:
+        with open(journal_path(file_path), "r") as file:
+            return sum(1 for line in file if line.strip())
+    except FileNotFoundError:
+        return 0
+
+
+# Folder and file names used by the storage backends
+DATA_DIR = "data"
+EXPENSES_NAME = "expenses.json"
+CATEGORIES_NAME = "expensecatagories.json"
+SQLITE_NAME = "expensetracker.db"
+DEFAULT_CATEGORIES = ["Food", "Transport", "Entertainment", "Other"]
+
+# Documents built from the expenses that count categories by name, dropped and built again when
+# creating the category registry turns several old spellings into one category
+DERIVED_DOCUMENTS = ("aggregates", "rollups", "goal_progress")
+
+# Cached SQLite results that depend on the expenses table
+EXPENSE_QUERIES = ("expenses", "total", "totals_by_category")
+
+# Folder with one expenses file per month and the manifest listing them
+PARTITION_DIR = "expenses"
+MANIFEST_NAME = "manifest.json"
+
+# Environment variable that picks the backend, "json" (default) or "sqlite"
+BACKEND_ENV = "EXPENSE_TRACKER_BACKEND"
+
+# Lock file that serializes writers to a data folder
+LOCK_NAME = "write.lock"
+
+
+# The month an expense belongs to and the month it is now, as "YYYY-MM"
+def current_month():
+    return date.today().strftime("%Y-%m")
+
+def group_by_month(expenses):
+    by_month = {}
+    for expense in expenses:
+        by_month.setdefault(str(expense["date"])[:7], []).append(expense)
+    return by_month
+
+# The fields an optimistic check compares, so 12 and 12.0 or a date and its string match
+def row_fields(expense):
+    return None if expense is None else (float(expense["amount"]), expense["category"], str(expense["date"]))
+
+# Updates and deletes must find their rows as the writer last saw them. rows holds the current
+# version of every row the group has looked at so far, find(expenses) looks up the others
+def check_delta(rows, delta, find):
+    expected = delta.deleted + [old for old, new in delta.updated]
+    unknown = [expense for expense in expected if expense["id"] not in rows]
+    if unknown:
+        found = find(unknown)
+        rows.update({expense["id"]: found.get(expense["id"]) for expense in unknown})
+    changed = [expense for expense in expected if row_fields(rows[expense["id"]]) != row_fields(expense)]
+    if changed:
+        raise WriteConflict(f"{len(changed)} expenses were changed or deleted by someone else, reload and try again.")
+    rows.update({expense["id"]: None for expense in delta.deleted})
+    rows.update({new["id"]: new for old, new in delta.updated})
+    rows.update({expense["id"]: expense for expense in delta.inserted})
+
+
+# Interface every storage backend follows. Backends must implement the load/save
+# methods, the queries below scan all expenses and are overridden where an index helps
+class StorageBackend:
+    # Expenses between two "YYYY-MM-DD" dates (inclusive), all of them when no dates are given
+    def load_expenses(self, start=None, end=None):
+        raise NotImplementedError
+
+    def count_expenses(self):
+        return len(self.load_expenses())
+
+    # Expenses between two dates as ExpenseColumns, all of them when no dates are given
+    def load_columns(self, start=None, end=None):
+        return ExpenseColumns.from_records(self.load_expenses(start, end))
+
+    # Yield expenses between two dates one at a time, for exports of long histories
+    def iter_expenses(self, start=None, end=None):
+        yield from self.load_expenses(start, end)
+
+    def append_expense(self, expense):
+        raise NotImplementedError
+
+    # Append many expenses at once, backends override this to write them in one go
+    def append_expenses(self, expenses):
+        for expense in expenses:
+            self.append_expense(expense)
+
+    def replace_expenses(self, expenses):
+        raise NotImplementedError
+
+    # Current version of the given expenses, as a dict from id to expense. Missing ones are left out
+    def find_expenses(self, expenses):
+        wanted = {expense["id"] for expense in expenses}
+        return {expense["id"]: expense for expense in self.load_expenses() if expense["id"] in wanted}
+
+    # Save an ExpenseDelta, backends override this to write only the rows that changed
+    def apply_delta(self, delta):
+        expenses = {expense["id"]: expense for expense in self.load_expenses()}
+        for expense in delta.deleted:
+            expenses.pop(expense["id"], None)
+        for old, new in delta.updated:
+            expenses[new["id"]] = new
+        for expense in delta.inserted:
+            expenses[expense["id"]] = expense
+        self.replace_expenses(list(expenses.values()))
+
+    # The plain list of category names kept before the registry, only read to create it
+    def load_category_list(self):
+        raise NotImplementedError
+
+    def load_document(self, name, default):
+        raise NotImplementedError
+
+    def write_document(self, name, data):
+        raise NotImplementedError
+
+    # Opaque token that changes whenever the document is saved, for optimistic checks
+    def document_version(self, name):
+        raise NotImplementedError
+
+    # The methods above write straight away. Pages and managers write through the ones below,
+    # which hold the data folder's write lock and are group-committed with other sessions' writes
+    def lock_path(self):
+        raise NotImplementedError
+
+    def writer(self):
+        return writes.coordinator(self.lock_path())
+
+    # Save an ExpenseDelta, raising WriteConflict when a row it updates or deletes has changed since
+    # it was read. on_commit() runs right after, still under the lock, for things that must change
+    # together with the expenses such as the saved aggregates. Returns the delta actually applied
+    # (this one combined with any others committed in the same group) and the expenses version
+    # before and after it
+    def commit_delta(self, delta, on_commit=None):
+        def load():
+            return {"deltas": [], "hooks": [], "rows": {}, "before": self.expenses_version()}
+
+        def change(state, version):
+            check_delta(state["rows"], delta, self.find_expenses)
+            state["deltas"].append(delta)
+            if on_commit is not None:
+                state["hooks"].append(on_commit)
+            return state
+
+        def save(state):
+            state["applied"] = ExpenseDelta.combine(state["deltas"])
+            self.apply_delta(state["applied"])
+            for hook in state["hooks"]:
+                hook()
+            state["after"] = self.expenses_version()
+
+        state = self.writer().submit(self.expenses_key(), WriteTarget(load, save), change)
+        return state["applied"], state["before"], state["after"]
+
+    # Replace a document with change(current document), applied to the latest saved version.
+    # With expected_version the write fails with WriteConflict if the document changed since then
+    def update_document(self, name, default, change, expected_version=None):
+        def apply(data, version):
+            if expected_version is not None and version != expected_version:
+                raise WriteConflict(f"{name} was changed by someone else, reload and try again.")
+            return change(default if data is None else data)
+
+        target = WriteTarget(
+            lambda: self.load_document(name, None),
+            lambda data: self.write_document(name, data),
+            lambda: self.document_version(name),
+        )
+        return self.writer().submit(("document", name), target, apply)
+
+    def save_document(self, name, data, expected_version=None):
+        self.update_document(name, None, lambda current: data, expected_version)
+
+    # The category registry, shared through the cache and not to be changed in place. It is
+    # created from the old list of names the first time it is needed, under the write lock
+    def load_registry(self):
+        if self.load_document(CATEGORIES_DOCUMENT, None) is None:
+            with self.writer().exclusive():
+                if self.load_document(CATEGORIES_DOCUMENT, None) is None:
+                    self.migrate_categories()
+        return cache.get(
+            ("registry",) + self.expenses_key(),
+            self.document_version(CATEGORIES_DOCUMENT),
+            lambda: CategoryRegistry.from_dict(self.load_document(CATEGORIES_DOCUMENT, {})),
+        )
+
+    # When the old list had spellings that are now one category, the saved totals may still count
+    # them apart and cached expenses still show them, so both are dropped
+    def migrate_categories(self):
+        names = self.load_category_list()
+        registry = CategoryRegistry.from_names(names)
+        self.write_document(CATEGORIES_DOCUMENT, registry.to_dict())
+        if registry.categories() != list(names):
+            for name in DERIVED_DOCUMENTS:
+                if self.load_document(name, None) is not None:
+                    self.write_document(name, None)
+            cache.drop_under(self.data_dir)
+
+    # Names of the categories, in the order they were added
+    def load_categories(self):
+        return self.load_registry().categories()
+
+    # Change the registry (change(registry) edits it in place) under the write lock, for adding
+    # and merging categories. Returns the registry after the change
+    def update_registry(self, change):
+        self.load_registry()
+
+        def apply(data):
+            registry = CategoryRegistry.from_dict(data)
+            change(registry)
+            return registry.to_dict()
+
+        return CategoryRegistry.from_dict(self.update_document(CATEGORIES_DOCUMENT, {}, apply))
+
+    # Names are only ever added, expenses saved with a category id must keep finding their name
+    def save_categories(self, categories):
+        self.update_registry(lambda registry: [registry.add(name) for name in categories])
+
+    # The registry with every given name in it. Expense writes call this from inside a commit,
+    # where the write lock is already held, so new names are written straight away
+    def register_categories(self, names):
+        registry = self.load_registry()
+        if all(registry.lookup(name) is not None for name in names):
+            return registry
+        with self.writer().exclusive():
+            registry = CategoryRegistry.from_dict(self.load_document(CATEGORIES_DOCUMENT, {}))
+            for name in names:
+                registry.add(name)
+            self.write_document(CATEGORIES_DOCUMENT, registry.to_dict())
+        return self.load_registry()
+
+    # Expenses as they are stored, with the category's id instead of its name
+    def encode_expenses(self, expenses):
+        registry = self.register_categories({expense["category"] for expense in expenses})
+        return [
+            {**{key: value for key, value in expense.items() if key != "category"}, "category_id": registry.lookup(expense["category"])}
+            for expense in expenses
+        ]
+
+    # Turn stored records back into expenses with the category's name, in place. Records saved
+    # before there were ids have the name, shown in its registered spelling
+    def decode_expenses(self, records):
+        registry = self.load_registry()
+        names = [registry.name_of(category_id) for category_id in range(len(registry.names))]
+        for record in records:
+            if "category_id" in record:
+                record["category"] = names[record.pop("category_id")]
+            else:
+                record["category"] = registry.display_name(record["category"])
+        return records
+
+    def filter_by_category(self, category):
+        return [expense for expense in self.load_expenses() if expense["category"] == category]
+
+    def filter_by_date(self, selected_date):
+        return [expense for expense in self.load_expenses() if expense["date"] == selected_date]
+
+    def total_amount(self):
+        return sum(expense["amount"] for expense in self.load_expenses())
+
+    def totals_by_category(self):
+        totals = {}
+        for expense in self.load_expenses():
+            totals[expense["category"]] = totals.get(expense["category"], 0) + expense["amount"]
+        return totals
+
+    # Key and version that change whenever the stored expenses change, used by caches built on top
+    def expenses_key(self):
+        raise NotImplementedError
+
+    def expenses_version(self):
+        raise NotImplementedError
+
+    # Fold pending writes into the main files, backends without a journal have nothing to do
+    def compact(self):
+        pass
+
+    def close(self):
+        pass
+
+
+# Storage on plain JSON files in the data folder. Expenses are split into one file per
+# month in data/expenses/, the current month takes appends through its journal and
+# months that have ended are sealed: compacted once and only rewritten by edits
+class JsonBackend(StorageBackend):
+    def __init__(self, data_dir=DATA_DIR):
+        self.data_dir = data_dir
+        cache.add_folder(data_dir)
+        self.expenses_file = os.path.join(data_dir, EXPENSES_NAME)  # Single file used before partitioning
+        self.partition_dir = os.path.join(data_dir, PARTITION_DIR)
+        self.manifest_file = os.path.join(self.partition_dir, MANIFEST_NAME)
+        self.categories_file = os.path.join(data_dir, CATEGORIES_NAME)
+
+    def lock_path(self):
+        return os.path.join(self.data_dir, LOCK_NAME)
+
+    # Documents are the small JSON files such as savings.json and goals.json
+    def document_path(self, name):
+        return os.path.join(self.data_dir, name + ".json")
+
+    def partition_path(self, month):
+        return os.path.join(self.partition_dir, month + ".json")
+
+    # Every write updates the manifest, so its version is the version of all expenses
+    def expenses_key(self):
+        return ("json", os.path.abspath(self.manifest_file))
+
+    def expenses_version(self):
+        return cache.version_of(self.expenses_key(), self.manifest_file)
+
+    # The manifest maps each month to its number of expenses and of single appends waiting in its
+    # journal. It is created from the old single expenses.json (which is left in place as a backup)
+    # the first time it is needed, under the write lock so only one session does it
+    def load_manifest(self):
+        manifest = self.load_cached(self.manifest_file, None)
+        if manifest is None:
+            with self.writer().exclusive():
+                manifest = self.load_cached(self.manifest_file, None) or self.migrate_single_file()
+        return manifest
+
+    def save_manifest(self, manifest):
+        self.save_cached(self.manifest_file, manifest)
+
+    def migrate_single_file(self):
+        os.makedirs(self.partition_dir, exist_ok=True)
+        expenses = load_journaled(self.expenses_file)
+        assign_ids(expenses)
+        by_month = group_by_month(expenses)
+        for month, month_expenses in by_month.items():
+            save_records(self.partition_path(month), self.encode_expenses(month_expenses))
+        manifest = {"months": {month: {"count": len(rows)} for month, rows in by_month.items()}}
+        self.save_manifest(manifest)
+        self.seal_closed_months(manifest)
+        return manifest
+
+    # Expenses of one month, parsed once per change and shared through the cache
+    def partition_key(self, month):
+        return ("json", os.path.abspath(self.partition_path(month)))
+
+    def partition_version(self, month):
+        path = self.partition_path(month)
+        return cache.version_of(self.partition_key(month), path, journal_path(path))
+
+    def load_partition(self, month):
+        path = self.partition_path(month)
+        return cache.get(self.partition_key(month), self.partition_version(month), lambda: self.read_partition(path))
+
+    # Reading never writes. Expenses saved before they had IDs get IDs derived from their month and
+    # position, which stay the same until the month is next rewritten with them saved
+    def read_partition(self, path):
+        expenses = load_json(path, [])
+        expenses.extend(read_journal(path))
+        assign_ids(expenses, os.path.basename(path))
+        return self.decode_expenses(expenses)
+
+    # Rewrite one month as a snapshot without a journal. The cache gets the records as they will
+    # be read back, with every category in its registered spelling
+    def write_partition(self, month, expenses):
+        records = self.encode_expenses(expenses)
+        compact(self.partition_path(month), records)
+        cache.invalidate(self.partition_key(month))
+        cache.put(self.partition_key(month), self.partition_version(month), self.decode_expenses(records))
+
+    # Fold the journal of every month that has ended into its snapshot, once
+    def seal_closed_months(self, manifest):
+        for month in manifest["months"]:
+            if month < current_month() and journal_length(self.partition_path(month)):
+                self.write_partition(month, self.load_partition(month))
+
+    # The binary segment of a month that has ended (see segments.py), written from the JSON file
+    # when it is missing or was made from an older version. None for this month, months with a
+    # journal and months that can't be stored exactly in a segment
+    def load_segment(self, month):
+        path = self.partition_path(month)
+        if month >= current_month() or os.path.exists(journal_path(path)):
+            return None
+        # The digest is computed once per version of the partition, like its parsed records
+        version = cache.get(("segment-source", os.path.abspath(path)), self.partition_version(month), lambda: segments.source_version(path))
+        if version is None:
+            return None
+        array = segments.read(segments.segment_path(path), version)
+        if array is None:
+            records = load_json(path, [])
+            assign_ids(records, os.path.basename(path))
+            array = segments.from_records(records)
+            if array is not None:
+                segments.write(segments.segment_path(path), array, version)
+        return array
+
+    # Months that have ended are read from their segments without parsing, the others from JSON
+    def load_columns(self, start=None, end=None):
+        start, end = (None if start is None else str(start)), (None if end is None else str(end))
+        registry = self.load_registry()
+        parts = []
+        for month in sorted(self.load_manifest()["months"]):
+            if (start is not None and month < start[:7]) or (end is not None and month > end[:7]):
+                continue
+            array = self.load_segment(month)
+            if array is not None:
+                parts.append(ExpenseColumns.from_segment(segments.between(array, start, end), registry.name_of))
+            else:
+                parts.append(ExpenseColumns.from_records([
+                    expense for expense in self.load_partition(month)
+                    if (start is None or expense["date"] >= start) and (end is None or expense["date"] <= end)
+                ]))
+        return ExpenseColumns.concatenate(parts)
+
+    # Only the months overlapping start..end are read, dates are "YYYY-MM-DD" strings
+    def load_expenses(self, start=None, end=None):
+        start, end = (None if start is None else str(start)), (None if end is None else str(end))
+        expenses = []
+        for month in sorted(self.load_manifest()["months"]):
+            if (start is None or month >= start[:7]) and (end is None or month <= end[:7]):
+                expenses.extend(self.load_partition(month))
+        if start is not None or end is not None:
+            expenses = [
+                expense for expense in expenses
+                if (start is None or expense["date"] >= start) and (end is None or expense["date"] <= end)
+            ]
+        return expenses
+
+    def count_expenses(self):
+        return sum(entry["count"] for entry in self.load_manifest()["months"].values())
+
+    # One month in memory at a time, months that aren't cached are read without being cached
+    def iter_expenses(self, start=None, end=None):
+        start, end = (None if start is None else str(start)), (None if end is None else str(end))
+        for month in sorted(self.load_manifest()["months"]):
+            if (start is not None and month < start[:7]) or (end is not None and month > end[:7]):
+                continue
+            expenses = cache.peek(self.partition_key(month), self.partition_version(month))
+            if expenses is None:
+                expenses = self.read_partition(self.partition_path(month))
+            for expense in expenses:
+                if (start is None or expense["date"] >= start) and (end is None or expense["date"] <= end):
+                    yield expense
+
+    # Appends to the current month only write the new record, a back-dated expense rewrites its
+    # sealed month and so does a journal that has grown past COMPACT_THRESHOLD
+    def append_expense(self, expense):
+        manifest = self.load_manifest()
+        month = str(expense["date"])[:7]
+        entry = manifest["months"].get(month, {"count": 0})
+        journal = entry.get("journal", 0) + 1
+        if month < current_month() or journal >= COMPACT_THRESHOLD:
+            self.write_partition(month, self.load_partition(month) + [expense])
+            journal = 0
+        else:
+            cached = cache.peek(self.partition_key(month), self.partition_version(month))
+            records = self.encode_expenses([expense])
+            append_record(self.partition_path(month), records[0])
+            cache.invalidate(self.partition_key(month))
+            if cached is not None:
+                cache.put(self.partition_key(month), self.partition_version(month), cached + self.decode_expenses(records))
+        months = dict(manifest["months"])
+        months[month] = {"count": entry["count"] + 1, "journal": journal}
+        self.save_manifest({**manifest, "months": months})
+
+    # Bulk appends go to each month's journal in one write per month, even for sealed
+    # months, compact() seals them again afterwards
+    def append_expenses(self, expenses):
+        manifest = self.load_manifest()
+        months = dict(manifest["months"])
+        for month, month_expenses in group_by_month(expenses).items():
+            os.makedirs(self.partition_dir, exist_ok=True)
+            append_records(self.partition_path(month), self.encode_expenses(month_expenses))
+            cache.invalidate(self.partition_key(month))
+            entry = months.get(month, {"count": 0})
+            months[month] = {**entry, "count": entry["count"] + len(month_expenses)}
+        self.save_manifest({**manifest, "months": months})
+
+    # Only the months the expenses were in when they were read are searched
+    def find_expenses(self, expenses):
+        wanted = {expense["id"] for expense in expenses}
+        found = {}
+        for month in {str(expense["date"])[:7] for expense in expenses} & set(self.load_manifest()["months"]):
+            found.update((expense["id"], expense) for expense in self.load_partition(month) if expense["id"] in wanted)
+        return found
+
+    # Inserts only go through the journal, otherwise just the months the delta touches are rewritten
+    def apply_delta(self, delta):
+        if not delta.updated and not delta.deleted:
+            self.append_expenses(delta.inserted)
+            return
+        removed = {expense["id"] for expense in delta.deleted} | {old["id"] for old, new in delta.updated}
+        added = group_by_month(delta.inserted + [new for old, new in delta.updated])
+        manifest = self.load_manifest()
+        months = dict(manifest["months"])
+        for month in delta.months():
+            rows = [expense for expense in self.load_partition(month) if expense["id"] not in removed]
+            rows.extend(added.get(month, []))
+            if rows:
+                self.write_partition(month, rows)
+                months[month] = {"count": len(rows)}
+            elif month in months:
+                self.remove_partition(month)
+                del months[month]
+        self.save_manifest({**manifest, "months": months})
+
+    def remove_partition(self, month):
+        compact(self.partition_path(month), [])
+        os.remove(self.partition_path(month))
+        segments.remove(segments.segment_path(self.partition_path(month)))
+        cache.invalidate(self.partition_key(month))
+
+    # Only months whose expenses actually changed are rewritten
+    def replace_expenses(self, expenses):
+        manifest = self.load_manifest()
+        by_month = group_by_month(expenses)
+        for month in set(manifest["months"]) - set(by_month):
+            self.remove_partition(month)
+        for month, month_expenses in by_month.items():
+            if month not in manifest["months"] or self.load_partition(month) != month_expenses:
+                self.write_partition(month, month_expenses)
+        self.save_manifest({**manifest, "months": {month: {"count": len(rows)} for month, rows in by_month.items()}})
+
+    def filter_by_date(self, selected_date):
+        return self.load_expenses(selected_date, selected_date)
+
+    # Fold every journal into its snapshot, one month at a time and without filling the cache
+    def compact(self):
+        with self.writer().exclusive():
+            manifest = self.load_manifest()
+            for month in manifest["months"]:
+                path = self.partition_path(month)
+                if journal_length(path):
+                    compact(path, self.encode_expenses(self.read_partition(path)))
+                    cache.invalidate(self.partition_key(month))
+            months = {month: {"count": entry["count"]} for month, entry in manifest["months"].items()}
+            if months != manifest["months"]:
+                self.save_manifest({**manifest, "months": months})
+
+    def load_category_list(self):
+        return list(self.load_cached(self.categories_file, DEFAULT_CATEGORIES))
+
+    # Documents come straight from the shared cache and must not be modified in place
+    def load_document(self, name, default):
+        return self.load_cached(self.document_path(name), default)
+
+    def write_document(self, name, data):
+        self.save_cached(self.document_path(name), data)
+
+    def document_version(self, name):
+        return cache.file_version(self.document_path(name))
+
+    # A missing or broken file is cached as None so each caller still gets its own default
+    def load_cached(self, file_path, default):
+        key = ("json", os.path.abspath(file_path))
+        data = cache.get(key, cache.version_of(key, file_path), lambda: load_json(file_path, None))
+        return default if data is None else data
+
+    def save_cached(self, file_path, data):
+        key = ("json", os.path.abspath(file_path))
+        save_json(file_path, data)
+        cache.invalidate(key)
+        cache.put(key, cache.version_of(key, file_path), data)
+
+
+# Storage in a single SQLite database with indexes on date and category
+class SqliteBackend(StorageBackend):
+    def __init__(self, db_path=os.path.join(DATA_DIR, SQLITE_NAME)):
+        self.db_path = db_path
+        self.data_dir = os.path.dirname(db_path)
+        cache.add_folder(self.data_dir)
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS expenses (
+                    id INTEGER PRIMARY KEY,
+                    amount REAL NOT NULL,
+                    category_id INTEGER NOT NULL,
+                    date TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS categories (
+                    position INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS documents (
+                    name TEXT PRIMARY KEY,
+                    data TEXT NOT NULL
+                );
+            """)
+        if "category" in [row["name"] for row in self.connection.execute("PRAGMA table_info(expenses)")]:
+            with self.writer().exclusive():
+                self.migrate_category_column()
+        with self.connection:
+            self.connection.executescript("""
+                CREATE INDEX IF NOT EXISTS expenses_date ON expenses (date);
+                CREATE INDEX IF NOT EXISTS expenses_category_id ON expenses (category_id);
+            """)
+
+    # Databases from before the category registry store the name in every row. The table is copied
+    # once with the names replaced by their ids, in one transaction
+    def migrate_category_column(self):
+        if "category" not in [row["name"] for row in self.connection.execute("PRAGMA table_info(expenses)")]:
+            return  # Another process did it first
+        names = [row["category"] for row in self.connection.execute("SELECT DISTINCT category FROM expenses")]
+        registry = self.register_categories(names)
+        with self.connection:
+            self.connection.execute("CREATE TEMP TABLE category_ids (name TEXT PRIMARY KEY, category_id INTEGER NOT NULL)")
+            self.connection.executemany("INSERT INTO category_ids VALUES (?, ?)", [(name, registry.lookup(name)) for name in names])
+            self.connection.executescript("""
+                CREATE TABLE expenses_by_id (
+                    id INTEGER PRIMARY KEY,
+                    amount REAL NOT NULL,
+                    category_id INTEGER NOT NULL,
+                    date TEXT NOT NULL
+                );
+                INSERT INTO expenses_by_id (id, amount, category_id, date)
+                    SELECT expenses.id, expenses.amount, category_ids.category_id, expenses.date
+                    FROM expenses JOIN category_ids ON category_ids.name = expenses.category;
+                DROP TABLE expenses;
+                ALTER TABLE expenses_by_id RENAME TO expenses;
+                DROP TABLE temp.category_ids;
+            """)
+        self.invalidate(*EXPENSE_QUERIES)
+
+    def lock_path(self):
+        return self.db_path + ".lock"
+
+    # Cached results are keyed on the database and WAL files, so a commit from any process is noticed
+    def cached(self, name, loader):
+        key = ("sqlite", os.path.abspath(self.db_path), name)
+        return cache.get(key, cache.version_of(key, self.db_path, self.db_path + "-wal"), loader)
+
+    def expenses_key(self):
+        return ("sqlite", os.path.abspath(self.db_path), "expenses")
+
+    def expenses_version(self):
+        return cache.version_of(self.expenses_key(), self.db_path, self.db_path + "-wal")
+
+    # Drop cached results after this process writes, the database file alone may not show it yet
+    def invalidate(self, *names):
+        for name in names:
+            cache.invalidate(("sqlite", os.path.abspath(self.db_path), name))
+
+    # Turn database rows into the same dicts the JSON backend returns
+    def rows_to_expenses(self, rows):
+        registry = self.load_registry()
+        names = [registry.name_of(category_id) for category_id in range(len(registry.names))]
+        return [
+            {"id": row["id"], "amount": row["amount"], "category": names[row["category_id"]], "date": row["date"]} for row in rows
+        ]
+
+    # Row values of expenses to insert, with their category ids
+    def expense_rows(self, expenses):
+        return [
+            (expense.get("id"), expense["amount"], expense["category_id"], str(expense["date"]))
+            for expense in self.encode_expenses(expenses)
+        ]
+
+    # A date range is answered from the date index, the full list is cached
+    def load_expenses(self, start=None, end=None):
+        if start is not None or end is not None:
+            rows = self.connection.execute(
+                "SELECT id, amount, category_id, date FROM expenses WHERE date >= ? AND date <= ? ORDER BY date, id",
+                (str(start or ""), str(end or "9999-12-31")),
+            )
+            return self.rows_to_expenses(rows)
+        def read():
+            return self.rows_to_expenses(self.connection.execute("SELECT id, amount, category_id, date FROM expenses ORDER BY date, id"))
+        return list(self.cached("expenses", read))
+
+    def count_expenses(self):
+        return self.connection.execute("SELECT COUNT(*) FROM expenses").fetchone()[0]
+
+    # Rows are fetched from the cursor in chunks instead of all at once
+    def iter_expenses(self, start=None, end=None):
+        cursor = self.connection.execute(
+            "SELECT id, amount, category_id, date FROM expenses WHERE date >= ? AND date <= ? ORDER BY date, id",
+            (str(start or ""), str(end or "9999-12-31")),
+        )
+        while rows := cursor.fetchmany(1000):
+            yield from self.rows_to_expenses(rows)
+
+    def append_expense(self, expense):
+        with self.connection:
+            self.connection.execute("INSERT INTO expenses (id, amount, category_id, date) VALUES (?, ?, ?, ?)", self.expense_rows([expense])[0])
+        self.invalidate(*EXPENSE_QUERIES)
+
+    def append_expenses(self, expenses):
+        with self.connection:
+            self.connection.executemany("INSERT INTO expenses (id, amount, category_id, date) VALUES (?, ?, ?, ?)", self.expense_rows(expenses))
+        self.invalidate(*EXPENSE_QUERIES)
+
+    # One transaction touching only the changed rows
+    def apply_delta(self, delta):
+        updated = self.expense_rows([new for old, new in delta.updated])
+        inserted = self.expense_rows(delta.inserted)
+        with self.connection:
+            self.connection.executemany("DELETE FROM expenses WHERE id = ?", [(expense["id"],) for expense in delta.deleted])
+            self.connection.executemany(
+                "UPDATE expenses SET amount = ?, category_id = ?, date = ? WHERE id = ?",
+                [(amount, category_id, day, expense_id) for expense_id, amount, category_id, day in updated],
+            )
+            self.connection.executemany("INSERT INTO expenses (id, amount, category_id, date) VALUES (?, ?, ?, ?)", inserted)
+        self.invalidate(*EXPENSE_QUERIES)
+
+    def replace_expenses(self, expenses):
+        with self.connection:
+            self.connection.execute("DELETE FROM expenses")
+            self.connection.executemany("INSERT INTO expenses (id, amount, category_id, date) VALUES (?, ?, ?, ?)", self.expense_rows(expenses))
+        self.invalidate(*EXPENSE_QUERIES)
+
+    def load_category_list(self):
+        rows = self.connection.execute("SELECT name FROM categories ORDER BY position").fetchall()
+        if not rows:
+            return list(DEFAULT_CATEGORIES)
+        return [row["name"] for row in rows]
+
+    # Documents come straight from the shared cache and must not be modified in place
+    def load_document(self, name, default):
+        def read():
+            row = self.connection.execute("SELECT data FROM documents WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                return None
+            instrument.add("json_bytes_read", len(row["data"]))
+            return json.loads(row["data"])
+        data = self.cached("document:" + name, read)
+        return default if data is None else data
+
+    def write_document(self, name, data):
+        text = json.dumps(data)
+        instrument.add("json_bytes_written", len(text))
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO documents (name, data) VALUES (?, ?)", (name, text)
+            )
+        self.invalidate("document:" + name)
+
+    # Hash of the stored text, so a save from another process changes it too
+    def document_version(self, name):
+        row = self.connection.execute("SELECT data FROM documents WHERE name = ?", (name,)).fetchone()
+        return None if row is None else hashlib.sha1(row["data"].encode()).hexdigest()
+
+    # Rows are looked up by primary key, a few hundred ids per query
+    def find_expenses(self, expenses):
+        ids = [expense["id"] for expense in expenses]
+        found = {}
+        for first in range(0, len(ids), 500):
+            chunk = ids[first:first + 500]
+            rows = self.connection.execute(
+                f"SELECT id, amount, category_id, date FROM expenses WHERE id IN ({', '.join('?' * len(chunk))})", chunk
+            )
+            found.update((expense["id"], expense) for expense in self.rows_to_expenses(rows))
+        return found
+
+    # Queries, answered from the indexes instead of scanning in Python
+    # A category is looked up by its id, together with the ids merged into it
+    def filter_by_category(self, category):
+        registry = self.load_registry()
+        target = registry.lookup(category)
+        if target is None:
+            return []
+        ids = [category_id for category_id in range(len(registry.names)) if registry.canonical(category_id) == target]
+        rows = self.connection.execute(
+            f"SELECT id, amount, category_id, date FROM expenses WHERE category_id IN ({', '.join('?' * len(ids))}) ORDER BY date, id", ids
+        )
+        return self.rows_to_expenses(rows)
+
+    def filter_by_date(self, selected_date):
+        rows = self.connection.execute(
+            "SELECT id, amount, category_id, date FROM expenses WHERE date = ? ORDER BY date, id", (selected_date,)
+        )
+        return self.rows_to_expenses(rows)
+
+    def total_amount(self):
+        return self.cached("total", lambda: self.connection.execute("SELECT COALESCE(SUM(amount), 0) FROM expenses").fetchone()[0])
+
+    def totals_by_category(self):
+        def read():
+            registry = self.load_registry()
+            totals = {}
+            for row in self.connection.execute("SELECT category_id, SUM(amount) AS total FROM expenses GROUP BY category_id"):
+                name = registry.name_of(row["category_id"])
+                totals[name] = totals.get(name, 0) + row["total"]
+            return totals
+        return dict(self.cached("totals_by_category", read))
+
+    def close(self):
+        self.connection.close()
+        with _sqlite_lock:
+            for key in [key for key, backend in _sqlite_backends.items() if backend is self]:
+                del _sqlite_backends[key]
+
+
+# Data folder of the user the current session works on (see tenants.py). Streamlit runs each
+# session's reruns in its own thread, which has its own value
+_data_dir = contextvars.ContextVar("data_dir", default=DATA_DIR)
+
+def use_data_dir(data_dir):
+    _data_dir.set(data_dir)
+
+def current_data_dir():
+    return _data_dir.get()
+
+# One SQLite backend per database, process and thread, so the many get_backend() calls of a rerun
+# share one connection. The backends of threads that have ended are closed when the next one is
+# opened, the others when the process exits. close() on a backend makes the next call open a new one
+_sqlite_lock = threading.Lock()
+_sqlite_backends = {}  # (database path, pid, thread id) -> SqliteBackend
+
+def sqlite_backend(db_path):
+    key = (os.path.abspath(db_path), os.getpid(), threading.get_ident())
+    with _sqlite_lock:
+        backend = _sqlite_backends.get(key)
+    if backend is not None:
+        return backend
+    backend = SqliteBackend(db_path)
+    with _sqlite_lock:
+        alive = {thread.ident for thread in threading.enumerate()}
+        for ended in [other for other in _sqlite_backends if other[1] == os.getpid() and other[2] not in alive]:
+            _sqlite_backends.pop(ended).connection.close()
+        _sqlite_backends[key] = backend
+    return backend
+
+@atexit.register
+def close_backends():
+    with _sqlite_lock:
+        backends = [backend for key, backend in _sqlite_backends.items() if key[1] == os.getpid()]
+        _sqlite_backends.clear()
+    for backend in backends:
+        backend.connection.close()
+
+# Pick the backend from the environment, JSON files unless "sqlite" is asked for. Without a data
+# folder it is the current session's
+def get_backend(data_dir=None):
+    data_dir = data_dir or current_data_dir()
+    if os.environ.get(BACKEND_ENV, "json").lower() == "sqlite":
+        return sqlite_backend(os.path.join(data_dir, SQLITE_NAME))
+    return JsonBackend(data_dir)
+
+
+# Copy everything in the JSON files into the SQLite database, running it again gives the same result.
+# The category registry goes first so the expenses keep their category ids
+def migrate_json_to_sqlite(data_dir=DATA_DIR, db_path=None, documents=("savings", "goals", "budget")):
+    source = JsonBackend(data_dir)
+    target = SqliteBackend(db_path or os.path.join(data_dir, SQLITE_NAME))
+    target.save_document(CATEGORIES_DOCUMENT, source.load_registry().to_dict())
+    expenses = source.load_expenses()
+    target.replace_expenses(expenses)
+    for name in documents:
+        data = source.load_document(name, None)
+        if data is not None:
+            target.save_document(name, data)
+    target.close()
+    return len(expenses)
+
+
+# Run "python storage.py migrate" to move the data folder into SQLite
+if __name__ == "__main__":
+    import sys
+    if sys.argv[1:2] == ["migrate"]:
+        count = migrate_json_to_sqlite(*sys.argv[2:3])
+        print(f"Migrated {count} expenses to SQLite. Set {BACKEND_ENV}=sqlite to use it.")
+    else:
+        print("Usage: python storage.py migrate [data_dir]")
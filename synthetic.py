@@ -0,0 +1,114 @@
+# Synthetic data for benchmarks and trying the app with a long history: expenses, categories,
+# savings and goals that look like a real user's, generated with NumPy from a seed so the same
+# options always give the same data
+import os
+import sys
+from datetime import date
+import numpy as np
+import ledger
+import storage
+
+# Category names, the first ones are used most
+CATEGORY_NAMES = [
+    "Food", "Transport", "Entertainment", "Other", "Rent", "Utilities", "Groceries", "Health", "Clothes",
+    "Travel", "Gifts", "Subscriptions", "Education", "Insurance", "Pets", "Home", "Sports", "Restaurants",
+]
+
+# Defaults for the command line options and generate_user
+OPTIONS = {
+    "users": 1, "years": 5, "per_month": 3000, "categories": 12, "savings_events": 200, "goals": 5,
+    "seed": 1, "backend": "json",
+}
+
+
+# Expense dicts spread over the last `years` years up to today. Categories follow a Zipf-like
+# distribution and each has its own typical amount
+def generate_expenses(rng, years, per_month, categories):
+    end = date.today()
+    start = date(end.year - years, end.month, 1)
+    count = years * 12 * per_month
+    days = rng.integers(start.toordinal(), end.toordinal() + 1, size=count)
+    weights = 1.0 / np.arange(1, len(categories) + 1)
+    codes = rng.choice(len(categories), size=count, p=weights / weights.sum())
+    typical = rng.uniform(2.5, 6.0, size=len(categories))  # log of the typical amount per category
+    amounts = np.round(np.exp(rng.normal(typical[codes], 0.6)), 2)
+    ids = rng.integers(1, 2 ** 63 - 1, size=count, dtype=np.int64)
+    order = np.argsort(days, kind="stable")
+    epoch = date(1970, 1, 1).toordinal()
+    dates = (days[order] - epoch).astype("datetime64[D]").astype(str)
+    return [
+        {"id": expense_id, "amount": amount, "category": categories[code], "date": day}
+        for expense_id, amount, code, day in zip(ids[order].tolist(), amounts[order].tolist(), codes[order].tolist(), dates)
+    ]
+
+# The savings document: a ledger of deposits and some withdrawals, a budget per category and
+# what is left of it
+def generate_savings(rng, years, events, categories):
+    end = date.today()
+    days = np.sort(rng.integers(date(end.year - years, end.month, 1).toordinal(), end.toordinal() + 1, size=events))
+    changes = np.round(rng.uniform(50, 2000, size=events) * np.where(rng.random(events) < 0.1, -0.5, 1.0), 2)
+    savings_ledger = ledger.SavingsLedger([date.fromordinal(day).isoformat() for day in days.tolist()], changes.tolist())
+    budget = {category: int(amount) for category, amount in zip(categories, rng.integers(10, 200, size=len(categories)) * 10)}
+    return ledger.with_ledger({"category_budget": budget, "remaining_budget": int(rng.integers(0, 5000))}, savings_ledger)
+
+# Savings and spend-less goals over windows of a few weeks to two years in the last `years` years
+def generate_goals(rng, count, categories, years=5):
+    end = date.today().toordinal()
+    starts = rng.integers(end - years * 365, end + 1, size=count)
+    lengths = rng.integers(14, 730, size=count)
+    kinds = rng.random(count) < 0.5
+    codes = rng.integers(0, len(categories), size=count)
+    targets = rng.integers(10, 500, size=count) * 100
+    goals = []
+    for number in range(count):
+        goal = {
+            "id": int(rng.integers(1, 2 ** 63 - 1)),
+            "name": f"Goal {number + 1}",
+            "type": "save" if kinds[number] else "spend_less",
+            "target": int(targets[number]),
+            "start": date.fromordinal(int(starts[number])).isoformat(),
+            "end": date.fromordinal(int(starts[number] + lengths[number])).isoformat(),
+        }
+        if not kinds[number]:
+            goal["category"] = categories[codes[number]]
+        goals.append(goal)
+    return goals
+
+# Write one user's data folder with the given backend, returns the number of expenses
+def generate_user(data_dir, years=5, per_month=3000, categories=12, savings_events=200, goals=5, seed=1, backend="json"):
+    rng = np.random.default_rng(seed)
+    names = CATEGORY_NAMES[:categories] + [f"Category {number}" for number in range(len(CATEGORY_NAMES), categories)]
+    expenses = generate_expenses(rng, years, per_month, names)
+    os.makedirs(data_dir, exist_ok=True)
+    target = storage.SqliteBackend(os.path.join(data_dir, storage.SQLITE_NAME)) if backend == "sqlite" else storage.JsonBackend(data_dir)
+    target.save_categories(names)
+    target.replace_expenses(expenses)
+    target.write_document("savings", generate_savings(rng, years, savings_events, names))
+    target.write_document("goals", generate_goals(rng, goals, names, years))
+    target.close()
+    return len(expenses)
+
+# One folder per user under out_dir (user-001, user-002, ...), or out_dir itself for a single user
+def generate(out_dir, users=1, seed=1, **options):
+    counts = {}
+    for user in range(users):
+        data_dir = out_dir if users == 1 else os.path.join(out_dir, f"user-{user + 1:03d}")
+        counts[data_dir] = generate_user(data_dir, seed=seed + user, **options)
+    return counts
+
+
+# Run "python synthetic.py OUT_DIR [--users 1] [--years 5] [--per-month 3000] [--categories 12]
+# [--savings-events 200] [--goals 5] [--seed 1] [--backend json|sqlite]"
+if __name__ == "__main__":
+    arguments = sys.argv[1:]
+    if not arguments:
+        print("Usage: python synthetic.py OUT_DIR [--users N] [--years N] [--per-month N] [--categories N] "
+              "[--savings-events N] [--goals N] [--seed N] [--backend json|sqlite]")
+        sys.exit(1)
+    out_dir = arguments.pop(0)
+    options = dict(OPTIONS)
+    while arguments:
+        flag, value = arguments.pop(0).lstrip("-").replace("-", "_"), arguments.pop(0)
+        options[flag] = value if flag == "backend" else int(value)
+    for data_dir, count in generate(out_dir, **options).items():
+        print(f"{data_dir}: {count} expenses")
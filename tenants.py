@@ -0,0 +1,85 @@
+# Several users (households) served by one process, each with their own data folder under
+# data/users/. The user of a session is picked in the sidebar and its folder is the one
+# storage.get_backend() uses for the rest of the rerun. What is loaded for a user (the expenses,
+# aggregates, savings ledger, goals and their progress) stays in the shared cache between reruns,
+# and the users are kept in least recently used order: when the cache holds more than
+# MEMORY_BUDGET, the data of the users not seen for the longest time is dropped from it and read
+# from disk again when they come back
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+import cache
+import storage
+
+# Folder with one data folder per user
+USERS_DIR = os.path.join(storage.DATA_DIR, "users")
+
+# Memory the cached data of all users may use, in MB with EXPENSE_TRACKER_MEMORY_MB
+MEMORY_ENV = "EXPENSE_TRACKER_MEMORY_MB"
+MEMORY_BUDGET = int(os.environ.get(MEMORY_ENV, "512")) * 1024 * 1024
+
+
+# Folder name of a user: lower case letters, digits, "-" and "_", anything else becomes "-"
+def user_key(name):
+    return re.sub(r"[^a-z0-9_-]+", "-", str(name or "").strip().casefold()).strip("-")
+
+# Data folder of a user, created the first time. No user is the shared data folder
+def data_dir(user):
+    key = user_key(user)
+    if not key:
+        return storage.DATA_DIR
+    path = os.path.join(USERS_DIR, key)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def list_users():
+    try:
+        return sorted(name for name in os.listdir(USERS_DIR) if os.path.isdir(os.path.join(USERS_DIR, name)))
+    except FileNotFoundError:
+        return []
+
+
+# Data folders in the order they were last used, the least recently used first
+class UserPool:
+    def __init__(self, memory_budget=MEMORY_BUDGET):
+        self.memory_budget = memory_budget
+        self.lock = threading.Lock()
+        self.folders = OrderedDict()  # data folder -> time it was last used
+        self._stats = {"evictions": 0, "evicted_bytes": 0}
+
+    # Mark a folder as used now, then make room by dropping the coldest folders' data. The
+    # folder in use is never dropped, nor are the user folders nested in the shared one
+    def use(self, folder):
+        folder = os.path.abspath(folder)
+        cache.add_folder(folder)
+        with self.lock:
+            self.folders[folder] = time.time()
+            self.folders.move_to_end(folder)
+            while cache.stats()["bytes"] > self.memory_budget and len(self.folders) > 1:
+                coldest, _ = self.folders.popitem(last=False)
+                self._stats["evictions"] += 1
+                self._stats["evicted_bytes"] += cache.drop_under(coldest)
+
+    def stats(self):
+        with self.lock:
+            return dict(self._stats, resident=len(self.folders), memory_budget=self.memory_budget,
+                        cached_bytes=cache.stats()["bytes"])
+
+pool = UserPool()
+
+# Work on a user's data for the rest of this rerun (or this thread), returns their data folder
+def enter(user):
+    folder = data_dir(user)
+    storage.use_data_dir(folder)
+    pool.use(folder)
+    return folder
+
+
+# Run "python tenants.py" to list the users with their number of expenses
+if __name__ == "__main__":
+    for user in list_users():
+        backend = storage.get_backend(os.path.join(USERS_DIR, user))
+        print(f"{user}: {backend.count_expenses()} expenses")
+        backend.close()
@@ -0,0 +1,63 @@
+# ExpenseDelta: combining deltas and the delta between two lists of expenses
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from delta import ExpenseDelta
+
+
+def expense(expense_id, amount, day="2026-09-01", category="Food"):
+    return {"id": expense_id, "amount": amount, "category": category, "date": day}
+
+
+class CombineTest(unittest.TestCase):
+    def test_insert_then_delete_disappears(self):
+        combined = ExpenseDelta.combine([ExpenseDelta(inserted=[expense(1, 10)]), ExpenseDelta(deleted=[expense(1, 10)])])
+        self.assertFalse(combined)
+
+    def test_insert_then_update_is_one_insert(self):
+        combined = ExpenseDelta.combine([ExpenseDelta(inserted=[expense(1, 10)]), ExpenseDelta(updated=[(expense(1, 10), expense(1, 12))])])
+        self.assertEqual(combined.inserted, [expense(1, 12)])
+        self.assertEqual((combined.updated, combined.deleted), ([], []))
+
+    # The stored version is kept, so running totals take out what was saved
+    def test_two_updates_keep_the_stored_version(self):
+        combined = ExpenseDelta.combine([
+            ExpenseDelta(updated=[(expense(1, 10), expense(1, 12))]),
+            ExpenseDelta(updated=[(expense(1, 12), expense(1, 15, "2026-10-02"))]),
+        ])
+        self.assertEqual(combined.updated, [(expense(1, 10), expense(1, 15, "2026-10-02"))])
+        self.assertEqual(combined.months(), {"2026-09", "2026-10"})
+
+    def test_update_then_delete_deletes_the_stored_version(self):
+        combined = ExpenseDelta.combine([ExpenseDelta(updated=[(expense(1, 10), expense(1, 12))]), ExpenseDelta(deleted=[expense(1, 12)])])
+        self.assertEqual(combined.deleted, [expense(1, 10)])
+        self.assertEqual((combined.inserted, combined.updated), ([], []))
+
+    def test_single_delta_is_returned_as_is(self):
+        delta = ExpenseDelta(inserted=[expense(1, 10)])
+        self.assertIs(ExpenseDelta.combine([delta]), delta)
+
+
+class BetweenTest(unittest.TestCase):
+    def test_inserted_updated_deleted_and_unchanged(self):
+        old = [expense(1, 10), expense(2, 20), expense(3, 30)]
+        new = [expense(1, 10), expense(2, 25), expense(4, 40)]
+        delta = ExpenseDelta.between(old, new)
+        self.assertEqual(delta.inserted, [expense(4, 40)])
+        self.assertEqual(delta.updated, [(expense(2, 20), expense(2, 25))])
+        self.assertEqual(delta.deleted, [expense(3, 30)])
+
+    def test_expense_without_id_gets_one(self):
+        delta = ExpenseDelta.between([], [{"amount": 5, "category": "Food", "date": "2026-09-01"}])
+        self.assertEqual(len(delta.inserted), 1)
+        self.assertIsInstance(delta.inserted[0]["id"], int)
+
+    def test_same_lists_give_an_empty_delta(self):
+        self.assertFalse(ExpenseDelta.between([expense(1, 10)], [expense(1, 10)]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+# SavingsLedger: balances from the checkpoints kept every CHECKPOINT_EVERY entries
+import os
+import sys
+import unittest
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ledger import CHECKPOINT_EVERY, SavingsLedger
+
+
+def day(number):
+    return (date(2026, 1, 1) + timedelta(days=number)).isoformat()
+
+
+class CheckpointTest(unittest.TestCase):
+    def setUp(self):
+        self.count = 3 * CHECKPOINT_EVERY + 5
+        self.ledger = SavingsLedger()
+        for number in range(self.count):
+            self.ledger.add(number + 1, day(number))
+
+    def running(self, upto):
+        return sum(range(1, upto + 1))
+
+    def test_a_checkpoint_every_block(self):
+        self.assertEqual(len(self.ledger.checkpoints), self.count // CHECKPOINT_EVERY + 1)
+        for block, checkpoint in enumerate(self.ledger.checkpoints):
+            self.assertEqual(checkpoint, self.running(block * CHECKPOINT_EVERY))
+        self.assertEqual(self.ledger.total, self.running(self.count))
+
+    # Balances on either side of each checkpoint
+    def test_balance_across_the_boundary(self):
+        for entries in (CHECKPOINT_EVERY - 1, CHECKPOINT_EVERY, CHECKPOINT_EVERY + 1, 2 * CHECKPOINT_EVERY):
+            self.assertEqual(self.ledger.balance_at(day(entries - 1)), self.running(entries))
+            self.assertEqual(self.ledger.balance_before(entries), self.running(entries))
+
+    # An entry dated before a checkpoint moves every later checkpoint
+    def test_back_dated_entry_recomputes_later_checkpoints(self):
+        self.ledger.add(1000, day(10))
+        self.assertEqual(len(self.ledger.checkpoints), (self.count + 1) // CHECKPOINT_EVERY + 1)
+        rebuilt = SavingsLedger(self.ledger.dates, self.ledger.changes)
+        self.assertEqual(self.ledger.checkpoints, rebuilt.checkpoints)
+        self.assertEqual(self.ledger.total, self.running(self.count) + 1000)
+        self.assertEqual(self.ledger.change_between(day(10), day(10)), 11 + 1000)
+
+    def test_appending_the_last_entry_of_a_block_adds_a_checkpoint(self):
+        ledger = SavingsLedger()
+        for number in range(CHECKPOINT_EVERY - 1):
+            ledger.add(1.0, day(number))
+        self.assertEqual(len(ledger.checkpoints), 1)
+        ledger.add(1.0, day(CHECKPOINT_EVERY))
+        self.assertEqual(ledger.checkpoints, [0.0, float(CHECKPOINT_EVERY)])
+
+    def test_saved_and_loaded(self):
+        loaded = SavingsLedger.from_dict(self.ledger.to_dict())
+        self.assertEqual(loaded.checkpoints, self.ledger.checkpoints)
+        self.assertEqual(loaded.history(day(60), day(70)), self.ledger.history(day(60), day(70)))
+
+    # Checkpoints that don't match the entries are computed again
+    def test_loaded_with_wrong_checkpoints(self):
+        data = dict(self.ledger.to_dict(), checkpoints=[0.0])
+        self.assertEqual(SavingsLedger.from_dict(data).checkpoints, self.ledger.checkpoints)
+
+
+if __name__ == "__main__":
+    unittest.main()
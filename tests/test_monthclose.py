@@ -0,0 +1,38 @@
+# Month close together with "Reset Now" on the budget page
+import os
+import sys
+import tempfile
+import unittest
+from datetime import date
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ledger
+import monthclose
+import storage
+
+
+class ResetThenCloseTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.backend = storage.JsonBackend(self.directory.name)
+        budget = {"category_budget": {"Food": 300}, "remaining_budget": 700}
+        self.backend.save_document(ledger.SAVINGS_DOCUMENT, {**budget, "total_savings": 1000, monthclose.BUDGETS: {"2026-09": budget}})
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    # Income moved by a reset isn't moved again when its month is closed
+    def test_reset_income_is_moved_once(self):
+        self.backend.update_document(ledger.SAVINGS_DOCUMENT, {}, lambda savings: monthclose.reset(savings, date(2026, 9, 20)))
+        moved = monthclose.close_months(self.backend, today=date(2026, 10, 18))
+        self.assertEqual(moved, {"2026-09": 300.0})
+        self.assertEqual(self.backend.load_document(ledger.SAVINGS_DOCUMENT, {})["total_savings"], 2000)
+
+    def test_close_without_reset_moves_unallocated_income(self):
+        moved = monthclose.close_months(self.backend, today=date(2026, 10, 18))
+        self.assertEqual(moved, {"2026-09": 1000.0})
+
+
+if __name__ == "__main__":
+    unittest.main()
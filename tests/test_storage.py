@@ -0,0 +1,83 @@
+# JsonBackend.apply_delta on months that have ended (sealed) and on the current month's journal
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cache
+import segments
+import storage
+from delta import ExpenseDelta
+
+SEALED = "2020-01"
+
+
+def expense(expense_id, amount, day, category="Food"):
+    return {"id": expense_id, "amount": amount, "category": category, "date": day}
+
+
+class ApplyDeltaTest(unittest.TestCase):
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.TemporaryDirectory()
+        self.backend = storage.JsonBackend(self.directory.name)
+        self.current = storage.current_month()
+        self.backend.apply_delta(ExpenseDelta(inserted=[expense(1, 10.0, SEALED + "-05"), expense(2, 20.0, SEALED + "-06")]))
+        self.backend.compact()
+
+    def tearDown(self):
+        cache.clear()
+        self.directory.cleanup()
+
+    def path(self, month):
+        return self.backend.partition_path(month)
+
+    def amounts(self):
+        return sorted(expense["amount"] for expense in self.backend.load_expenses())
+
+    def test_inserts_go_to_the_journal(self):
+        self.backend.apply_delta(ExpenseDelta(inserted=[expense(3, 30.0, self.current + "-01")]))
+        self.backend.apply_delta(ExpenseDelta(inserted=[expense(4, 40.0, self.current + "-02")]))
+        self.assertEqual(storage.journal_length(self.path(self.current)), 2)
+        self.assertEqual(storage.load_json(self.path(self.current), []), [])
+        self.assertEqual(self.amounts(), [10.0, 20.0, 30.0, 40.0])
+        self.assertEqual(self.backend.load_manifest()["months"][self.current]["count"], 2)
+
+    # An update rewrites only its month, as a snapshot without a journal
+    def test_update_in_a_journaled_month_compacts_it(self):
+        self.backend.apply_delta(ExpenseDelta(inserted=[expense(3, 30.0, self.current + "-01")]))
+        sealed_before = os.stat(self.path(SEALED)).st_mtime_ns
+        self.backend.apply_delta(ExpenseDelta(updated=[(expense(3, 30.0, self.current + "-01"), expense(3, 33.0, self.current + "-01"))]))
+        self.assertEqual(storage.journal_length(self.path(self.current)), 0)
+        self.assertEqual(len(storage.load_json(self.path(self.current), [])), 1)
+        self.assertEqual(os.stat(self.path(SEALED)).st_mtime_ns, sealed_before)
+        self.assertEqual(self.amounts(), [10.0, 20.0, 33.0])
+
+    # The sealed month is rewritten and its binary segment follows the new JSON file
+    def test_update_in_a_sealed_month(self):
+        self.assertEqual(self.backend.load_segment(SEALED)["cents"].tolist(), [1000, 2000])
+        self.backend.apply_delta(ExpenseDelta(updated=[(expense(1, 10.0, SEALED + "-05"), expense(1, 15.0, SEALED + "-05"))]))
+        self.assertFalse(os.path.exists(storage.journal_path(self.path(SEALED))))
+        self.assertEqual(self.backend.load_segment(SEALED)["cents"].tolist(), [1500, 2000])
+        self.assertEqual(self.backend.load_columns().amounts.tolist(), [15.0, 20.0])
+
+    # Moving an expense to another month takes it out of the old one
+    def test_update_moving_an_expense_between_months(self):
+        self.backend.apply_delta(ExpenseDelta(updated=[(expense(1, 10.0, SEALED + "-05"), expense(1, 10.0, self.current + "-03"))]))
+        months = self.backend.load_manifest()["months"]
+        self.assertEqual((months[SEALED]["count"], months[self.current]["count"]), (1, 1))
+        self.assertEqual([expense["id"] for expense in self.backend.load_expenses(end=SEALED + "-31")], [2])
+
+    def test_deleting_a_whole_sealed_month_removes_it(self):
+        self.backend.load_segment(SEALED)
+        self.backend.apply_delta(ExpenseDelta(deleted=[expense(1, 10.0, SEALED + "-05"), expense(2, 20.0, SEALED + "-06")]))
+        self.assertNotIn(SEALED, self.backend.load_manifest()["months"])
+        self.assertFalse(os.path.exists(self.path(SEALED)))
+        self.assertFalse(os.path.exists(segments.segment_path(self.path(SEALED))))
+        self.assertEqual(self.backend.load_expenses(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+# Dropping the coldest data folders when the cache is over its memory budget
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cache
+import ledger
+import storage
+import tenants
+
+
+class UserPoolTest(unittest.TestCase):
+    def setUp(self):
+        cache.clear()
+        self.shared = os.path.abspath("data")
+        self.user = os.path.join(self.shared, "users", "anna")
+
+    def tearDown(self):
+        cache.clear()
+
+    def file_key(self, folder):
+        return ("json", os.path.join(folder, "savings.json"))
+
+    # The shared folder is a prefix of every user folder, evicting it keeps the active user's data
+    def test_evicting_shared_folder_keeps_active_user(self):
+        pool = tenants.UserPool(memory_budget=0)
+        pool.use(self.shared)
+        cache.put(self.file_key(self.shared), 1, {"total_savings": 1})
+        cache.put(self.file_key(self.user), 1, {"total_savings": 2})
+        pool.use(self.user)
+        self.assertIsNone(cache.peek(self.file_key(self.shared), 1))
+        self.assertEqual(cache.peek(self.file_key(self.user), 1), {"total_savings": 2})
+        self.assertEqual(pool.stats()["evictions"], 1)
+
+
+class WriteLockTest(unittest.TestCase):
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        cache.clear()
+        self.directory.cleanup()
+
+    # The first write to a folder, or a commit from another process, only drops that folder's data
+    def test_write_to_one_user_keeps_other_users_cached(self):
+        first = storage.JsonBackend(os.path.join(self.directory.name, "users", "a"))
+        second = storage.JsonBackend(os.path.join(self.directory.name, "users", "b"))
+        first.load_document(ledger.SAVINGS_DOCUMENT, {})
+        entries = cache.stats()["entries"]
+        ledger.deposit(1.0, backend=second)
+        self.assertGreater(cache.stats()["entries"], entries)
+        with open(second.lock_path(), "w") as file:
+            file.write("1000")  # Another process committed
+        ledger.deposit(1.0, backend=second)
+        key = ("json", os.path.abspath(first.document_path(ledger.SAVINGS_DOCUMENT)))
+        self.assertIn(key, cache._entries)
+
+
+if __name__ == "__main__":
+    unittest.main()
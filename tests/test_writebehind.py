@@ -0,0 +1,91 @@
+# Write-behind queue: its thread, the replay log and writing queued changes
+import atexit
+import os
+import json
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cache
+import ledger
+import storage
+import writebehind
+
+
+class StartTest(unittest.TestCase):
+    # The app calls start() on every rerun, only the first one registers the exit handler
+    def test_start_twice_registers_one_handler(self):
+        queue = writebehind.WriteBehindQueue()
+        with mock.patch.object(writebehind, "queue", queue), mock.patch.object(atexit, "register") as register:
+            try:
+                writebehind.start()
+                writebehind.start()
+            finally:
+                writebehind.stop()
+        self.assertEqual(register.call_count, 1)
+
+class ReplayTest(unittest.TestCase):
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.mkdtemp()
+        self.backend = storage.JsonBackend(self.directory)
+        self.changes = [
+            {"operation": "insert_expenses", "arguments": {"expenses": [{"id": 1, "amount": 12.5, "category": "Food", "date": "2026-09-03"}]}},
+            {"operation": "deposit", "arguments": {"amount": 100.0, "day": "2026-09-04", "token": "first"}},
+            {"operation": "insert_expenses", "arguments": {"expenses": [{"id": 2, "amount": 7.5, "category": "Bus", "date": "2026-09-05"}]}},
+            {"operation": "deposit", "arguments": {"amount": 50.0, "day": "2026-09-06", "token": "second"}},
+        ]
+
+    def tearDown(self):
+        cache.clear()
+        shutil.rmtree(self.directory)
+
+    # A log left by a process that has died, 2**22 + 1 is above any pid Linux hands out
+    # and old enough to count as left over on Windows
+    def write_log(self, changes, pid=2 ** 22 + 1):
+        path = writebehind.log_path(self.directory, pid)
+        with open(path, "w") as file:
+            file.write("".join(json.dumps(change) + "\n" for change in changes))
+        stale = time.time() - 2 * writebehind.STALE_SECONDS
+        os.utime(path, (stale, stale))
+
+    def state(self):
+        expenses = sorted((expense["id"], expense["amount"]) for expense in self.backend.load_expenses())
+        return expenses, self.backend.load_document(ledger.SAVINGS_DOCUMENT, {}).get("total_savings")
+
+    # The process died after writing the first two changes, the replay writes only the rest
+    def test_replay_after_a_crash_writes_each_change_once(self):
+        writebehind.apply_changes(self.backend, self.changes[:2])
+        self.write_log(self.changes)
+        writebehind.WriteBehindQueue().flush(self.directory)
+        self.assertEqual(self.state(), ([(1, 12.5), (2, 7.5)], 150.0))
+        self.assertEqual([name for name in os.listdir(self.directory) if name.endswith(writebehind.LOG_SUFFIX)], [])
+
+    # The replay itself died before removing the log, the next one changes nothing
+    def test_replaying_the_same_log_twice(self):
+        self.write_log(self.changes)
+        writebehind.WriteBehindQueue().flush(self.directory)
+        first = self.state()
+        self.write_log(self.changes)
+        writebehind.WriteBehindQueue().flush(self.directory)
+        self.assertEqual(self.state(), first)
+        self.assertEqual(self.backend.count_expenses(), 2)
+
+    # A line torn by the crash is left out, the changes before it are written
+    def test_torn_last_line(self):
+        self.write_log(self.changes[:2])
+        path = writebehind.log_path(self.directory, 2 ** 22 + 1)
+        with open(path, "a") as file:
+            file.write(json.dumps(self.changes[2])[:20])
+        os.utime(path, (time.time() - 2 * writebehind.STALE_SECONDS,) * 2)
+        writebehind.WriteBehindQueue().flush(self.directory)
+        self.assertEqual(self.state(), ([(1, 12.5)], 100.0))
+
+
+if __name__ == "__main__":
+    unittest.main()
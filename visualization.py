@@ -1,22 +1,16 @@
 # Visualize our spending, savings, and goals
 import streamlit as st
 import pandas as pd
-import matplotlib.pyplot as plt
-import json
+import charts
+import ledger
+import instrument
+import reports
+import storage
+from aggregates import load_aggregates
 from datetime import datetime
-EXPENSES_FILE = "data/expenses.json"
-SAVINGS_FILE = "data/savings.json"
-GOALS_FILE = "data/goals.json"
-
-# Load data from JSON or return a default
-def load_data(file_path, default):
-    try:
-        with open(file_path, "r") as file:
-            return json.load(file)
-    except (FileNotFoundError, json.JSONDecodeError):
-        return default
 
 # Main visualizations page
+@instrument.timed()
 def display_visualizations():
     st.title("📊 Visualizations")
     st.write("Explore your spending and savings trends with these visuals.")
@@ -32,20 +26,23 @@ def display_visualizations():
         insights_visualizations()
 
 # Spending Visualizations
+@instrument.timed()
 def spending_visualizations():
     st.subheader("💸 Spending Overview")
 
-    # Load data
-    expenses = load_data(EXPENSES_FILE, [])
-    savings = load_data(SAVINGS_FILE, {"category_budget": {}})
+    # Load data, the budget is compared with this month's spending
+    backend = storage.get_backend()
+    savings = backend.load_document("savings", {"category_budget": {}})
     category_budget = savings.get("category_budget", {})
+    totals = load_aggregates(backend)
+    month = storage.current_month()
 
     # Total expenses and budget
-    total_expenses = sum(exp["amount"] for exp in expenses)
+    total_expenses = totals.month_total(month)
     total_budget = sum(category_budget.values())
 
     # Progress bar: Expenses vs Budget
-    st.write("### Total Expenses vs Budget")
+    st.write("### Expenses this month vs Budget")
     if total_budget > 0:
         progress = min(total_expenses / total_budget, 1.0)
         st.write(f"**Spent:** {total_expenses} / **Budget:** {total_budget}")
@@ -58,68 +55,69 @@ def spending_visualizations():
         st.info("No budget set yet. Add a budget to start tracking.")
 
     # Bar chart: Spending by Category
-    st.write("### Spending by Category")
-    category_expenses = pd.DataFrame(expenses).groupby("category")["amount"].sum().to_dict()
-    categories = list(category_budget.keys())
-    allocated = [category_budget.get(cat, 0) for cat in categories]
-    spent = [category_expenses.get(cat, 0) for cat in categories]
-
-    fig, ax = plt.subplots()
-    ax.bar(categories, allocated, label="Budget Allocated", alpha=0.7, color="#a3c1ad")
-    ax.bar(categories, spent, label="Amount Spent", alpha=0.7, color="#f77670")
+    st.write("### Spending by Category this month")
+    rows = reports.budget_vs_actual(savings, totals.month_totals_by_category(month))
+    data = {"categories": [row["category"] for row in rows], "allocated": [row["budget"] for row in rows], "spent": [row["spent"] for row in rows]}
+
+    charts.show("spending_by_category", data, draw_spending_by_category)
+
+# Bars of the budget and the amount spent per category, drawn by charts.show
+def draw_spending_by_category(figure, data):
+    ax = figure.subplots()
+    ax.bar(data["categories"], data["allocated"], label="Budget Allocated", alpha=0.7, color="#a3c1ad")
+    ax.bar(data["categories"], data["spent"], label="Amount Spent", alpha=0.7, color="#f77670")
     ax.legend()
-    st.pyplot(fig)
 
 # Savings Visualizations
+@instrument.timed()
 def savings_visualizations():
     st.subheader("🏦 Savings Overview")
 
     # Load data
-    savings = load_data(SAVINGS_FILE, {"total_savings": 0, "history": []})
+    savings = storage.get_backend().load_document("savings", {"total_savings": 0})
     total_savings = savings.get("total_savings", 0)
 
     # Line chart: Savings Over Time
     st.write("### Savings Over Time")
-    savings_history = savings.get("history", [])
+    savings_history = ledger.ledger_of(savings).history()
     if savings_history:
-        dates = [entry["date"] for entry in savings_history]
-        amounts = [entry["amount"] for entry in savings_history]
+        dates, amounts = charts.downsample([day for day, _ in savings_history], [amount for _, amount in savings_history])
         st.line_chart(pd.DataFrame({"Date": dates, "Savings": amounts}).set_index("Date"))
     else:
         st.info("No savings history yet. Start saving to see trends!")
 
 # Insights Visualizations
+@instrument.timed()
 def insights_visualizations():
     st.subheader("🔍 Key Insights")
 
     # Load data
-    expenses = load_data(EXPENSES_FILE, [])
-    savings = load_data(SAVINGS_FILE, {"total_savings": 0})
-    category_budget = savings.get("category_budget", {})
+    backend = storage.get_backend()
+    savings = backend.load_document("savings", {"total_savings": 0})
 
-    # Overspending Alerts
+    # Overspending Alerts, for the current month's budget
     st.write("### Overspending Alerts")
-    category_expenses = pd.DataFrame(expenses).groupby("category")["amount"].sum().to_dict()
-    for category, allocated in category_budget.items():
-        spent = category_expenses.get(category, 0)
-        if spent > allocated:
-            st.error(f"You're overspending in **{category}** by {spent - allocated}.")
-        elif spent == allocated:
-            st.warning(f"**{category}** budget fully utilized.")
+    totals = load_aggregates(backend)
+    for row in reports.budget_vs_actual(savings, totals.month_totals_by_category(storage.current_month())):
+        if row["status"] == reports.OVER:
+            st.error(f"You're overspending in **{row['category']}** by {row['spent'] - row['budget']}.")
+        elif row["status"] == reports.USED:
+            st.warning(f"**{row['category']}** budget fully utilized.")
         else:
-            st.success(f"**{category}**: Within budget with {allocated - spent} remaining.")
+            st.success(f"**{row['category']}**: Within budget with {row['left']} remaining.")
 
     # Savings vs Expenses Comparison
     st.write("### Savings vs Expenses")
-    total_expenses = sum(exp["amount"] for exp in expenses)
+    total_expenses = totals.total
     total_savings = savings.get("total_savings", 0)
 
-    labels = ["Savings", "Expenses"]
-    values = [total_savings, total_expenses]
-    fig, ax = plt.subplots()
-    ax.pie(values, labels=labels, autopct="%1.1f%%", startangle=90, colors=["#8fd694", "#f77670"])
+    charts.show("savings_vs_expenses", {"labels": ["Savings", "Expenses"], "values": [total_savings, total_expenses]}, draw_savings_vs_expenses)
+
+# Pie of savings against expenses, drawn by charts.show
+def draw_savings_vs_expenses(figure, data):
+    ax = figure.subplots()
+    ax.pie(data["values"], labels=data["labels"], autopct="%1.1f%%", startangle=90, colors=["#8fd694", "#f77670"])
     ax.axis("equal")
-    st.pyplot(fig)
 
 # Run visualizations
 if __name__ == "__main__":
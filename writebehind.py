@@ -0,0 +1,261 @@
+# Write-behind queue for the forms' saves. Once start() has been called (the app does it) a save
+# is written to a replay log and queued, and the page goes on straight away. A background thread
+# takes everything queued, puts runs of the same kind of change for the same data folder together
+# (ten queued expenses become one commit) and writes them through the usual storage path. Until a
+# change is saved it stays in the replay log, one per data folder and process, which is read back
+# the next time the folder is used if the process died first. Without start() every change is
+# written before submit() returns, as before
+import atexit
+import importlib
+import json
+import os
+import threading
+import time
+from collections import deque
+import instrument
+import storage
+
+# Kind of change -> (module, function writing a list of them in one go). The function is called
+# with the backend and the arguments of every queued change of that kind, in the order they were
+# made, and must give the same result when some of them were already written
+OPERATIONS = {
+    "add_categories": ("expenses", "add_categories"),
+    "insert_expenses": ("expenses", "insert_expenses"),
+    "deposit": ("ledger", "add_deposits"),
+    "set_budget": ("budget", "save_budgets"),
+}
+
+# Changes waiting at most, a save waits for room beyond this
+MAX_PENDING = 1000
+
+# Replay logs are named after the process writing them
+LOG_PREFIX = "write-behind-"
+LOG_SUFFIX = ".log"
+
+# On Windows a process can't be asked whether it is alive, a log untouched this long is left over
+STALE_SECONDS = 60
+
+
+def log_path(data_dir, pid=None):
+    return os.path.join(data_dir, f"{LOG_PREFIX}{pid or os.getpid()}{LOG_SUFFIX}")
+
+def process_alive(pid, path):
+    if os.name == "nt":
+        return time.time() - os.path.getmtime(path) < STALE_SECONDS
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+# Write runs of changes: consecutive changes of the same kind are written in one call
+def apply_changes(backend, changes):
+    run = []
+    for change in changes + [None]:
+        if run and (change is None or change["operation"] != run[0]["operation"]):
+            module_name, function_name = OPERATIONS[run[0]["operation"]]
+            with instrument.span("write-behind " + run[0]["operation"]):
+                getattr(importlib.import_module(module_name), function_name)(backend, [item["arguments"] for item in run])
+            run = []
+        if change is not None:
+            run.append(change)
+
+# Write changes to a data folder through a backend of its own, closed afterwards
+def write_to(data_dir, changes):
+    backend = storage.get_backend(data_dir)
+    try:
+        apply_changes(backend, changes)
+    finally:
+        backend.close()
+
+# Records of a replay log, a torn last line from a crash mid-write is left out
+def read_log(path):
+    changes = []
+    with open(path) as file:
+        for line in file:
+            try:
+                changes.append(json.loads(line))
+            except json.JSONDecodeError:
+                break
+    return changes
+
+
+class WriteBehindQueue:
+    def __init__(self, max_pending=MAX_PENDING):
+        self.max_pending = max_pending
+        self.condition = threading.Condition()
+        self.pending = deque()  # (data folder, sequence number, change) in the order they were made
+        self.sequence = 0
+        self.submitted = {}  # data folder -> sequence number of its last queued change
+        self.saved = {}  # data folder -> sequence number of its last written change
+        self.errors = {}  # data folder -> errors not reported by flush() yet
+        self.failed = set()  # Folders with a failed write, their log is kept and written again with the next batch
+        self.replayed = set()
+        self.thread = None
+        self.running = False
+        self._stats = {"submitted": 0, "written": 0, "batches": 0, "largest_batch": 0, "full_waits": 0, "replayed": 0, "errors": 0}
+
+    # Write the changes of processes that died before saving them, the first time a folder is used.
+    # A log with this process's id was left by an earlier process that had the same id. The folder's
+    # write lock is held throughout, so live writes from other sessions wait for the replay
+    def replay(self, data_dir):
+        if data_dir in self.replayed:
+            return
+        self.replayed.add(data_dir)
+        try:
+            names = os.listdir(data_dir)
+        except FileNotFoundError:
+            return
+        with storage.get_backend(data_dir).writer().exclusive():
+            for name in sorted(names):
+                if not (name.startswith(LOG_PREFIX) and name.endswith(LOG_SUFFIX)):
+                    continue
+                path = os.path.join(data_dir, name)
+                pid = name[len(LOG_PREFIX):-len(LOG_SUFFIX)]
+                if not pid.isdigit() or (int(pid) != os.getpid() and process_alive(int(pid), path)):
+                    continue
+                changes = read_log(path)
+                if changes:
+                    write_to(data_dir, changes)
+                    self._stats["replayed"] += len(changes)
+                os.remove(path)
+        with self.condition:
+            self.failed.discard(data_dir)
+
+    # Start the thread unless it runs already. Whatever is still queued is written when the process exits
+    def start(self):
+        with self.condition:
+            if self.running:
+                return
+            self.running = True
+            self.thread = threading.Thread(target=self.run, name="write-behind", daemon=True)
+            self.thread.start()
+        atexit.unregister(self.stop)
+        atexit.register(self.stop)
+
+    # Write everything still queued and stop the thread, later changes are written straight away
+    def stop(self):
+        with self.condition:
+            if not self.running:
+                return
+            self.running = False
+            self.condition.notify_all()
+        self.thread.join()
+
+    def started(self):
+        return self.running
+
+    # Queue a change to a data folder, or write it now when the queue isn't running
+    def submit(self, data_dir, operation, arguments, backend=None):
+        self.replay(data_dir)
+        change = {"operation": operation, "arguments": arguments}
+        if not self.running:
+            if backend is None:
+                write_to(data_dir, [change])
+            else:
+                apply_changes(backend, [change])
+            return
+        line = json.dumps(change) + "\n"
+        with self.condition:
+            while len(self.pending) >= self.max_pending and self.running:
+                self._stats["full_waits"] += 1
+                self.condition.wait()
+            with open(log_path(data_dir), "a") as file:
+                file.write(line)
+                file.flush()
+                os.fsync(file.fileno())
+            self.sequence += 1
+            self.submitted[data_dir] = self.sequence
+            self.pending.append((data_dir, self.sequence, change))
+            self._stats["submitted"] += 1
+            self.condition.notify_all()
+
+    # Wait until everything queued for a folder (all folders without one) is written. Returns the
+    # errors of failed writes since the last flush, their changes stay in the log for a replay
+    def flush(self, data_dir=None, timeout=None):
+        if data_dir is not None:
+            self.replay(data_dir)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            targets = dict(self.submitted) if data_dir is None else {data_dir: self.submitted.get(data_dir, 0)}
+            while self.running and any(self.saved.get(folder, 0) < sequence for folder, sequence in targets.items()):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            errors = []
+            for folder in targets:
+                errors.extend(self.errors.pop(folder, []))
+            return errors
+
+    # Take everything queued, write it folder by folder and drop each folder's log once nothing
+    # more is waiting for it
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending and self.running:
+                    self.condition.wait()
+                if not self.pending:
+                    return
+                batch = list(self.pending)
+                self.pending.clear()
+                self._stats["batches"] += 1
+                self._stats["largest_batch"] = max(self._stats["largest_batch"], len(batch))
+                self.condition.notify_all()
+            by_folder = {}
+            for data_dir, sequence, change in batch:
+                by_folder.setdefault(data_dir, []).append((sequence, change))
+            for data_dir, changes in by_folder.items():
+                with self.condition:
+                    retry = data_dir in self.failed
+                try:
+                    # After a failed write the log still holds its changes, they are written again
+                    # with these. Writing a change twice gives the same result
+                    write_to(data_dir, read_log(log_path(data_dir)) if retry else [change for _, change in changes])
+                except Exception as error:
+                    with self.condition:
+                        self.errors.setdefault(data_dir, []).append(error)
+                        self.failed.add(data_dir)
+                        self._stats["errors"] += 1
+                else:
+                    with self.condition:
+                        self.failed.discard(data_dir)
+                with self.condition:
+                    self.saved[data_dir] = changes[-1][0]
+                    self._stats["written"] += len(changes)
+                    if self.saved[data_dir] == self.submitted[data_dir] and data_dir not in self.failed:
+                        try:
+                            os.remove(log_path(data_dir))
+                        except FileNotFoundError:
+                            pass
+                    self.condition.notify_all()
+
+    def stats(self):
+        with self.condition:
+            return dict(self._stats, pending=len(self.pending), running=self.running)
+
+
+queue = WriteBehindQueue()
+
+# Module-level shortcuts for the one queue of the process
+def start():
+    queue.start()
+
+def stop():
+    queue.stop()
+
+def started():
+    return queue.started()
+
+# Save a change to the current session's data folder, or the given backend's
+def submit(operation, arguments, backend=None):
+    data_dir = storage.current_data_dir() if backend is None else backend.data_dir
+    queue.submit(data_dir, operation, arguments, backend)
+
+def flush(data_dir=None, timeout=None):
+    return queue.flush(data_dir, timeout)
+
+def stats():
+    return queue.stats()
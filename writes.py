@@ -0,0 +1,229 @@
+# Serialized, batched writes to the data folder, safe for many sessions and processes at once.
+# Writers queue their change, the first one to find no commit running becomes the leader and
+# commits everything queued so far: one file lock, one read and one write per file for the group.
+# Readers never wait, files are replaced by atomic renames so they always see a whole file
+import os
+import threading
+import time
+from contextlib import contextmanager
+import cache
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+# Raised when a write was based on a version that another writer has changed since
+class WriteConflict(Exception):
+    pass
+
+
+# Exclusive lock on a file, held across processes. Not reentrant: the coordinator makes
+# sure one thread per process holds it at a time. The file holds a generation number that
+# every commit increases, so a process can tell whether another one wrote in the meantime
+class FileLock:
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        open(self.path, "a").close()
+        self.file = open(self.path, "r+")
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+        else:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_LOCK, 1)
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            if fcntl is not None:
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+            else:
+                self.file.seek(0)
+                msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self.file.close()
+            self.file = None
+
+    # The generation without taking the lock, 0 before the first commit
+    def peek_generation(self):
+        try:
+            with open(self.path) as file:
+                text = file.read().strip()
+        except FileNotFoundError:
+            return 0
+        return int(text) if text.isdigit() else 0
+
+    def read_generation(self):
+        self.file.seek(0)
+        text = self.file.read().strip()
+        return int(text) if text.isdigit() else 0
+
+    def write_generation(self, generation):
+        self.file.seek(0)
+        self.file.write(str(generation))
+        self.file.truncate()
+        self.file.flush()
+
+
+# Something writes go to: load() reads the current state under the lock, save(state) writes it
+# back and version() identifies what was read, for optimistic checks
+class WriteTarget:
+    def __init__(self, load, save, version=None):
+        self.load = load
+        self.save = save
+        self.version = version or (lambda: None)
+
+
+# One queued change. change(state, version) returns the new state, version is the one read
+# under the lock, or None when an earlier change in the same group already changed the state
+class PendingWrite:
+    def __init__(self, key, target, change):
+        self.key = key
+        self.target = target
+        self.change = change
+        self.done = False
+        self.value = None
+        self.error = None
+
+    def outcome(self):
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class WriteCoordinator:
+    def __init__(self, lock_path):
+        self.file_lock = FileLock(lock_path)
+        self.condition = threading.Condition()
+        self.pending = []
+        self.committing = False
+        self.owner = None  # Thread holding the lock, which may nest exclusive() blocks
+        self.generation = self.file_lock.peek_generation()  # Last generation this process wrote or saw
+        self._stats = {"writes": 0, "commits": 0, "groups": 0, "conflicts": 0, "largest_group": 0, "lock_seconds": 0.0}
+
+    # Queue a change to the target stored under key and wait until it is committed, returns
+    # the state right after this change
+    def submit(self, key, target, change):
+        write = PendingWrite(key, target, change)
+        # Inside an exclusive block or a commit the lock is already held, the change is committed on its own
+        if self.owner == threading.get_ident():
+            self.commit([write])
+            return write.outcome()
+        with self.condition:
+            self.pending.append(write)
+            while not write.done and self.committing:
+                self.condition.wait()
+            if write.done:
+                return write.outcome()
+            self.committing = True
+            batch, self.pending = self.pending, []
+        try:
+            started = time.perf_counter()
+            with self.locked():
+                self.commit(batch)
+            self._stats["lock_seconds"] += time.perf_counter() - started
+        finally:
+            with self.condition:
+                for pending in batch:
+                    pending.done = True
+                self.committing = False
+                self.condition.notify_all()
+        return write.outcome()
+
+    # Hold the file lock. The cache checks file sizes and times, which can miss a write by another
+    # process within the same clock tick, so when another process has committed since our last
+    # commit what is cached from this data folder is dropped before reading under the lock
+    @contextmanager
+    def locked(self):
+        with self.file_lock:
+            self.owner = threading.get_ident()
+            try:
+                generation = self.file_lock.read_generation()
+                if generation != self.generation:
+                    cache.drop_under(os.path.dirname(os.path.abspath(self.file_lock.path)))
+                yield
+                self.generation = generation + 1
+                self.file_lock.write_generation(self.generation)
+            finally:
+                self.owner = None
+
+    # Apply every queued change in order, each target is loaded and saved once
+    def commit(self, batch):
+        groups = {}
+        for write in batch:
+            groups.setdefault(write.key, []).append(write)
+        for writes in groups.values():
+            target = writes[0].target
+            applied = []
+            try:
+                state, version = target.load(), target.version()
+            except Exception as error:
+                for write in writes:
+                    write.error = error
+                continue
+            for write in writes:
+                try:
+                    state = write.change(state, None if applied else version)
+                except WriteConflict as error:
+                    self._stats["conflicts"] += 1
+                    write.error = error
+                except Exception as error:
+                    write.error = error
+                else:
+                    write.value = state
+                    applied.append(write)
+            if not applied:
+                continue
+            try:
+                target.save(state)
+            except Exception as error:
+                for write in applied:
+                    write.error = error
+                continue
+            self._stats["commits"] += 1
+        self._stats["writes"] += len(batch)
+        self._stats["groups"] += 1
+        self._stats["largest_group"] = max(self._stats["largest_group"], len(batch))
+
+    # Run a block with the lock held and no group committing, for maintenance such as compaction.
+    # Inside a commit or another exclusive block the lock is already held and the block just runs
+    @contextmanager
+    def exclusive(self):
+        if self.owner == threading.get_ident():
+            yield
+            return
+        with self.condition:
+            while self.committing:
+                self.condition.wait()
+            self.committing = True
+        try:
+            with self.locked():
+                yield
+        finally:
+            with self.condition:
+                self.committing = False
+                self.condition.notify_all()
+
+    def stats(self):
+        with self.condition:
+            stats = dict(self._stats)
+        stats["writes_per_group"] = stats["writes"] / stats["groups"] if stats["groups"] else 0.0
+        return stats
+
+
+# One coordinator per lock file, shared by every session in the process
+_coordinators = {}
+_coordinators_lock = threading.Lock()
+
+def coordinator(lock_path):
+    lock_path = os.path.abspath(lock_path)
+    with _coordinators_lock:
+        if lock_path not in _coordinators:
+            _coordinators[lock_path] = WriteCoordinator(lock_path)
+        return _coordinators[lock_path]